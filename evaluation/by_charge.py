@@ -1,8 +1,12 @@
 import os
-import json
+import sys
 import re
 from collections import defaultdict
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -12,13 +16,6 @@ def normalize_accusation(acc):
     acc = re.sub(r"[\[\]]", "", acc).strip()
     return acc[:-1] if acc.endswith("罪") else acc
 
-def load_jsonl(file_path):
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            data.append(json.loads(line.strip()))
-    return data
-
 def compute_pr(tp, fp, fn):
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
     recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
@@ -27,12 +24,9 @@ def compute_pr(tp, fp, fn):
 def main():
     print("\U0001f504 正在按罪名分类进行分析...")
 
-    true_data = load_jsonl(test_path)
-    pred_data = load_jsonl(result_path)
-
     label_stats = defaultdict(lambda: {"TP": 0, "FP": 0, "FN": 0, "count": 0})
 
-    for true_item, pred_item in zip(true_data, pred_data):
+    for true_item, pred_item in zip(iter_jsonl(test_path, errors="raise"), iter_jsonl(result_path, errors="raise")):
         true_accs = set(normalize_accusation(a) for a in true_item["meta"].get("accusation", []))
         pred_accs = set(normalize_accusation(a) for a in pred_item["meta"].get("accusation", []))
 
@@ -1,8 +1,12 @@
 import os
-import json
+import sys
 import re
 from collections import defaultdict
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -12,13 +16,6 @@ def normalize_accusation(acc):
     acc = re.sub(r"[\[\]]", "", acc).strip()
     return acc[:-1] if acc.endswith("罪") else acc
 
-def load_jsonl(file_path):
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            data.append(json.loads(line.strip()))
-    return data
-
 def compute_pr(true_list, pred_list):
     TP = FP = FN = 0
     for t, p in zip(true_list, pred_list):
@@ -32,16 +29,13 @@ def compute_pr(true_list, pred_list):
 def main():
     print("\U0001f504 正在分析置标数量...")
 
-    true_data = load_jsonl(test_path)
-    pred_data = load_jsonl(result_path)
-
     buckets = {
         "1-label": [],
         "2-label": [],
         "3+-label": []
     }
 
-    for true_item, pred_item in zip(true_data, pred_data):
+    for true_item, pred_item in zip(iter_jsonl(test_path, errors="raise"), iter_jsonl(result_path, errors="raise")):
         true_acc = set(normalize_accusation(a) for a in true_item["meta"].get("accusation", []))
         pred_acc = set(normalize_accusation(a) for a in pred_item["meta"].get("accusation", []))
 
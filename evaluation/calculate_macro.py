@@ -1,9 +1,14 @@
 import os
-import json
+import sys
 import re
 from collections import defaultdict
+from itertools import zip_longest
 from tqdm import tqdm
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -14,30 +19,18 @@ def normalize_accusation(acc):
     acc = re.sub(r"[\[\]]", "", acc).strip()
     return acc[:-1] if acc.endswith("罪") else acc
 
-def load_jsonl(file_path):
-    """ 加载 jsonl 文件，返回列表 """
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            try:
-                data.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                print(f"⚠️ 无法解析行：{line.strip()}")
-    return data
-
-def compute_macro_precision_recall(true_list, pred_list):
-    stats = defaultdict(lambda: {"TP": 0, "FP": 0, "FN": 0})
-
-    for t, p in zip(true_list, pred_list):
-        for label in p:
-            if label in t:
-                stats[label]["TP"] += 1
-            else:
-                stats[label]["FP"] += 1
-        for label in t:
-            if label not in p:
-                stats[label]["FN"] += 1
+def update_label_stats(stats, t, p):
+    """ 累加单条样本的逐标签 TP / FP / FN（t、p 为真实与预测标签集合） """
+    for label in p:
+        if label in t:
+            stats[label]["TP"] += 1
+        else:
+            stats[label]["FP"] += 1
+    for label in t:
+        if label not in p:
+            stats[label]["FN"] += 1
 
+def compute_macro_precision_recall(stats):
     precision_list, recall_list = [], []
 
     for label, s in stats.items():
@@ -53,22 +46,24 @@ def compute_macro_precision_recall(true_list, pred_list):
 
 def main():
     print("\U0001f504 正在加载数据...")
-    true_data = load_jsonl(test_path)
-    pred_data = load_jsonl(result_path)
-
-    if len(true_data) != len(pred_data):
-        print(f"⚠️ 数据长度不一致：测试集 {len(true_data)} 条，生成结果 {len(pred_data)} 条")
-        return
-
-    # 解析实际值
-    true_accusations = [set(normalize_accusation(a) for a in item["meta"].get("accusation", [])) for item in true_data]
-    pred_accusations = [set(normalize_accusation(a) for a in item["meta"].get("accusation", [])) for item in pred_data]
+    # 流式读取，只累计逐标签计数（内存与样本数无关）
+    accusation_stats = defaultdict(lambda: {"TP": 0, "FP": 0, "FN": 0})
+    article_stats = defaultdict(lambda: {"TP": 0, "FP": 0, "FN": 0})
+    for count, (true_item, pred_item) in enumerate(zip_longest(iter_jsonl(test_path), iter_jsonl(result_path))):
+        if true_item is None or pred_item is None:
+            shorter = "测试集" if true_item is None else "生成结果"
+            print(f"⚠️ 数据长度不一致：{shorter}只有 {count} 条")
+            return
 
-    true_articles = [set(item["meta"].get("relevant_articles", [])) for item in true_data]
-    pred_articles = [set(item["meta"].get("relevant_articles", [])) for item in pred_data]
+        update_label_stats(accusation_stats,
+                           set(normalize_accusation(a) for a in true_item["meta"].get("accusation", [])),
+                           set(normalize_accusation(a) for a in pred_item["meta"].get("accusation", [])))
+        update_label_stats(article_stats,
+                           set(true_item["meta"].get("relevant_articles", [])),
+                           set(pred_item["meta"].get("relevant_articles", [])))
 
-    acc_p, acc_r = compute_macro_precision_recall(true_accusations, pred_accusations)
-    art_p, art_r = compute_macro_precision_recall(true_articles, pred_articles)
+    acc_p, acc_r = compute_macro_precision_recall(accusation_stats)
+    art_p, art_r = compute_macro_precision_recall(article_stats)
 
     print("\n📊 Macro 平均指标：")
     print(f"【罪名 - Precision】: {acc_p:.4f}")
@@ -1,9 +1,14 @@
 import os
-import json
+import sys
 import re
 from collections import defaultdict
+from itertools import zip_longest
 from tqdm import tqdm
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -15,18 +20,11 @@ def normalize_accusation(acc):
     acc = re.sub(r"[\[\]]", "", acc).strip()
     return acc[:-1] if acc.endswith("罪") else acc
 
-def load_jsonl(file_path):
-    """ 加载 jsonl 文件，返回列表 """
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            try:
-                data.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                print(f"⚠️ 无法解析行：{line.strip()}")
-    return data
-
 def calculate_metrics(true_data, pred_data):
+    """
+    逐条累计 TP / FP / FN，true_data / pred_data 可以是列表或流式迭代器（如 iter_jsonl）。
+    两者条数不一致时抛出 ValueError。
+    """
     metrics = {
         "accusation": {"TP": 0, "FP": 0, "FN": 0},
         "relevant_articles": {"TP": 0, "FP": 0, "FN": 0}
@@ -34,7 +32,11 @@ def calculate_metrics(true_data, pred_data):
 
     skipped = 0  # 跳过空预测样本计数
 
-    for true_item, pred_item in zip(true_data, pred_data):
+    for count, (true_item, pred_item) in enumerate(zip_longest(true_data, pred_data)):
+        if true_item is None or pred_item is None:
+            shorter = "测试集" if true_item is None else "生成结果"
+            raise ValueError(f"数据长度不一致：{shorter}只有 {count} 条")
+
         true_meta = true_item.get("meta", {})
         pred_meta = pred_item.get("meta", {})
 
@@ -77,19 +79,14 @@ def compute_precision_recall(tp, fp, fn):
     return precision, recall
 
 def main():
-    # 加载数据
+    # 流式读取数据并计算指标（条数不一致时不输出指标）
     print("🔄 正在加载数据...")
-    true_data = load_jsonl(test_path)
-    pred_data = load_jsonl(result_path)
-
-    # 数据长度校验
-    if len(true_data) != len(pred_data):
-        print(f"⚠️ 数据长度不一致：测试集 {len(true_data)} 条，生成结果 {len(pred_data)} 条")
+    try:
+        metrics, skipped = calculate_metrics(iter_jsonl(test_path), iter_jsonl(result_path))
+    except ValueError as e:
+        print(f"⚠️ {e}")
         return
 
-    # 计算指标
-    metrics, skipped = calculate_metrics(true_data, pred_data)
-
     # 计算 Precision 和 Recall
     acc_tp, acc_fp, acc_fn = metrics["accusation"].values()
     art_tp, art_fp, art_fn = metrics["relevant_articles"].values()
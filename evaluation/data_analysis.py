@@ -1,7 +1,11 @@
 import os
-import json
+import sys
 from tqdm import tqdm
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -15,20 +19,9 @@ def load_txt(file_path):
     with open(file_path, "r", encoding="utf-8") as file:
         return set(line.strip() for line in file if line.strip())
 
-def load_jsonl(file_path):
-    """ 加载 jsonl 文件，返回列表 """
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            try:
-                data.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                print(f"⚠️ JSON 解析失败：{line.strip()}")
-    return data
-
 def analyze_coverage(data, valid_accusations, valid_articles):
     """
-    统计覆盖率：罪名和法条的覆盖情况。
+    统计覆盖率：罪名和法条的覆盖情况。data 可以是流式迭代器，同时返回样本数。
     """
     accusation_count = {}
     article_count = {}
@@ -39,7 +32,9 @@ def analyze_coverage(data, valid_accusations, valid_articles):
     for art in valid_articles:
         article_count[art] = 0
 
+    num_samples = 0
     for item in data:
+        num_samples += 1
         meta = item.get("meta", {})
         accusations = meta.get("accusation", [])
         articles = meta.get("relevant_articles", [])
@@ -54,7 +49,7 @@ def analyze_coverage(data, valid_accusations, valid_articles):
             if art in article_count:
                 article_count[art] += 1
 
-    return accusation_count, article_count
+    return accusation_count, article_count, num_samples
 
 def print_coverage_report(acc_count, art_count):
     """
@@ -79,23 +74,21 @@ def main():
     valid_accusations = load_txt(accu_path)
     valid_articles = set(map(int, load_txt(law_path)))
 
-    # 加载测试集数据
-    test_data = load_jsonl(test_path)
-    gen_data = load_jsonl(result_path)
-    base_data = load_jsonl(base_result_path)
+    # 流式读取数据，统计样本数与覆盖率
+    num_test = sum(1 for _ in iter_jsonl(test_path))
+    acc_count, art_count, num_gen = analyze_coverage(iter_jsonl(result_path), valid_accusations, valid_articles)
+    base_acc_count, base_art_count, num_base = analyze_coverage(iter_jsonl(base_result_path), valid_accusations, valid_articles)
 
     print("\n📊 数据集统计：")
-    print(f"测试集样本数：{len(test_data)}")
-    print(f"微调模型样本数：{len(gen_data)}")
-    print(f"基础模型样本数：{len(base_data)}")
+    print(f"测试集样本数：{num_test}")
+    print(f"微调模型样本数：{num_gen}")
+    print(f"基础模型样本数：{num_base}")
 
     # 覆盖率统计
     print("\n📊 微调模型覆盖率：")
-    acc_count, art_count = analyze_coverage(gen_data, valid_accusations, valid_articles)
     print_coverage_report(acc_count, art_count)
 
     print("\n📊 基础模型覆盖率：")
-    base_acc_count, base_art_count = analyze_coverage(base_data, valid_accusations, valid_articles)
     print_coverage_report(base_acc_count, base_art_count)
 
 if __name__ == "__main__":
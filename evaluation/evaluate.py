@@ -0,0 +1,282 @@
+import os
+import sys
+import re
+import json
+from itertools import zip_longest
+import numpy as np
+from metrics_core import LabelIndex, confusion, grow, prf, NEVER
+
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
+# 路径配置
+base_dir = os.path.dirname(__file__)
+test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
+result_paths = [
+    os.path.join(base_dir, "..", "outputs", "test_results2.0_lora_valid.jsonl"),
+    os.path.join(base_dir, "..", "outputs", "test_results3.0_base_valid.jsonl"),
+]
+report_path = os.path.join(base_dir, "..", "outputs", "eval_report.json")
+accu_path = os.path.join(base_dir, "..", "meta", "accu.txt")
+law_path = os.path.join(base_dir, "..", "meta", "law.txt")
+
+# 分组与罪名排行配置（与 by_label.py / by_length.py / by_charge.py 保持一致）
+label_buckets = ["1-label", "2-label", "3+-label"]
+length_buckets = ["<200", "200-500", ">500"]
+
+
+def normalize_accusation(acc):
+    """ 去掉中括号和‘罪’字 """
+    acc = re.sub(r"[\[\]]", "", acc).strip()
+    return acc[:-1] if acc.endswith("罪") else acc
+
+def load_txt(file_path):
+    """ 加载 txt 文件，返回按原顺序去重的列表 """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
+def parse_case(item, accusation_index, article_index):
+    """
+    每条记录只解析、编码一次，返回 (罪名组合 id, 法条组合 id, 案情长度)。
+    """
+    meta = item.get("meta", {})
+    return (
+        accusation_index.encode(meta.get("accusation", [])),
+        article_index.encode(meta.get("relevant_articles", [])),
+        len(item.get("fact", "")),
+    )
+
+def label_bucket_ids(label_counts):
+    """ 按真实罪名数量分组（0 个罪名与 by_label.py 一样归入 3+-label） """
+    return np.where(label_counts == 1, 0, np.where(label_counts == 2, 1, 2))
+
+def length_bucket_ids(lengths):
+    """ 按案情字符数分组 """
+    return np.where(lengths < 200, 0, np.where(lengths <= 500, 1, 2))
+
+def f1_score(precision, recall):
+    return 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
+
+def summarize_counts(tp, fp, fn, **extra):
+    precision, recall, f1 = prf(tp, fp, fn)
+    return dict(TP=int(tp), FP=int(fp), FN=int(fn), precision=float(precision), recall=float(recall), f1=float(f1), **extra)
+
+def summarize_macro(counts, labels):
+    """
+    counts 形状为 (3, 标签数)。只对出现过（真实或预测）的标签取平均，与 calculate_macro.py 一致。
+    """
+    seen = np.flatnonzero(counts.sum(axis=0) > 0)
+    precision, recall, _ = prf(*counts[:, seen])
+    macro_precision = float(precision.mean()) if len(seen) else 0.0
+    macro_recall = float(recall.mean()) if len(seen) else 0.0
+    return {
+        "precision": macro_precision,
+        "recall": macro_recall,
+        "f1": f1_score(macro_precision, macro_recall),
+        "num_labels": len(seen),
+        "labels": {str(labels[i]): summarize_counts(*counts[:, i]) for i in seen},
+    }
+
+
+class ResultEvaluator:
+    """
+    单个结果文件的指标累加器：逐条接收 (真实, 预测) 样本，每 chunk_size 条编码为
+    (样本数, 标签数) 的布尔矩阵，用数组归约一次性累加
+    Micro / Macro、按罪名、按标签数量、按案情长度以及覆盖率。
+    各项的样本口径与原有脚本一致：
+    - Micro（calculate_micro.py）：跳过罪名与法条均为空的预测
+    - Macro（calculate_macro.py）：不跳过任何样本
+    - 按罪名 / 标签数量 / 长度（by_charge.py 等）：跳过罪名为空的预测
+    - 覆盖率（data_analysis.py）：统计结果文件全部样本的原始罪名与法条
+    """
+
+    def __init__(self, accusation_index, article_index, chunk_size=16384):
+        self.indexes = {"accusation": accusation_index, "relevant_articles": article_index}
+        self.chunk_size = chunk_size
+        self.num_cases = 0
+        self.num_pairs = 0
+        self.pairs = []
+        self.pred_combos = []
+
+        self.micro = {field: np.zeros(3, dtype=np.int64) for field in self.indexes}
+        self.micro_skipped = 0
+        self.macro = {field: np.zeros((3, 0), dtype=np.int64) for field in self.indexes}
+
+        # 按罪名：TP / FP / FN / 真实出现次数，以及首次出现的样本序号（用于同频罪名排序）
+        self.charge_stats = np.zeros((4, 0), dtype=np.int64)
+        self.charge_first_seen = np.zeros(0, dtype=np.int64)
+        # 按分组：TP / FP / FN / 样本数
+        self.label_stats = np.zeros((len(label_buckets), 4), dtype=np.int64)
+        self.length_stats = np.zeros((len(length_buckets), 4), dtype=np.int64)
+
+        self.coverage = {field: np.zeros(index.num_valid, dtype=np.int64) for field, index in self.indexes.items()}
+
+    def update_coverage(self, pred_case):
+        self.num_cases += 1
+        self.pred_combos.append(pred_case)
+        if len(self.pred_combos) >= self.chunk_size:
+            self.flush()
+
+    def update(self, true_case, pred_case):
+        self.num_pairs += 1
+        self.pairs.append((true_case, pred_case))
+        if len(self.pairs) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ 将缓冲的样本编码为矩阵并累加各项计数 """
+        if self.pred_combos:
+            pred_combos = np.array(self.pred_combos, dtype=np.int64)[:, :2]
+            for column, (field, index) in enumerate(self.indexes.items()):
+                self.coverage[field] += index.coverage(pred_combos[:, column])
+            self.pred_combos = []
+
+        if not self.pairs:
+            return
+        pairs = np.array(self.pairs, dtype=np.int64)  # (样本数, 2, 3)
+        offset = self.num_pairs - len(self.pairs)
+        self.pairs = []
+
+        # 每条样本的计数只取决于 (真实组合, 预测组合, 长度分组)，按唯一组合计算后乘以出现次数
+        keys = np.column_stack([pairs[:, 0, :2], pairs[:, 1, :2], length_bucket_ids(pairs[:, 0, 2])])
+        keys, first, weights = np.unique(keys, axis=0, return_index=True, return_counts=True)
+
+        matrices = {}
+        row_counts = {}
+        for column, (field, index) in enumerate(self.indexes.items()):
+            true_matrix = index.matrix(keys[:, column])
+            pred_matrix = index.matrix(keys[:, column + 2])
+            counts = confusion(true_matrix, pred_matrix)
+            matrices[field] = (true_matrix, pred_matrix, counts)
+            row_counts[field] = counts.sum(axis=2).T  # (组合数, 3)
+
+            # --- Macro ---
+            self.macro[field] = grow(self.macro[field], len(index)) + weights @ counts
+
+        # --- Micro ---
+        true_acc, pred_acc, acc_counts = matrices["accusation"]
+        has_acc = pred_acc.any(axis=1)
+        has_pred = has_acc | matrices["relevant_articles"][1].any(axis=1)
+        self.micro_skipped += int(weights[~has_pred].sum())
+        for field in self.indexes:
+            self.micro[field] += weights[has_pred] @ row_counts[field][has_pred]
+
+        # --- 按罪名 / 标签数量 / 长度 ---
+        rows = np.flatnonzero(has_acc)
+        if len(rows) == 0:
+            return
+
+        size = len(self.indexes["accusation"])
+        charge_counts = weights[rows] @ np.concatenate([acc_counts[:, rows], true_acc[rows][None]])
+        self.charge_stats = grow(self.charge_stats, size) + charge_counts
+
+        touched = true_acc[rows] | pred_acc[rows]
+        first_seen = np.where(touched, first[rows, None] + offset, NEVER).min(axis=0)
+        self.charge_first_seen = np.minimum(grow(self.charge_first_seen, size, fill=NEVER), first_seen)
+
+        bucket_counts = np.column_stack([row_counts["accusation"][rows], np.ones(len(rows), dtype=np.int64)])
+        bucket_counts *= weights[rows, None]
+        for stats, bucket_ids in ((self.label_stats, label_bucket_ids(true_acc[rows].sum(axis=1))),
+                                  (self.length_stats, keys[rows, 4])):
+            np.add.at(stats, bucket_ids, bucket_counts)
+
+    def report(self, num_test):
+        """
+        汇总为可序列化的字典。测试集与结果条数不一致时与原脚本一样不计算 Micro / Macro，
+        按罪名 / 标签数量 / 长度则按 zip 截断后的样本统计。
+        """
+        self.flush()
+        aligned = self.num_cases == num_test
+
+        labels = {field: index.labels for field, index in self.indexes.items()}
+        charges = np.flatnonzero(self.charge_first_seen != NEVER)
+        charges = charges[np.lexsort((charges, self.charge_first_seen[charges], -self.charge_stats[3, charges]))]
+
+        return {
+            "num_cases": self.num_cases,
+            "aligned": aligned,
+            "micro": dict(
+                {field: summarize_counts(*counts) for field, counts in self.micro.items()},
+                skipped=self.micro_skipped,
+            ) if aligned else None,
+            "macro": {
+                field: summarize_macro(counts, labels[field]) for field, counts in self.macro.items()
+            } if aligned else None,
+            "by_charge": [summarize_counts(*self.charge_stats[:3, i], label=labels["accusation"][i],
+                                           count=int(self.charge_stats[3, i])) for i in charges],
+            "by_label": {bucket: summarize_counts(*stats[:3], num_cases=int(stats[3]))
+                         for bucket, stats in zip(label_buckets, self.label_stats)},
+            "by_length": {bucket: summarize_counts(*stats[:3], num_cases=int(stats[3]))
+                          for bucket, stats in zip(length_buckets, self.length_stats)},
+            "coverage": {
+                "accusation": dict(zip(labels["accusation"], self.coverage["accusation"].tolist())),
+                "relevant_articles": dict(zip(map(str, labels["relevant_articles"]), self.coverage["relevant_articles"].tolist())),
+                "uncovered_accusations": [labels["accusation"][i] for i in np.flatnonzero(self.coverage["accusation"] == 0)],
+                "uncovered_articles": [labels["relevant_articles"][i] for i in np.flatnonzero(self.coverage["relevant_articles"] == 0)],
+            },
+        }
+
+
+def evaluate(test_path, result_paths, chunk_size=16384):
+    """
+    一次遍历测试集与所有结果文件：每个文件只读取、解析、规范化一次，逐行流式处理，
+    每 chunk_size 条做一次矩阵运算，内存占用与数据集大小无关。
+    返回 {"test_path", "num_test", "results": {结果路径: 指标}}。
+    """
+    accusation_index = LabelIndex(load_txt(accu_path), normalize=normalize_accusation)
+    article_index = LabelIndex(int(art) for art in load_txt(law_path))
+    evaluators = [ResultEvaluator(accusation_index, article_index, chunk_size) for _ in result_paths]
+
+    num_test = 0
+    streams = [iter_jsonl(test_path)] + [iter_jsonl(path) for path in result_paths]
+    for items in zip_longest(*streams):
+        true_case = parse_case(items[0], accusation_index, article_index) if items[0] is not None else None
+        if true_case is not None:
+            num_test += 1
+
+        for evaluator, pred_item in zip(evaluators, items[1:]):
+            if pred_item is None:
+                continue
+            pred_case = parse_case(pred_item, accusation_index, article_index)
+            evaluator.update_coverage(pred_case)
+            if true_case is not None:
+                evaluator.update(true_case, pred_case)
+
+    return {
+        "test_path": test_path,
+        "num_test": num_test,
+        "results": {path: evaluator.report(num_test) for path, evaluator in zip(result_paths, evaluators)},
+    }
+
+def print_summary(report):
+    """ 打印各结果文件的主要指标，完整结果见 JSON 报告 """
+    print(f"\n📊 测试集样本数：{report['num_test']}")
+    for path, result in report["results"].items():
+        print(f"\n📄 {os.path.basename(path)}（{result['num_cases']} 条）")
+        if not result["aligned"]:
+            print(f"⚠️ 数据长度不一致：测试集 {report['num_test']} 条，生成结果 {result['num_cases']} 条，跳过 Micro / Macro")
+            continue
+
+        micro, macro = result["micro"], result["macro"]
+        print(f"Micro（已跳过空预测样本 {micro['skipped']} 条）：")
+        for field, name in (("accusation", "罪名"), ("relevant_articles", "法条")):
+            m = micro[field]
+            print(f"【{name}】: Precision = {m['precision']:.4f}, Recall = {m['recall']:.4f}, F1 = {m['f1']:.4f}")
+        print("Macro：")
+        for field, name in (("accusation", "罪名"), ("relevant_articles", "法条")):
+            m = macro[field]
+            print(f"【{name}】: Precision = {m['precision']:.4f}, Recall = {m['recall']:.4f}, F1 = {m['f1']:.4f}")
+
+def main():
+    print("🔄 正在评估（单次遍历）...")
+    report = evaluate(test_path, result_paths)
+    print_summary(report)
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"\n✅ 评估报告已保存至：{report_path}")
+
+if __name__ == "__main__":
+    main()
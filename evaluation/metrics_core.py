@@ -0,0 +1,114 @@
+from itertools import chain
+import numpy as np
+
+# 计数矩阵的行顺序
+TP, FP, FN = 0, 1, 2
+
+# 尚未出现过的标签的首次出现位置
+NEVER = np.iinfo(np.int64).max
+
+
+class LabelIndex:
+    """
+    标签 -> 整数 id。meta/ 中的合法标签按文件顺序占前 num_valid 个 id，
+    预测中出现的非法标签按首次出现顺序追加新 id（仍需计入 FP）。
+    真实数据中标签组合重复度很高，因此每条样本只编码为一个“标签组合 id”，
+    同一组合只规范化、查表一次；布尔矩阵由组合表按行索引得到。
+    """
+
+    def __init__(self, labels, normalize=None):
+        self.labels = list(dict.fromkeys(labels))
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+        self.num_valid = len(self.labels)
+        self.normalize = normalize
+
+        self.combos = {}        # 原始标签元组 -> 组合 id
+        self.combo_ids = []     # 组合 id -> 规范化去重后的标签 id 列表
+        self.combo_valid = []   # 组合 id -> 原始标签中合法标签的 id（不去重，用于覆盖率）
+        self._matrix = None
+        self._valid_counts = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _label_id(self, label):
+        if label not in self.ids:
+            self.ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self.ids[label]
+
+    def encode(self, values):
+        """ 编码一条样本的标签列表，返回组合 id """
+        key = tuple(values)
+        combo = self.combos.get(key)
+        if combo is None:
+            normalized = map(self.normalize, key) if self.normalize else key
+            combo = self.combos[key] = len(self.combo_ids)
+            self.combo_ids.append([self._label_id(label) for label in dict.fromkeys(normalized)])
+            self.combo_valid.append([self.ids[value] for value in key if self.ids.get(value, self.num_valid) < self.num_valid])
+        return combo
+
+    def matrix(self, combos):
+        """ 组合 id 数组 -> (样本数, 标签数) 布尔矩阵 """
+        if self._matrix is None or self._matrix.shape != (len(self.combo_ids), len(self.labels)):
+            self._matrix = to_matrix(self.combo_ids, len(self.labels))
+        return self._matrix[combos]
+
+    def coverage(self, combos):
+        """ 组合 id 数组 -> 各合法标签在原始标签中的出现次数 """
+        if self._valid_counts is None or len(self._valid_counts) != len(self.combo_valid):
+            self._valid_counts = np.zeros((len(self.combo_valid), self.num_valid), dtype=np.int64)
+            for combo, ids in enumerate(self.combo_valid):
+                np.add.at(self._valid_counts[combo], ids, 1)
+        return np.bincount(combos, minlength=len(self.combo_valid)) @ self._valid_counts
+
+
+def to_matrix(rows, num_labels):
+    """
+    将每条样本的标签 id 列表转换为 (样本数, num_labels) 的布尔矩阵。
+    """
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+    ids = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=int(lengths.sum()))
+    matrix = np.zeros((len(rows), num_labels), dtype=bool)
+    matrix[np.repeat(np.arange(len(rows)), lengths), ids] = True
+    return matrix
+
+
+def confusion(true_matrix, pred_matrix):
+    """ 返回形状为 (3, 样本数, 标签数) 的 TP / FP / FN 布尔矩阵 """
+    return np.stack([true_matrix & pred_matrix, pred_matrix & ~true_matrix, true_matrix & ~pred_matrix])
+
+
+def grow(array, size, fill=0):
+    """ 标签表追加新标签后，将最后一维补齐到 size """
+    if array.shape[-1] >= size:
+        return array
+    pad = [(0, 0)] * (array.ndim - 1) + [(0, size - array.shape[-1])]
+    return np.pad(array, pad, constant_values=fill)
+
+
+def safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.zeros(np.broadcast(numerator, denominator).shape)
+    return np.divide(numerator, denominator, out=out, where=denominator > 0)
+
+
+def prf(tp, fp, fn):
+    """ 按元素计算 Precision、Recall 和 F1，分母为 0 时记为 0 """
+    precision = safe_divide(tp, tp + fp)
+    recall = safe_divide(tp, tp + fn)
+    return precision, recall, safe_divide(2 * precision * recall, precision + recall)
+
+
+def macro_prf(tp, fp, fn):
+    """
+    tp / fp / fn 形状为 (..., 标签数)，沿最后一维宏平均：只对出现过（真实或预测）的标签取平均，
+    与 calculate_macro.py 一致；F1 由宏平均后的 Precision 与 Recall 计算。
+    """
+    seen = (tp + fp + fn) > 0
+    precision, recall, _ = prf(tp, fp, fn)
+    num_seen = seen.sum(axis=-1)
+    macro_precision = safe_divide((precision * seen).sum(axis=-1), num_seen)
+    macro_recall = safe_divide((recall * seen).sum(axis=-1), num_seen)
+    return macro_precision, macro_recall, safe_divide(2 * macro_precision * macro_recall, macro_precision + macro_recall)
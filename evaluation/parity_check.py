@@ -0,0 +1,49 @@
+import os
+from calculate_micro import iter_jsonl, calculate_metrics, compute_precision_recall
+
+# 路径配置
+base_dir = os.path.dirname(__file__)
+test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
+reference_path = os.path.join(base_dir, "..", "outputs", "test_results2.0_lora_valid.jsonl")
+candidate_path = os.path.join(base_dir, "..", "outputs", "test_results2.0_lora_int8_valid.jsonl")
+
+# 允许的最大指标差值
+tolerance = 0.01
+
+def micro_scores(true_data, pred_data):
+    """ 按 calculate_micro.py 的口径计算 Micro Precision / Recall，条数不一致时抛出 ValueError """
+    metrics, _ = calculate_metrics(true_data, pred_data)
+    acc_precision, acc_recall = compute_precision_recall(*metrics["accusation"].values())
+    art_precision, art_recall = compute_precision_recall(*metrics["relevant_articles"].values())
+    return {
+        "罪名 - Precision": acc_precision,
+        "罪名 - Recall": acc_recall,
+        "法条 - Precision": art_precision,
+        "法条 - Recall": art_recall,
+    }
+
+def main():
+    print("🔄 正在加载数据...")
+    # 测试集分别与两份结果流式配对读取
+    try:
+        reference_scores = micro_scores(iter_jsonl(test_path), iter_jsonl(reference_path))
+        candidate_scores = micro_scores(iter_jsonl(test_path), iter_jsonl(candidate_path))
+    except ValueError as e:
+        print(f"⚠️ {e}")
+        return
+
+    print("\n📊 精度一致性检查（Micro）：")
+    passed = True
+    for name, reference in reference_scores.items():
+        candidate = candidate_scores[name]
+        delta = candidate - reference
+        passed = passed and abs(delta) <= tolerance
+        print(f"【{name}】: 基准 {reference:.4f}，对比 {candidate:.4f}，差值 {delta:+.4f}")
+
+    if passed:
+        print(f"\n✅ 所有指标差值均在 {tolerance} 以内")
+    else:
+        print(f"\n❌ 存在指标差值超过 {tolerance}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+from itertools import zip_longest
+from statistics import NormalDist
+import numpy as np
+from evaluate import parse_case, normalize_accusation, load_txt, accu_path, law_path
+from metrics_core import LabelIndex, confusion, prf, macro_prf
+
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl
+
+# 路径配置
+base_dir = os.path.dirname(__file__)
+test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
+reference_path = os.path.join(base_dir, "..", "outputs", "test_results3.0_base_valid.jsonl")
+candidate_path = os.path.join(base_dir, "..", "outputs", "test_results2.0_lora_valid.jsonl")
+report_path = os.path.join(base_dir, "..", "outputs", "significance_report.json")
+
+# 重采样配置
+num_resamples = 10000   # bootstrap 与置换检验的重采样次数
+confidence = 0.95       # 置信区间水平
+chunk_size = 1000       # 每次矩阵运算处理的重采样次数
+seed = 42
+
+fields = [("accusation", "罪名"), ("relevant_articles", "法条")]
+metrics = ["precision", "recall", "f1"]
+
+
+def load_case_counts(test_path, result_paths):
+    """
+    读取测试集与各结果文件，返回每个结果文件的逐样本计数矩阵 (样本数, 列数)。
+    每个字段占 3 列 Micro 计数（TP / FP / FN，按 calculate_micro.py 跳过罪名与法条均为空的预测）
+    加 3 * 标签数列逐标签计数（Macro 用，不跳过样本）。
+    任一重采样的全部计数都等于 权重 @ 计数矩阵。
+    """
+    accusation_index = LabelIndex(load_txt(accu_path), normalize=normalize_accusation)
+    article_index = LabelIndex(int(art) for art in load_txt(law_path))
+    indexes = {"accusation": accusation_index, "relevant_articles": article_index}
+
+    cases = []
+    streams = [iter_jsonl(test_path)] + [iter_jsonl(path) for path in result_paths]
+    for items in zip_longest(*streams):
+        if any(item is None for item in items):
+            lengths = ", ".join(f"{os.path.basename(path)} 已读 {len(cases)} 条" for path in [test_path] + result_paths)
+            raise ValueError(f"测试集与结果文件条数不一致（{lengths}）")
+        cases.append([parse_case(item, accusation_index, article_index) for item in items])
+    cases = np.array(cases, dtype=np.int64)  # (样本数, 1 + 结果数, 3)
+
+    case_counts = []
+    for column in range(1, cases.shape[1]):
+        blocks = []
+        pred_any = np.zeros(len(cases), dtype=bool)
+        for i, index in enumerate(indexes.values()):
+            pred_matrix = index.matrix(cases[:, column, i])
+            pred_any |= pred_matrix.any(axis=1)
+            blocks.append(confusion(index.matrix(cases[:, 0, i]), pred_matrix))
+
+        columns = []
+        for counts in blocks:
+            columns.append(counts.sum(axis=2).T * pred_any[:, None])             # Micro
+            columns.append(counts.transpose(1, 0, 2).reshape(len(cases), -1))    # Macro
+        case_counts.append(np.concatenate(columns, axis=1).astype(np.float64))
+
+    return case_counts, [len(index) for index in indexes.values()]
+
+
+def compute_scores(totals, num_labels):
+    """
+    totals: (重采样次数, 列数) 的汇总计数，按 load_case_counts 的列布局拆分，
+    返回 {"罪名 - Micro - precision": (重采样次数,) 数组, ...}。
+    """
+    scores = {}
+    start = 0
+    for (_, name), size in zip(fields, num_labels):
+        micro = totals[:, start:start + 3]
+        macro = totals[:, start + 3:start + 3 + 3 * size].reshape(len(totals), 3, size)
+        start += 3 + 3 * size
+
+        for average, values in (("Micro", prf(*micro.T)), ("Macro", macro_prf(macro[:, 0], macro[:, 1], macro[:, 2]))):
+            for metric, value in zip(metrics, values):
+                scores[f"{name} - {average} - {metric}"] = value
+    return scores
+
+
+class SparseCounts:
+    """
+    逐样本计数矩阵的稀疏表示（按列排序的非零元）。每条样本只有少数几个非零计数，
+    权重 @ 计数 只需对非零元做 gather + 按列 reduceat，代价为 重采样次数 × 非零元数。
+    """
+
+    def __init__(self, dense):
+        columns, rows = np.nonzero(dense.T)
+        self.rows = rows
+        self.values = dense[rows, columns]
+        self.columns, self.starts = np.unique(columns, return_index=True)
+        self.num_columns = dense.shape[1]
+
+    def weighted_sum(self, weights):
+        """ 等价于 weights @ dense """
+        out = np.zeros((len(weights), self.num_columns))
+        if len(self.rows):
+            out[:, self.columns] = np.add.reduceat(weights[:, self.rows] * self.values, self.starts, axis=1)
+        return out
+
+
+def collect(chunks):
+    """ 合并分块计算的 {指标名: 数组} """
+    return {name: np.concatenate([scores[name] for scores in chunks]) for name in chunks[0]}
+
+
+def bootstrap(case_counts, num_labels, rng):
+    """
+    配对 bootstrap：每次有放回抽样 n 条，即样本权重服从 Multinomial(n, 1/n)，
+    两个结果文件使用同一组权重，差值的置信区间即为配对置信区间。
+    返回每个结果文件的 {指标名: (num_resamples,) 数组}。
+    """
+    sparse_counts = [SparseCounts(counts) for counts in case_counts]
+    num_cases = len(case_counts[0])
+
+    chunks = [[] for _ in case_counts]
+    for start in range(0, num_resamples, chunk_size):
+        size = min(chunk_size, num_resamples - start)
+        # 每行 n 次均匀抽样的计数即一组多项分布权重
+        draws = rng.integers(0, num_cases, size=(size, num_cases)) + np.arange(size)[:, None] * num_cases
+        weights = np.bincount(draws.ravel(), minlength=size * num_cases).reshape(size, num_cases).astype(np.float64)
+        for chunk, counts in zip(chunks, sparse_counts):
+            chunk.append(compute_scores(counts.weighted_sum(weights), num_labels))
+    return [collect(chunk) for chunk in chunks]
+
+
+def permutation_test(case_counts, num_labels, rng):
+    """
+    配对置换检验：每条样本以 1/2 概率交换两个结果文件的预测，
+    返回两组交换后的伪结果各自的指标（差值即零假设下的统计量分布）。
+    交换后的计数 = 参考计数 + 交换掩码 @ (对比计数 - 参考计数)。
+    """
+    reference, candidate = case_counts
+    delta = SparseCounts(candidate - reference)
+    num_cases = len(reference)
+
+    chunks = ([], [])
+    for start in range(0, num_resamples, chunk_size):
+        swaps = (rng.random((min(chunk_size, num_resamples - start), num_cases)) < 0.5).astype(np.float64)
+        shift = delta.weighted_sum(swaps)
+        chunks[0].append(compute_scores(reference.sum(axis=0) + shift, num_labels))
+        chunks[1].append(compute_scores(candidate.sum(axis=0) - shift, num_labels))
+    return [collect(chunk) for chunk in chunks]
+
+
+def bias_corrected_interval(samples, estimate):
+    """
+    偏差校正（BC）的 bootstrap 百分位置信区间：z0 = Φ⁻¹(重采样值小于点估计的比例，相等记一半)，
+    取 Φ(2·z0 ± z) 处的分位数。Macro 只对每次重采样中出现过的标签取平均，稀有标签时有时无，
+    bootstrap 分布相对点估计整体偏移，普通百分位区间可能不包含点估计；无偏时（z0 = 0）与百分位区间相同。
+    """
+    normal = NormalDist()
+    below = (np.sum(samples < estimate) + 0.5 * np.sum(samples == estimate)) / len(samples)
+    below = min(max(below, 0.5 / len(samples)), 1 - 0.5 / len(samples))
+    z0 = normal.inv_cdf(below)
+    z = normal.inv_cdf(0.5 + confidence / 2)
+    return np.percentile(samples, [100 * normal.cdf(2 * z0 - z), 100 * normal.cdf(2 * z0 + z)]).tolist()
+
+
+def compare(test_path, reference_path, candidate_path):
+    """
+    对比两个结果文件的 Micro / Macro Precision、Recall、F1：
+    点估计、bootstrap 置信区间（偏差校正百分位法）、差值（对比 - 参考）的配对置信区间与置换检验双侧 p 值。
+    """
+    rng = np.random.default_rng(seed)
+    case_counts, num_labels = load_case_counts(test_path, [reference_path, candidate_path])
+    observed = [compute_scores(counts.sum(axis=0, keepdims=True), num_labels) for counts in case_counts]
+
+    boot_reference, boot_candidate = bootstrap(case_counts, num_labels, rng)
+    perm_reference, perm_candidate = permutation_test(case_counts, num_labels, rng)
+
+    report = {}
+    for name in observed[0]:
+        reference, candidate = float(observed[0][name][0]), float(observed[1][name][0])
+        diff = candidate - reference
+        perm_diff = perm_candidate[name] - perm_reference[name]
+        report[name] = {
+            "reference": reference,
+            "reference_ci": bias_corrected_interval(boot_reference[name], reference),
+            "candidate": candidate,
+            "candidate_ci": bias_corrected_interval(boot_candidate[name], candidate),
+            "diff": diff,
+            "diff_ci": bias_corrected_interval(boot_candidate[name] - boot_reference[name], diff),
+            "p_value": float((1 + (np.abs(perm_diff) >= abs(diff) - 1e-12).sum()) / (1 + num_resamples)),
+        }
+    return {"num_cases": len(case_counts[0]), "num_resamples": num_resamples, "confidence": confidence, "metrics": report}
+
+
+def main():
+    print("🔄 正在计算 bootstrap 置信区间与置换检验...")
+    start = time.perf_counter()
+    result = compare(test_path, reference_path, candidate_path)
+    elapsed = time.perf_counter() - start
+
+    level = f"{confidence:.0%}"
+    print(f"\n📊 显著性检验（{result['num_cases']} 条，重采样 {num_resamples} 次，耗时 {elapsed:.1f} 秒）：")
+    print(f"参考：{os.path.basename(reference_path)}")
+    print(f"对比：{os.path.basename(candidate_path)}")
+    for name, stat in result["metrics"].items():
+        print(f"【{name}】: 参考 {stat['reference']:.4f} [{stat['reference_ci'][0]:.4f}, {stat['reference_ci'][1]:.4f}]，"
+              f"对比 {stat['candidate']:.4f} [{stat['candidate_ci'][0]:.4f}, {stat['candidate_ci'][1]:.4f}]，"
+              f"差值 {stat['diff']:+.4f}（{level} CI [{stat['diff_ci'][0]:+.4f}, {stat['diff_ci'][1]:+.4f}]，p = {stat['p_value']:.4f}）")
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(dict(result, reference_path=reference_path, candidate_path=candidate_path), file, ensure_ascii=False, indent=2)
+    print(f"\n✅ 检验报告已保存至：{report_path}")
+
+if __name__ == "__main__":
+    main()
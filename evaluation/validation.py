@@ -1,8 +1,12 @@
 import os
-import json
+import sys
 import re
 from tqdm import tqdm
 
+# 共用的 jsonl 读写模块位于 scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+from jsonl_io import iter_jsonl, JsonlWriter
+
 # 路径配置
 base_dir = os.path.dirname(__file__)
 test_path = os.path.join(base_dir, "..", "data", "test2.0.jsonl")
@@ -16,17 +20,6 @@ def load_txt(file_path):
     with open(file_path, "r", encoding="utf-8") as file:
         return set(line.strip() for line in file if line.strip())
 
-def load_jsonl(file_path):
-    """ 加载 jsonl 文件，返回列表 """
-    data = []
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            try:
-                data.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                print(f"⚠️ JSON 解析失败：{line.strip()}")
-    return data
-
 def normalize_accusation(accusation):
     """
     标准化罪名：
@@ -47,13 +40,15 @@ def normalize_accusation(accusation):
 def validate_and_save(test_data, result_data, valid_accusations, valid_articles, output_path):
     """
     遍历生成结果，将非法样本置空，并将合法样本中的“罪”字去除后保存。
+    test_data / result_data 可以是流式迭代器（如 iter_jsonl），边读边写。
     """
-    total_samples = len(test_data)
+    total_samples = 0
     structured_samples = 0
     valid_samples = 0
 
-    with open(output_path, "w", encoding="utf-8") as outfile:
+    with JsonlWriter(output_path) as writer:
         for true_item, pred_item in zip(test_data, result_data):
+            total_samples += 1
             pred_meta = pred_item.get("meta", {})
             accusations = pred_meta.get("accusation", [])
             articles = pred_meta.get("relevant_articles", [])
@@ -80,16 +75,16 @@ def validate_and_save(test_data, result_data, valid_accusations, valid_articles,
                             "relevant_articles": articles
                         }
                     }
-                    outfile.write(json.dumps(cleaned_data, ensure_ascii=False) + "\n")
+                    writer.write(cleaned_data)
                 else:
                     # 置空
                     empty_data = {"meta": {"accusation": [], "relevant_articles": []}}
-                    outfile.write(json.dumps(empty_data, ensure_ascii=False) + "\n")
+                    writer.write(empty_data)
 
             else:
                 # 置空
                 empty_data = {"meta": {"accusation": [], "relevant_articles": []}}
-                outfile.write(json.dumps(empty_data, ensure_ascii=False) + "\n")
+                writer.write(empty_data)
 
     # 输出统计信息
     structured_rate = structured_samples / total_samples if total_samples > 0 else 0
@@ -103,8 +98,8 @@ def validate_and_save(test_data, result_data, valid_accusations, valid_articles,
 def main():
     # 加载数据
     print("🔄 正在加载数据...")
-    test_data = load_jsonl(test_path)
-    result_data = load_jsonl(result_path)
+    test_data = iter_jsonl(test_path)
+    result_data = iter_jsonl(result_path)
     valid_accusations = load_txt(accu_path)
     valid_articles = set(map(int, load_txt(law_path)))  # 转为整数
 
@@ -0,0 +1,37 @@
+def schedule_batches(lengths, max_tokens=4096, max_batch_size=32):
+    """
+    按长度排序后贪心装箱，返回索引批次列表。
+    - 每批的填充后 token 数（最长长度 × 条数）不超过 max_tokens
+    - 每批条数不超过 max_batch_size
+    单条超出预算的样本单独成批。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    batches = []
+    current = []
+    for i in order:
+        # 升序遍历，加入当前样本后该批最长长度即 lengths[i]
+        padded_tokens = lengths[i] * (len(current) + 1)
+        if current and (padded_tokens > max_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+        current.append(i)
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def fixed_batches(n, batch_size):
+    """
+    按原顺序每 batch_size 条切分，返回索引批次列表。
+    """
+    return [list(range(start, min(start + batch_size, n))) for start in range(0, n, batch_size)]
+
+
+def padding_efficiency(real_tokens, padded_tokens):
+    """
+    填充效率 = 有效 token 数 / 填充后 token 数，越接近 1 浪费越少。
+    """
+    return real_tokens / padded_tokens if padded_tokens > 0 else 1.0
@@ -0,0 +1,349 @@
+import json
+import time
+import resource
+import tracemalloc
+import multiprocessing
+import torch
+import generate_lora
+import generate_base
+from generate_utils import decode, encode_prompts, prompt_header, generation_stats, reset_generation_stats
+from speculative import speculative_decode, reset_speculative_stats, report_speculative_stats
+from template_decode import template_stats, reset_template_stats, report_template_stats
+import retrieval_index
+import jsonl_io
+from jsonl_io import iter_jsonl
+
+# 输入路径配置
+input_path = "../data/test2.0.jsonl"
+
+
+def load_prompts(file_path, num_cases):
+    """
+    读取测试集前 num_cases 条有效案情并构建 prompt。
+    """
+    prompts = []
+    for item in iter_jsonl(file_path, errors="raise"):
+        fact = item.get("fact", "")
+        if fact:
+            prompts.append(f"{prompt_header}{fact}")
+        if len(prompts) >= num_cases:
+            break
+    return prompts
+
+
+def load_module(model_type):
+    module = generate_lora if model_type == "lora" else generate_base
+    module.load_model()
+    return module
+
+
+def timed(fn):
+    """
+    返回 fn 的执行耗时（秒），GPU 上等待计算完成。
+    """
+    start = time.perf_counter()
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def bench_prefix_cache(model_type="lora", num_cases=50):
+    """
+    对比每条样本的 prefill 耗时：完整 prompt vs 复用指令头 KV cache。
+    两种方式都只解码 1 个 token，即耗时基本等于 prefill。
+    """
+    module = load_module(model_type)
+    prompts = load_prompts(input_path, num_cases)
+
+    def prefill(prompt, prefix_cache):
+        input_ids, attention_mask, past_key_values = encode_prompts(module.model, module.tokenizer, [prompt], prefix_cache)
+        decode(module.model, module.tokenizer, input_ids, attention_mask, past_key_values=past_key_values,
+               max_new_tokens=1, do_sample=False)
+
+    # 预热
+    prefill(prompts[0], None)
+    prefill(prompts[0], module.prefix_cache)
+
+    full_time = sum(timed(lambda: prefill(prompt, None)) for prompt in prompts)
+    cached_time = sum(timed(lambda: prefill(prompt, module.prefix_cache)) for prompt in prompts)
+
+    full_ms = full_time / len(prompts) * 1000
+    cached_ms = cached_time / len(prompts) * 1000
+    print(f"\n📊 Prefill 耗时对比（{model_type}，{len(prompts)} 条，指令头 {module.prefix_cache.length} token）：")
+    print(f"完整 prompt：{full_ms:.1f} ms/条")
+    print(f"复用指令头 cache：{cached_ms:.1f} ms/条")
+    print(f"每条节省：{full_ms - cached_ms:.1f} ms（{1 - cached_ms / full_ms:.2%}）")
+
+
+def precision_worker(model_type, precision, num_cases, queue):
+    """
+    在独立进程中以指定精度加载模型并逐条推理，回传加载耗时、单条延迟与峰值内存。
+    """
+    start = time.perf_counter()
+    module = generate_lora if model_type == "lora" else generate_base
+    module.load_model(precision)
+    load_time = time.perf_counter() - start
+
+    prompts = load_prompts(input_path, num_cases)
+    module.generate_batch(prompts[:1], batch_size=1, do_sample=False)  # 预热
+    latency = timed(lambda: module.generate_batch(prompts, batch_size=1, do_sample=False)) / len(prompts)
+
+    queue.put({
+        "precision": precision,
+        "load_time": load_time,
+        "latency_ms": latency * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def bench_precision(model_type="lora", precisions=("fp32", "bf16", "int8"), num_cases=20):
+    """
+    对比不同推理精度的加载耗时、单条延迟（贪心解码）与峰值内存。
+    每种精度在独立进程中运行，避免模型常驻内存互相干扰。
+    准确率是否一致请用 evaluation/parity_check.py 对比两份结果文件。
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+
+    results = []
+    for precision in precisions:
+        worker = context.Process(target=precision_worker, args=(model_type, precision, num_cases, queue))
+        worker.start()
+        worker.join()
+        if worker.exitcode != 0:
+            print(f"❌ 精度 {precision} 测试失败")
+            continue
+        results.append(queue.get())
+
+    print(f"\n📊 推理精度对比（{model_type}，{num_cases} 条，batch_size=1）：")
+    for result in results:
+        print(f"{result['precision']:>5}：加载 {result['load_time']:.1f} 秒，"
+              f"延迟 {result['latency_ms']:.1f} ms/条，峰值内存 {result['peak_rss_mb']:.0f} MB")
+
+
+def cold_start_worker(use_merged, queue):
+    """
+    在全新进程中加载 LoRA 模型，回传冷启动耗时与峰值内存。
+    """
+    start = time.perf_counter()
+    generate_lora.load_model(use_merged=use_merged)
+    queue.put({
+        "use_merged": use_merged,
+        "load_time": time.perf_counter() - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def bench_cold_start():
+    """
+    对比 LoRA 模型冷启动：现场合并 adapter vs 加载导出的合并模型。
+    需先运行 generate_lora.export_merged_model()。
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+
+    print("\n📊 LoRA 模型冷启动对比：")
+    for use_merged in (False, True):
+        worker = context.Process(target=cold_start_worker, args=(use_merged, queue))
+        worker.start()
+        worker.join()
+        name = "加载合并模型" if use_merged else "现场合并 adapter"
+        if worker.exitcode != 0:
+            print(f"❌ {name} 测试失败")
+            continue
+        result = queue.get()
+        print(f"{name}：耗时 {result['load_time']:.1f} 秒，峰值内存 {result['peak_rss_mb']:.0f} MB")
+
+
+def bench_streaming(model_type="lora", num_cases=20):
+    """
+    流式推理：对比首个罪名产出耗时（time-to-first-charge）与完整输出耗时。
+    """
+    module = load_module(model_type)
+    stream = module.stream_lora if model_type == "lora" else module.stream_base
+    prompts = load_prompts(input_path, num_cases)
+
+    def run(prompt):
+        for event in stream(prompt, do_sample=False):
+            if event["type"] == "done":
+                return event
+
+    run(prompts[0])  # 预热
+
+    first_charge_ms, total_ms = [], []
+    for prompt in prompts:
+        event = run(prompt)
+        total_ms.append(event["total_ms"])
+        if event["time_to_first_charge_ms"] is not None:
+            first_charge_ms.append(event["time_to_first_charge_ms"])
+
+    avg_total = sum(total_ms) / len(total_ms)
+    print(f"\n📊 流式推理（{model_type}，{len(prompts)} 条，贪心解码）：")
+    if first_charge_ms:
+        avg_first = sum(first_charge_ms) / len(first_charge_ms)
+        print(f"首个罪名耗时：{avg_first:.1f} ms/条（{len(first_charge_ms)} 条输出了罪名）")
+        print(f"完整输出耗时：{avg_total:.1f} ms/条，首个罪名提前 {avg_total - avg_first:.1f} ms")
+    else:
+        print(f"完整输出耗时：{avg_total:.1f} ms/条，没有样本输出罪名")
+
+
+def bench_speculative(model_type="lora", num_cases=20, ngram_size=3, max_draft=8):
+    """
+    投机解码 vs 现有逐 token 贪心解码：逐条对比输出 token 是否一致与单条耗时，并打印草稿接受率。
+    """
+    module = load_module(model_type)
+    prompts = load_prompts(input_path, num_cases)
+
+    def greedy(prompt):
+        input_ids, attention_mask, past_key_values = encode_prompts(module.model, module.tokenizer, [prompt], module.prefix_cache)
+        return decode(module.model, module.tokenizer, input_ids, attention_mask, past_key_values=past_key_values,
+                      max_new_tokens=200, do_sample=False)[0]
+
+    def speculative(prompt):
+        input_ids, attention_mask, past_key_values = encode_prompts(module.model, module.tokenizer, [prompt], module.prefix_cache)
+        return speculative_decode(module.model, module.tokenizer, input_ids, attention_mask, past_key_values=past_key_values,
+                                  max_new_tokens=200, ngram_size=ngram_size, max_draft=max_draft)
+
+    # 预热
+    greedy(prompts[0])
+    speculative(prompts[0])
+    reset_speculative_stats()
+
+    greedy_ms, speculative_ms, mismatches = [], [], 0
+    for prompt in prompts:
+        outputs = {}
+        greedy_ms.append(timed(lambda: outputs.update(greedy=greedy(prompt))) * 1000)
+        speculative_ms.append(timed(lambda: outputs.update(speculative=speculative(prompt))) * 1000)
+        mismatches += outputs["greedy"] != outputs["speculative"]
+
+    avg_greedy = sum(greedy_ms) / len(greedy_ms)
+    avg_speculative = sum(speculative_ms) / len(speculative_ms)
+    print(f"\n📊 投机解码（{model_type}，{len(prompts)} 条，n-gram={ngram_size}，草稿上限 {max_draft}）：")
+    print(f"逐 token 贪心解码：{avg_greedy:.1f} ms/条")
+    print(f"投机解码：{avg_speculative:.1f} ms/条（加速 {avg_greedy / avg_speculative:.2f}x）")
+    print(f"输出不一致：{mismatches} 条")
+    report_speculative_stats()
+
+
+def bench_template(model_type="lora", num_cases=20):
+    """
+    模板约束解码 vs 现有逐 token 贪心解码：对比每条样本的解码步数（前向次数）与耗时，
+    并统计两种方式解析出的罪名 / 法条集合一致的比例。
+    """
+    module = load_module(model_type)
+    generate = module.generate_lora if model_type == "lora" else module.generate_base
+    template = module.template_lora if model_type == "lora" else module.template_base
+    prompts = load_prompts(input_path, num_cases)
+
+    # 预热
+    generate(prompts[0], do_sample=False)
+    template(prompts[0], do_sample=False)
+    reset_generation_stats()
+    reset_template_stats()
+
+    free_ms, template_ms, same_accusation, same_articles = [], [], 0, 0
+    for prompt in prompts:
+        outputs = {}
+        free_ms.append(timed(lambda: outputs.update(free=generate(prompt, do_sample=False))) * 1000)
+        template_ms.append(timed(lambda: outputs.update(template=template(prompt, do_sample=False))) * 1000)
+        same_accusation += set(outputs["free"][1]) == set(outputs["template"][1])
+        same_articles += set(outputs["free"][2]) == set(outputs["template"][2])
+
+    # 逐 token 解码每步一次前向，另加一次 prefill
+    free_passes = generation_stats["decode_steps"] / len(prompts)
+    template_passes = template_stats["forward_passes"] / len(prompts)
+    avg_free = sum(free_ms) / len(free_ms)
+    avg_template = sum(template_ms) / len(template_ms)
+    print(f"\n📊 模板约束解码（{model_type}，{len(prompts)} 条，贪心解码）：")
+    print(f"逐 token 解码：{free_passes:.1f} 步/条，{avg_free:.1f} ms/条")
+    print(f"模板约束解码：{template_passes:.1f} 次前向/条，{avg_template:.1f} ms/条（加速 {avg_free / avg_template:.2f}x）")
+    print(f"与逐 token 解码结果一致：罪名 {same_accusation}/{len(prompts)}，法条 {same_articles}/{len(prompts)}")
+    report_template_stats()
+
+
+def bench_retrieval(num_cases=1000, k=retrieval_index.top_k):
+    """
+    检索预筛的查询延迟：索引加载耗时，单条查询（分词哈希 + 倒排累加 + top-k）的平均 / p50 / p95 延迟，
+    以及每条查询平均读取的倒排记录数。
+    """
+    start = time.perf_counter()
+    index = retrieval_index.load_index()
+    load_ms = (time.perf_counter() - start) * 1000
+    facts = [retrieval_index.fact_from_prompt(prompt) for prompt in load_prompts(input_path, num_cases)]
+
+    # 预热（换入内存映射的倒排记录）
+    for fact in facts[:10]:
+        index.search(fact, k)
+
+    latencies, postings = [], 0
+    for fact in facts:
+        latencies.append(timed(lambda: index.search(fact, k)) * 1000)
+        terms, _ = retrieval_index.term_frequencies(fact)
+        postings += int((index.term_ptr[terms + 1] - index.term_ptr[terms]).sum())
+
+    latencies.sort()
+    print(f"\n📊 检索预筛（{index.num_docs} 个训练案例，{len(facts)} 条查询，top-{k}）：")
+    print(f"索引加载：{load_ms:.1f} ms")
+    print(f"查询延迟：平均 {sum(latencies) / len(latencies):.2f} ms，p50 {latencies[len(latencies) // 2]:.2f} ms，"
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms")
+    print(f"每条查询平均读取倒排记录 {postings / len(facts):,.0f} 条")
+
+
+def bench_jsonl(file_path=input_path):
+    """
+    对比 jsonl 解析吞吐与峰值内存（tracemalloc 统计的 Python 堆）：
+    原方式（逐行 json.loads 存入列表） vs jsonl_io 流式读取（标准库 json / orjson）。
+    """
+    def load_list():
+        data = []
+        with open(file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                data.append(json.loads(line.strip()))
+        return len(data)
+
+    def stream(orjson_enabled):
+        def run():
+            jsonl_io.use_orjson = orjson_enabled
+            return sum(1 for _ in iter_jsonl(file_path))
+        return run
+
+    methods = [("原方式（列表 + json）", load_list), ("流式 + json", stream(False))]
+    if jsonl_io.orjson is not None:
+        methods.append(("流式 + orjson", stream(True)))
+
+    print(f"\n📊 jsonl 解析对比（{file_path}）：")
+    default = jsonl_io.use_orjson
+    for name, fn in methods:
+        start = time.perf_counter()
+        num_lines = fn()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name}：{num_lines / elapsed:,.0f} 行/秒，峰值内存 {peak / 1024 / 1024:.2f} MB")
+    jsonl_io.use_orjson = default
+
+
+if __name__ == "__main__":
+    bench_prefix_cache(model_type="lora", num_cases=50)
+
+    # CPU 推理精度对比（fp32 / bf16 / int8）
+    # bench_precision(model_type="lora", precisions=("fp32", "bf16", "int8"), num_cases=20)
+
+    # LoRA 模型冷启动对比（需先导出合并模型）
+    # bench_cold_start()
+
+    # 流式推理首个罪名耗时
+    # bench_streaming(model_type="lora", num_cases=20)
+
+    # 投机解码接受率与单条耗时
+    # bench_speculative(model_type="lora", num_cases=20)
+
+    # 模板约束解码的解码步数与耗时
+    # bench_template(model_type="lora", num_cases=20)
+
+    # jsonl 解析吞吐与内存
+    # bench_jsonl("../data/final_all_data/exercise_contest/data_train.json")
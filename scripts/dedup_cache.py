@@ -0,0 +1,332 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from tqdm import tqdm
+from jsonl_io import iter_jsonl
+from generate_utils import format_output, default_generation_config
+from retrieval_index import ngram_features, fact_from_prompt, parse_response, normalize_accusation
+
+# 路径配置
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+train_path = os.path.join(BASE_DIR, "data", "train2.0.jsonl")
+test_path = os.path.join(BASE_DIR, "data", "test2.0.jsonl")
+overlap_path = os.path.join(BASE_DIR, "outputs", "train_test_overlap.json")
+dedup_path_pattern = os.path.join(BASE_DIR, "outputs", "dedup_cache_{model_type}.npz")  # 按模型分别保存答案
+
+# MinHash / LSH 配置：num_perm = num_bands * band_rows
+shingle_size = 5
+num_bands = 16
+band_rows = 8                # 候选召回阈值约 (1 / num_bands) ** (1 / band_rows) ≈ 0.71
+similarity_threshold = 0.9   # 估计的 Jaccard 相似度不低于该值时复用已有答案
+seed = 42
+
+# 案情中的可变实体：日期、时间、金额 / 数量、人名（按顺序替换为占位符）
+_date_pattern = re.compile(r"\d{2,4}\s*年(?:\s*\d{1,2}\s*月)?(?:\s*\d{1,2}\s*日)?|\d{1,2}\s*月\s*\d{1,2}\s*日")
+_time_pattern = re.compile(r"\d{1,2}\s*时(?:\s*\d{1,2}\s*分)?(?:\s*许)?")
+_number_pattern = re.compile(r"\d+(?:[.,．]\d+)*|[零〇一二两三四五六七八九十百千万亿]+(?=[余多]?[元万千百克只人次件台辆个岁])")
+# 人名只认两种形态：“X某 / X某某”，或常见姓氏 + 一到两字名（均须紧跟在称谓之后）
+_surnames = (
+    "欧阳|司马|上官|诸葛|东方|皇甫|尉迟|公孙|慕容|长孙|宇文|司徒|夏侯|令狐|"
+    "[王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢"
+    "姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤常温康施文牛樊葛邢"
+    "安齐易乔伍庞颜倪庄聂章鲁岳翟殷詹申欧耿关兰焦俞左柳甘祝包宁尚符舒阮柯纪梅童凌毕单季裴霍涂成苗谷盛曲翁冉骆蓝路游辛靳管柴蒙鲍华喻祁蒲房滕屈饶解牟艾尤阳时穆农司卓古吉缪简车项连芦麦褚娄窦戚岑景党宫费卜冷晏席卫米柏宗瞿桂全佟应臧闵苟邬边卞姬师和仇栾隋商刁沙荣巫寇桑郎甄丛仲虞敖巩明佘池查麻苑迟邝]"
+)
+_name_pattern = re.compile(
+    r"(?:被告人|被害人|犯罪嫌疑人|嫌疑人|同案人|证人)"
+    r"([\u4e00-\u9fa5]{1,2}某{1,2}|(?:" + _surnames + r")[\u4e00-\u9fa5]{1,2}?"
+    r"(?=[，。、；：,;（(\s\d在于因与和及将以从到向被等持驾伙系的报称对家处所用趁采使携进经均]))"
+)
+# 伤情、后果、作案工具、身体部位等定罪量刑相关的字词，含有这些字的候选一律不当作人名替换
+_name_stop_words = (
+    "伤", "死", "亡", "残", "瘫", "昏", "迷", "血", "骨", "折",
+    "刀", "枪", "棍", "棒", "斧", "锤", "砖", "剪", "铲", "锄", "匕", "弹", "药", "毒", "火", "油", "绳",
+    "头", "颅", "脑", "面", "脸", "眼", "鼻", "耳", "嘴", "口", "牙", "颈", "喉", "肩", "胸", "腹", "肋", "背", "腰",
+    "臀", "手", "臂", "肘", "腕", "指", "腿", "膝", "脚", "足", "部", "身", "体", "肢", "脏", "肺", "肝", "脾", "肾",
+    "持", "刺", "砍", "捅", "打", "殴", "踢", "击", "撞", "咬", "掐", "勒",
+)
+
+# 由固定种子生成的 MinHash 参数（乘数取奇数）
+_rng = np.random.default_rng(seed)
+_hash_a = _rng.integers(1, 2 ** 63, size=num_bands * band_rows, dtype=np.uint64) | np.uint64(1)
+_hash_b = _rng.integers(0, 2 ** 63, size=num_bands * band_rows, dtype=np.uint64)
+
+
+def normalize_fact(fact):
+    """
+    规范化案情：人名（被告人、被害人等称谓之后的姓名，全文替换）、日期、时间、金额 / 数量替换为占位符，并去掉空白。
+    只有这些实体不同的模板化案情（如盗窃、赌博类）规范化后相同或几乎相同。
+    含伤情、后果、工具、身体部位用字的候选不替换，“致被害人轻伤”与“致被害人死亡”规范化后仍然不同。
+    """
+    names = {name for name in _name_pattern.findall(fact) if not any(word in name for word in _name_stop_words)}
+    for name in sorted(names, key=len, reverse=True):
+        fact = fact.replace(name, "某人")
+    fact = _date_pattern.sub("某日", fact)
+    fact = _time_pattern.sub("某时", fact)
+    fact = _number_pattern.sub("#", fact)
+    return re.sub(r"\s+", "", fact)
+
+
+def check_normalization():
+    """
+    规范化回归检查：只有人名 / 日期 / 金额不同的案情应当规范化为同一文本，
+    伤情、后果、工具、身体部位不同的案情不能相同。返回不符合预期的对数。
+    """
+    template = "{date}，被告人{defendant}在某小区内与被害人{victim}因琐事发生争执，{defendant}持{tool}捅刺被害人{part}，致被害人{outcome}。"
+    base = dict(date="2016年5月3日", defendant="王某", victim="李某某", tool="刀", part="胸部", outcome="轻伤")
+    same = [
+        dict(base, date="2017年8月12日", defendant="张某", victim="刘某"),
+        dict(base, defendant="陈小明", victim="赵某"),
+        dict(base, defendant="欧阳某", victim="黄伟"),
+    ]
+    different = [
+        dict(base, outcome="重伤"),
+        dict(base, outcome="死亡"),
+        dict(base, outcome="轻微伤"),
+        dict(base, tool="木棍"),
+        dict(base, part="头部"),
+        dict(base, part="左胸部"),
+    ]
+
+    expected = normalize_fact(template.format(**base))
+    failures = 0
+    for variant, should_match in [(variant, True) for variant in same] + [(variant, False) for variant in different]:
+        fact = template.format(**variant)
+        if (normalize_fact(fact) == expected) != should_match:
+            failures += 1
+            print(f"❌ 规范化{'应相同' if should_match else '应不同'}：{fact} -> {normalize_fact(fact)}")
+
+    # 不带称谓的写法：被害人之后直接跟伤情 / 部位
+    for first, second in [("致被害人轻伤", "致被害人死亡"), ("刺中被害人胸部", "刺中被害人腿部"), ("被害人左胸受伤", "被害人左腿受伤")]:
+        if normalize_fact(first) == normalize_fact(second):
+            failures += 1
+            print(f"❌ 规范化应不同：{first} / {second} -> {normalize_fact(first)}")
+
+    print(f"{'✅' if failures == 0 else '❌'} 规范化检查：{failures} 处不符合预期")
+    return failures
+
+
+def config_key(model_id, adapter_hash, generation_config):
+    """
+    条目键：(模型标识, adapter 哈希, 解码配置) 的 sha256，口径与 result_cache.make_key 相同（不含 prompt）。
+    只有键相同的条目之间互相复用答案。
+    """
+    payload = json.dumps([model_id, adapter_hash, generation_config], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fact_digest(normalized):
+    """ 规范化案情的 sha256，用于完全重复的快速判断 """
+    return hashlib.sha256(normalized.encode("utf-8")).digest()
+
+
+def minhash(normalized):
+    """
+    字符 shingle（长度 shingle_size，短文本退化为整段）的 MinHash 签名，(num_bands * band_rows,) uint32。
+    每个置换为 64 位乘加哈希的高 32 位。
+    """
+    size = min(shingle_size, max(len(normalized), 1))
+    shingles = np.unique(ngram_features(normalized, (size, size), 2 ** 32)).astype(np.uint64)
+    if len(shingles) == 0:
+        return np.full(len(_hash_a), np.iinfo(np.uint32).max, dtype=np.uint32)
+    hashed = (_hash_a[:, None] * shingles[None, :] + _hash_b[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+class DedupCache:
+    """
+    近重复案情的答案缓存：规范化案情后先按 sha256 查完全重复，
+    再用 MinHash 签名分段（LSH banding）召回候选，估计 Jaccard 相似度不低于 threshold 时复用最相似案例的答案。
+    每个条目带一个键（见 config_key），查询只在键相同的条目中进行；键为 None 的条目只与键为 None 的查询匹配。
+    path 不为 None 时从该文件加载，save() 写回。
+    """
+
+    def __init__(self, path=None, threshold=similarity_threshold):
+        self.path = path
+        self.threshold = threshold
+        self.signatures = []
+        self.answers = []
+        self.keys = []
+        self.digests = {}
+        self.buckets = [{} for _ in range(num_bands)]
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(path):
+            data = np.load(path, allow_pickle=False)
+            if "keys" not in data:
+                print(f"⚠️ 去重缓存 {path} 的条目没有记录模型与解码配置（旧格式），忽略已有条目")
+                return
+            answers, keys = json.loads(str(data["answers"])), json.loads(str(data["keys"]))
+            for signature, digest, answer, key in zip(data["signatures"], data["digests"], answers, keys):
+                self._insert(signature, bytes(digest), answer, key)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def _insert(self, signature, digest, answer, key=None):
+        entry = len(self.answers)
+        self.signatures.append(signature)
+        self.answers.append(answer)
+        self.keys.append(key)
+        self.digests.setdefault((key, digest), entry)
+        for band in range(num_bands):
+            self.buckets[band].setdefault((key, signature[band * band_rows:(band + 1) * band_rows].tobytes()), []).append(entry)
+
+    def add(self, fact, accusations, articles, key=None):
+        """ 登记一条已回答的案情（同一键下规范化后完全重复的案情只保留第一条），返回其所在的案例编号 """
+        normalized = normalize_fact(fact)
+        digest = fact_digest(normalized)
+        if (key, digest) not in self.digests:
+            self._insert(minhash(normalized), digest, [list(accusations), list(articles)], key)
+        return self.digests[(key, digest)]
+
+    def query(self, fact, key=None):
+        """
+        在键为 key 的条目中查询，返回 (相似度, 罪名列表, 法条列表, 案例编号)，没有相似度不低于 threshold 的案例时返回 None。
+        完全重复（规范化后相同）的相似度记为 1.0。不计入命中统计。
+        """
+        normalized = normalize_fact(fact)
+        entry = self.digests.get((key, fact_digest(normalized)))
+        if entry is not None:
+            return 1.0, *self.answers[entry], entry
+
+        signature = minhash(normalized)
+        candidates = set()
+        for band in range(num_bands):
+            candidates.update(self.buckets[band].get((key, signature[band * band_rows:(band + 1) * band_rows].tobytes()), ()))
+        if not candidates:
+            return None
+
+        candidates = sorted(candidates)
+        similarities = (np.stack([self.signatures[entry] for entry in candidates]) == signature).mean(axis=1)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return float(similarities[best]), *self.answers[candidates[best]], candidates[best]
+
+    def get(self, fact, key=None):
+        """ 命中返回 (accusations, articles)，未命中返回 None，并记录命中统计 """
+        match = self.query(fact, key)
+        if match is None:
+            self.misses += 1
+            return None
+        if match[0] >= 1.0:
+            self.exact_hits += 1
+        else:
+            self.near_hits += 1
+        return match[1], match[2]
+
+    def save(self, path=None):
+        """ 写入 npz（签名、sha256、JSON 编码的答案与条目键），先写临时文件再替换 """
+        path = path or self.path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digests = [None] * len(self.answers)
+        for (_, digest), entry in self.digests.items():
+            digests[entry] = digest
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            signatures=np.array(self.signatures, dtype=np.uint32).reshape(len(self.answers), num_bands * band_rows),
+            digests=np.array([np.frombuffer(digest, dtype=np.uint8) for digest in digests], dtype=np.uint8).reshape(-1, 32),
+            answers=np.array(json.dumps(self.answers, ensure_ascii=False)),
+            keys=np.array(json.dumps(self.keys)),
+        )
+        os.replace(tmp_path, path)
+
+    def report(self):
+        total = self.exact_hits + self.near_hits + self.misses
+        hit_rate = (self.exact_hits + self.near_hits) / total if total > 0 else 0.0
+        print(f"🪞 去重缓存：完全重复 {self.exact_hits}，近重复 {self.near_hits}，未命中 {self.misses}，"
+              f"命中率 {hit_rate:.2%}，当前条目 {len(self)}")
+
+
+def dedup_batch(dedup_cache, prompts, batch_fn, model_id=None, adapter_hash=None, **generation_kwargs):
+    """
+    在批量推理前查去重缓存：命中的 prompt 直接复用答案，只把未命中的交给 batch_fn，
+    有罪名的结果登记进缓存，按原顺序返回 (formatted_output, accusations, articles) 列表。
+    条目按 (model_id, adapter_hash, 解码配置) 区分；采样解码（do_sample=True）的结果是一次随机抽样，
+    不查询也不登记，直接交给 batch_fn。
+    """
+    config = dict(default_generation_config, **generation_kwargs)
+    if config["do_sample"]:
+        return batch_fn(prompts)
+
+    key = config_key(model_id, adapter_hash, config)
+    results = [None] * len(prompts)
+    pending = []
+    for i, prompt in enumerate(prompts):
+        cached = dedup_cache.get(fact_from_prompt(prompt), key)
+        if cached is None:
+            pending.append(i)
+        else:
+            results[i] = (format_output(*cached), *cached)
+
+    if pending:
+        for i, result in zip(pending, batch_fn([prompts[i] for i in pending])):
+            results[i] = result
+            if result[1]:
+                dedup_cache.add(fact_from_prompt(prompts[i]), result[1], result[2], key)
+    return results
+
+
+def report_overlap(train_path=train_path, test_path=test_path, output_path=overlap_path, threshold=similarity_threshold):
+    """
+    统计训练集与测试集的重复：规范化后完全相同、近重复（估计 Jaccard ≥ threshold），
+    以及重复样本中罪名与训练案例一致的比例（这部分泄漏会抬高评估指标）。
+    重复样本的测试集行号与对应训练集行号写入 output_path，可据此剔除后重新评估：
+    train_line 为匹配案例在训练集中首次出现的行号，train_lines 为规范化后与其完全相同的全部训练集行号。
+    """
+    cache = DedupCache(threshold=threshold)
+    train_lines = []  # 案例编号 -> 规范化后相同的训练集行号列表
+    num_train = 0
+    for line, data in enumerate(tqdm(iter_jsonl(train_path, errors="none"), desc="Indexing train")):
+        fact = fact_from_prompt(data.get("prompt", "")) if data is not None else ""
+        if fact:
+            entry = cache.add(fact, *parse_response(data.get("response", "")))
+            if entry == len(train_lines):
+                train_lines.append([])
+            train_lines[entry].append(line)
+            num_train += 1
+
+    num_test, exact, near, same_labels = 0, [], [], 0
+    for line, data in enumerate(tqdm(iter_jsonl(test_path, errors="none"), desc="Checking test")):
+        fact = data.get("fact", "") if data is not None else ""
+        if not fact:
+            continue
+        num_test += 1
+        match = cache.query(fact)
+        if match is None:
+            continue
+
+        similarity, accusations, _, entry = match
+        (exact if similarity >= 1.0 else near).append({
+            "line": line,
+            "train_line": train_lines[entry][0],
+            "train_lines": train_lines[entry],
+            "similarity": round(similarity, 4),
+        })
+        gold = {normalize_accusation(acc) for acc in data.get("meta", {}).get("accusation", [])}
+        same_labels += gold == set(accusations)
+
+    duplicates = len(exact) + len(near)
+    print(f"\n📊 训练集 {num_train} 条（规范化后去重 {len(cache)} 条），测试集 {num_test} 条：")
+    print(f"完全重复：{len(exact)} 条（{len(exact) / max(num_test, 1):.2%}）")
+    print(f"近重复（相似度 ≥ {threshold}）：{len(near)} 条（{len(near) / max(num_test, 1):.2%}）")
+    print(f"重复样本中罪名与训练案例一致：{same_labels}/{duplicates}（{same_labels / max(duplicates, 1):.2%}）")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump({"threshold": threshold, "num_test": num_test, "exact": exact, "near": near}, file, ensure_ascii=False, indent=2)
+    print(f"✅ 重复样本列表已保存至：{output_path}")
+
+
+if __name__ == "__main__":
+    # 人名规范化不误伤定罪量刑相关字词
+    check_normalization()
+
+    # 训练集 / 测试集重复检测
+    report_overlap()
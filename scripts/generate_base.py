@@ -1,73 +1,92 @@
-import torch
-from post_process_output import post_process_output
+from generate_utils import bind_model, batch_generate, stream_generate, prepare_tokenizer, PrefixCache, model_load_kwargs, quantize_dynamic_int8
+from speculative import speculative_generate
+from template_decode import template_generate
+from label_scoring import score_generate
+from dedup_cache import dedup_batch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
 # 路径配置
 base_model_path = "../models/DeepSeek-R1-Distill-Qwen-1.5B"
 
+# 推理精度："fp16"（GPU）、"bf16" / "fp32"（CPU）、"int8"（CPU 动态量化）
+default_precision = "fp16"
+
 # 全局变量
 tokenizer = None
 model = None
+prefix_cache = None
+model_precision = None
 
-def load_model():
+def load_model(precision=None):
     """
     仅加载基础模型，不加载 LoRA adapter。
+    - precision: 推理精度，默认 default_precision；CPU 主机可使用 "int8" 或 "bf16"
     """
-    global tokenizer, model
+    global tokenizer, model, prefix_cache, model_precision
 
     if tokenizer is None or model is None:
-        print("\n🔄 正在首次加载基础模型...")
+        model_precision = precision or default_precision
+        print(f"\n🔄 正在首次加载基础模型（{model_precision}）...")
         # 加载 Tokenizer
         tokenizer = AutoTokenizer.from_pretrained(base_model_path, trust_remote_code=True)
+        prepare_tokenizer(tokenizer)
 
         # 加载基础模型
         model = AutoModelForCausalLM.from_pretrained(
             base_model_path,
             trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="auto"
+            **model_load_kwargs(model_precision)
         )
+        if model_precision == "int8":
+            model = quantize_dynamic_int8(model)
         model.eval()
+
+        # 预计算固定指令头的 KV cache，后续请求直接复用
+        prefix_cache = PrefixCache(model, tokenizer)
     else:
         print("\n✅ 基础模型已加载，直接使用...")
 
 
-def generate_base(prompt):
+def generate_base(prompt, **generation_kwargs):
     """
     根据输入的 prompt，生成罪名与法条信息（仅使用基础模型）。
     返回格式化后的输出。
+    generation_kwargs 可覆盖默认生成参数，如 constrain_labels=True 开启合法标签约束解码。
+    """
+    # 单条推理即 batch_size=1 的批量推理
+    return generate_batch([prompt], batch_size=1, **generation_kwargs)[0]
+
+
+def generate_batch(prompts, batch_size=8, max_tokens=None, result_cache=None, dedup_cache=None, **generation_kwargs):
+    """
+    批量推理：左侧填充 + attention_mask，已结束的序列（eos 或 "输出结束"）提前移出 batch。
+    - max_tokens: 设置后按 token 长度分桶装箱，每批填充后 token 数不超过该预算
+    - result_cache: 结果缓存（ResultCache），配合 do_sample=False 的贪心解码可跨运行复用结果
+    - dedup_cache: 近重复去重缓存（DedupCache），规范化后与已回答案情足够相似的 prompt 直接复用答案，不经过模型；
+      只在模型、adapter 与解码配置都相同的条目间复用，采样解码（do_sample=True）时不生效
+    返回与 prompts 一一对应的 (formatted_output, accusations, articles) 列表。
     """
     # 检查模型是否已加载
     load_model()
 
-    # 编码输入
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-
-    # 生成输出
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=200,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.9,
-        )
-
-    # 解码输出
-    output_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # print(output_text)  # 调试用
+    model_id = f"{base_model_path}:{model_precision}"
 
-    # 解析罪名与法条信息
-    accusations, articles = post_process_output(output_text, prompt)
+    def run(prompts):
+        return batch_generate(
+            model, tokenizer, prompts, batch_size=batch_size, max_tokens=max_tokens, prefix_cache=prefix_cache,
+            result_cache=result_cache, model_id=model_id, adapter_hash=None, **generation_kwargs
+        )
 
-    # 格式化输出
-    accusation_str = "，".join(accusations) if accusations else "无"
-    articles_str = "，".join([f"《中华人民共和国刑法》第{article}条" for article in articles]) if articles else "无"
+    if dedup_cache is not None:
+        return dedup_batch(dedup_cache, prompts, run, model_id=model_id, adapter_hash=None, **generation_kwargs)
+    return run(prompts)
 
-    formatted_output = f"罪名：{accusation_str}\n法条：{articles_str}"
 
-    # 返回格式化输出和解析后的列表，方便后续处理
-    return formatted_output, accusations, articles
+# 单条推理的其他方式：绑定本模块的模型后转调对应的 *_generate（见 generate_utils.bind_model）
+stream_base = bind_model(stream_generate, load_model, lambda: (model, tokenizer, prefix_cache))
+speculative_base = bind_model(speculative_generate, load_model, lambda: (model, tokenizer, prefix_cache))
+template_base = bind_model(template_generate, load_model, lambda: (model, tokenizer, prefix_cache))
+score_base = bind_model(score_generate, load_model, lambda: (model, tokenizer, prefix_cache))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,452 @@
+import copy
+import time
+import torch
+from transformers import DynamicCache, LogitsProcessorList, TemperatureLogitsWarper, TopPLogitsWarper
+from post_process_output import post_process_output, IncrementalParser, IncrementalDecoder
+from batch_scheduler import schedule_batches, fixed_batches, padding_efficiency
+from label_trie import LabelConstraintProcessor
+from result_cache import make_key
+
+# 所有 prompt 共用的固定指令头（到 "案情描述如下：" 为止）
+prompt_header = (
+    "请根据以下案情判断罪名与适用法条，并按照以下格式输出：\n"
+    "罪名：XXX罪\n"
+    "法条：《中华人民共和国刑法》第XXX条\n"
+    "请不要重复案情内容，直接开始回答。\n\n"
+    "案情描述如下："
+)
+
+# 默认生成参数（与逐条生成保持一致）
+default_generation_config = {
+    "max_new_tokens": 200,
+    "do_sample": True,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "stop_on_sentinel": True,
+    "constrain_labels": False,
+}
+
+# 运行统计，由 reset_generation_stats 清零
+# - real_tokens / padded_tokens: 有效 token 与填充后 token
+# - decode_steps: 实际执行的逐行解码步数
+# - saved_tokens: 提前停止而省下的解码步数（相对 max_new_tokens）
+generation_stats = {
+    "real_tokens": 0,
+    "padded_tokens": 0,
+    "decode_steps": 0,
+    "saved_tokens": 0,
+}
+
+
+def reset_generation_stats():
+    for key in generation_stats:
+        generation_stats[key] = 0
+
+
+def report_generation_stats():
+    """
+    打印本次运行的填充效率与提前停止节省的解码步数。
+    """
+    real, padded = generation_stats["real_tokens"], generation_stats["padded_tokens"]
+    steps, saved = generation_stats["decode_steps"], generation_stats["saved_tokens"]
+    saved_ratio = saved / (steps + saved) if steps + saved > 0 else 0.0
+    print(f"🧮 填充效率：{padding_efficiency(real, padded):.4f}（有效 token {real} / 填充后 token {padded}）")
+    print(f"⏹️ 提前停止节省解码步数：{saved}（占 {saved_ratio:.2%}，实际解码 {steps} 步）")
+
+
+def format_output(accusations, articles):
+    """
+    将罪名与法条列表格式化为 "罪名：…\n法条：…" 字符串。
+    """
+    accusation_str = "，".join(accusations) if accusations else "无"
+    articles_str = "，".join([f"《中华人民共和国刑法》第{article}条" for article in articles]) if articles else "无"
+    return f"罪名：{accusation_str}\n法条：{articles_str}"
+
+
+def model_load_kwargs(precision):
+    """
+    各推理精度对应的 from_pretrained 参数：
+    - fp16: GPU 推理（device_map="auto"）
+    - bf16 / fp32: CPU 推理
+    - int8: 以 fp32 加载到 CPU，加载（及合并 LoRA）后再对 Linear 层做动态量化
+    """
+    if precision == "fp16":
+        return {"torch_dtype": torch.float16, "device_map": "auto"}
+    if precision == "bf16":
+        return {"torch_dtype": torch.bfloat16, "device_map": "cpu"}
+    if precision in ("fp32", "int8"):
+        return {"torch_dtype": torch.float32, "device_map": "cpu"}
+    raise ValueError(f"不支持的推理精度：{precision}")
+
+
+def quantize_dynamic_int8(model):
+    """
+    Linear 层 int8 动态量化（权重 int8，激活在推理时动态量化），仅适用于 CPU。
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_tokenizer(tokenizer):
+    """
+    批量推理要求左侧填充（生成从序列末尾继续），并且必须存在 pad_token。
+    """
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+class PrefixCache:
+    """
+    固定指令头的 KV cache：每次加载模型后计算一次，所有请求（单条或批量）复用，
+    prefill 只需覆盖案情部分。
+    注意：指令头与案情分开编码，二者交界处的分词可能与整体编码略有差异。
+    """
+
+    def __init__(self, model, tokenizer, header=prompt_header):
+        self.header = header
+        input_ids = tokenizer(header, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            outputs = model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True)
+        self.past_key_values = outputs.past_key_values
+        self.length = input_ids.shape[1]
+
+    def matches(self, prompts):
+        return all(prompt.startswith(self.header) for prompt in prompts)
+
+    def expand(self, batch_size):
+        """ 复制一份指令头 cache 并扩展到 batch_size 行（解码过程会原地修改 cache） """
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+
+def encode_prompts(model, tokenizer, prompts, prefix_cache=None):
+    """
+    编码一批 prompt（左侧填充），返回 (input_ids, attention_mask, past_key_values)。
+    若全部 prompt 以指令头开头，则只编码案情部分并复用指令头 cache，
+    此时 attention_mask 覆盖 "指令头 + 填充 + 案情"。
+    """
+    if prefix_cache is not None and prefix_cache.matches(prompts):
+        suffixes = [prompt[len(prefix_cache.header):] for prompt in prompts]
+        inputs = tokenizer(suffixes, return_tensors="pt", padding=True, add_special_tokens=False).to(model.device)
+        header_mask = inputs["attention_mask"].new_ones((len(prompts), prefix_cache.length))
+        attention_mask = torch.cat([header_mask, inputs["attention_mask"]], dim=-1)
+        past_key_values = prefix_cache.expand(len(prompts))
+    else:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        attention_mask = inputs["attention_mask"]
+        past_key_values = None
+
+    generation_stats["real_tokens"] += int(inputs["attention_mask"].sum())
+    generation_stats["padded_tokens"] += inputs["attention_mask"].numel()
+    return inputs["input_ids"], attention_mask, past_key_values
+
+
+class SentinelStoppingCriteria:
+    """
+    逐条判断生成文本是否已完整：
+    - 已生成结束标记 "输出结束"
+    - 或在完整的 罪名/法条 两行之后出现空行
+    按行号增量判断：每次只解码并扫描新增的 token，只保留结束标记长度的文本尾部与当前行的行首。
+    """
+
+    def __init__(self, tokenizer, sentinel="输出结束"):
+        self.tokenizer = tokenizer
+        self.sentinel = sentinel
+        self.states = {}
+
+    def __call__(self, row, tokens):
+        """ tokens 为第 row 行目前全部已生成的 token，返回该行是否应结束 """
+        state = self.states.get(row)
+        if state is None:
+            state = self.states[row] = {
+                "decoder": IncrementalDecoder(self.tokenizer),
+                "tail": "",                # 文本末尾 len(sentinel) - 1 个字符
+                "head": "",                # 当前行去掉前导空白后的前 3 个字符
+                "newline": False,          # 上一个字符是否为换行
+                "closed": False,           # 已出现空行（结果只取决于结束标记）
+                "accusation": False,
+                "article": False,
+            }
+        return self.feed(state, state["decoder"].feed(tokens))
+
+    def feed(self, state, text):
+        window = state["tail"] + text
+        if self.sentinel in window:
+            return True
+        state["tail"] = window[-(len(self.sentinel) - 1):]
+        if state["closed"]:
+            return False
+
+        for ch in text:
+            if ch != "\n":
+                if state["head"] or not ch.isspace():
+                    state["head"] = (state["head"] + ch)[:3]
+                state["newline"] = False
+                continue
+
+            # 第一个空行：之前的各行中需同时有罪名行与法条行
+            if state["newline"]:
+                state["closed"] = True
+                return state["accusation"] and state["article"]
+            state["accusation"] |= state["head"] == "罪名："
+            state["article"] |= state["head"] == "法条："
+            state["head"] = ""
+            state["newline"] = True
+        return False
+
+
+def build_logits_warpers(do_sample, temperature=1.0, top_p=1.0):
+    """
+    构建采样所需的 logits 处理器（贪心解码时为空）。
+    """
+    warpers = LogitsProcessorList()
+    if do_sample:
+        if temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p))
+    return warpers
+
+
+def decode_steps(model, tokenizer, input_ids, attention_mask, past_key_values=None, max_new_tokens=200,
+                 do_sample=True, temperature=1.0, top_p=1.0, stop_on_sentinel=True, constrain_labels=False):
+    """
+    带 KV cache 的逐步解码（生成器），每步产出本步新生成的 [(原始行号, token), ...]（不含 eos）。
+    past_key_values 非空时为已计算的前缀（如指令头），attention_mask 需覆盖前缀与 input_ids。
+    某行生成 eos 或满足 SentinelStoppingCriteria 后即从 batch 中移除，
+    其 KV cache 一并裁掉，后续解码步只计算仍未结束的行。
+    constrain_labels=True 时罪名与法条编号只能取 meta/ 中的合法值。
+    """
+    batch_size = input_ids.shape[0]
+    warpers = build_logits_warpers(do_sample, temperature, top_p)
+    stopping_criteria = SentinelStoppingCriteria(tokenizer) if stop_on_sentinel else None
+    constraint = LabelConstraintProcessor(tokenizer, batch_size) if constrain_labels else None
+
+    rows = list(range(batch_size))  # 仍在解码的行对应的原始行号
+    generated = [[] for _ in range(batch_size)]
+
+    # 左侧填充时位置编码从每行第一个有效 token 开始计数（填充位于前缀与案情之间时同样适用）
+    position_ids = attention_mask.long().cumsum(-1) - 1
+    position_ids.masked_fill_(attention_mask == 0, 1)
+    position_ids = position_ids[:, -input_ids.shape[1]:]
+
+    if past_key_values is None:
+        past_key_values = DynamicCache()
+    current_ids = input_ids
+
+    with torch.no_grad():
+        for _ in range(max_new_tokens):
+            outputs = model(
+                input_ids=current_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            generation_stats["decode_steps"] += len(rows)
+
+            # 选取下一个 token（先约束合法标签，再做采样截断）
+            scores = outputs.logits[:, -1, :].float()
+            if constraint is not None:
+                scores = constraint(rows, generated, scores)
+            scores = warpers(current_ids, scores)
+            if do_sample:
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(scores, dim=-1)
+
+            # 逐行判断是否结束
+            keep = []
+            step_tokens = []
+            for i, (row, token) in enumerate(zip(rows, next_tokens.tolist())):
+                if token == tokenizer.eos_token_id:
+                    continue
+                generated[row].append(token)
+                step_tokens.append((row, token))
+                if stopping_criteria and stopping_criteria(row, generated[row]):
+                    continue
+                keep.append(i)
+
+            if step_tokens:
+                yield step_tokens
+            if not keep:
+                break
+
+            # 移除已结束的行
+            next_positions = position_ids[:, -1:] + 1
+            if len(keep) < len(rows):
+                index = torch.tensor(keep, device=input_ids.device)
+                past_key_values.batch_select_indices(index)
+                attention_mask = attention_mask[index]
+                next_tokens = next_tokens[index]
+                next_positions = next_positions[index]
+                rows = [rows[i] for i in keep]
+
+            current_ids = next_tokens.unsqueeze(1)
+            position_ids = next_positions
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(rows), 1))], dim=-1)
+
+    generation_stats["saved_tokens"] += sum(max_new_tokens - len(tokens) for tokens in generated)
+
+
+def decode(model, tokenizer, input_ids, attention_mask, **config):
+    """
+    逐步解码直至所有行结束，返回每行新生成的 token 列表（不含 eos）。
+    """
+    generated = [[] for _ in range(input_ids.shape[0])]
+    for step_tokens in decode_steps(model, tokenizer, input_ids, attention_mask, **config):
+        for row, token in step_tokens:
+            generated[row].append(token)
+    return generated
+
+
+def generate_chunk(model, tokenizer, prompts, config, prefix_cache=None):
+    """
+    对一批 prompt 执行一次批量解码，返回 (formatted_output, accusations, articles) 列表。
+    """
+    # 编码输入（左侧填充，可复用指令头 cache）
+    input_ids, attention_mask, past_key_values = encode_prompts(model, tokenizer, prompts, prefix_cache)
+
+    # 生成输出（仅包含新生成部分）
+    new_tokens = decode(model, tokenizer, input_ids, attention_mask, past_key_values=past_key_values, **config)
+
+    results = []
+    for prompt, tokens in zip(prompts, new_tokens):
+        output_text = tokenizer.decode(tokens, skip_special_tokens=True)
+
+        # 解析罪名与法条信息
+        accusations, articles = post_process_output(output_text, prompt)
+        results.append((format_output(accusations, articles), accusations, articles))
+
+    return results
+
+
+def batch_generate(model, tokenizer, prompts, batch_size=8, max_tokens=None, prefix_cache=None,
+                   result_cache=None, model_id=None, adapter_hash=None, **generation_kwargs):
+    """
+    分批推理，左侧填充并携带 attention_mask。
+    - max_tokens 为空时按原顺序每 batch_size 条一批
+    - 否则按 token 长度排序装箱，每批填充后 token 数不超过 max_tokens、条数不超过 batch_size
+    - prefix_cache: 指令头 KV cache（PrefixCache），命中时只对案情部分做 prefill
+    - result_cache: 结果缓存（ResultCache），键为 (model_id, adapter_hash, 解码配置, prompt)；
+      命中的 prompt 不再推理，重复的 prompt 只推理一次。
+      只用于贪心解码（do_sample=False）：采样结果是一次随机抽样，不查询也不写入缓存
+    返回与 prompts 一一对应（原顺序）的 (formatted_output, accusations, articles) 列表。
+    """
+    config = dict(default_generation_config, **generation_kwargs)
+    results = [None] * len(prompts)
+    if config["do_sample"]:
+        result_cache = None
+
+    # 查询结果缓存，收集需要推理的 prompt（键 -> 原位置列表）
+    if result_cache is not None:
+        keys = [make_key(model_id, adapter_hash, config, prompt) for prompt in prompts]
+    else:
+        keys = list(range(len(prompts)))
+
+    pending = {}
+    for i, key in enumerate(keys):
+        if key in pending:
+            pending[key].append(i)
+            continue
+        cached = result_cache.get(key) if result_cache is not None else None
+        if cached is not None:
+            accusations, articles = cached
+            results[i] = (format_output(accusations, articles), accusations, articles)
+        else:
+            pending[key] = [i]
+
+    pending_keys = list(pending)
+    pending_prompts = [prompts[pending[key][0]] for key in pending_keys]
+
+    if max_tokens is None:
+        batches = fixed_batches(len(pending_prompts), batch_size)
+    else:
+        lengths = [len(ids) for ids in tokenizer(pending_prompts)["input_ids"]] if pending_prompts else []
+        batches = schedule_batches(lengths, max_tokens=max_tokens, max_batch_size=batch_size)
+
+    # 按批推理后写回原位置
+    for batch in batches:
+        chunk_results = generate_chunk(model, tokenizer, [pending_prompts[j] for j in batch], config, prefix_cache)
+        for j, result in zip(batch, chunk_results):
+            key = pending_keys[j]
+            for i in pending[key]:
+                results[i] = result
+            if result_cache is not None:
+                result_cache.put(key, result[1], result[2])
+
+    return results
+
+
+def stream_generate(model, tokenizer, prompt, prefix_cache=None, **generation_kwargs):
+    """
+    流式推理单条 prompt（生成器），按顺序产出事件字典：
+    - {"type": "token", "text": ...}：新生成的文本片段（不完整的多字节字符会留到下一步）
+    - {"type": "accusation" / "articles", "value": [...], "elapsed_ms": ...}：某一行生成完毕即解析出的字段
+    - {"type": "done", "output", "accusation", "relevant_articles", "time_to_first_charge_ms", "total_ms"}
+    解析结果与 generate_chunk 一致。
+    """
+    config = dict(default_generation_config, **generation_kwargs)
+    start = time.perf_counter()
+    parser = IncrementalParser()
+    time_to_first_charge = None
+
+    input_ids, attention_mask, past_key_values = encode_prompts(model, tokenizer, [prompt], prefix_cache)
+
+    tokens = []
+    emitted = ""
+    for step_tokens in decode_steps(model, tokenizer, input_ids, attention_mask,
+                                    past_key_values=past_key_values, **config):
+        tokens.extend(token for _, token in step_tokens)
+        text = tokenizer.decode(tokens, skip_special_tokens=True)
+        if text.endswith("\ufffd") or len(text) <= len(emitted):
+            continue
+
+        delta, emitted = text[len(emitted):], text
+        yield {"type": "token", "text": delta}
+
+        for field, value in parser.feed(delta):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if field == "accusation" and time_to_first_charge is None:
+                time_to_first_charge = elapsed_ms
+            yield {"type": field, "value": value, "elapsed_ms": elapsed_ms}
+
+    # 补齐末尾残留文本并解析最后一行
+    tail = tokenizer.decode(tokens, skip_special_tokens=True)[len(emitted):]
+    if tail:
+        yield {"type": "token", "text": tail}
+    for field, value in parser.feed(tail) + parser.close():
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if field == "accusation" and time_to_first_charge is None:
+            time_to_first_charge = elapsed_ms
+        yield {"type": field, "value": value, "elapsed_ms": elapsed_ms}
+
+    accusations, articles = parser.result()
+    yield {
+        "type": "done",
+        "output": format_output(accusations, articles),
+        "accusation": accusations,
+        "relevant_articles": articles,
+        "time_to_first_charge_ms": time_to_first_charge,
+        "total_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def bind_model(generate_fn, load_model, get_model):
+    """
+    将单条推理函数 generate_fn(model, tokenizer, prompt, prefix_cache=None, **kwargs)
+    包装为 fn(prompt, **kwargs)：调用时先 load_model()，再由 get_model() 取当前的 (model, tokenizer, prefix_cache)。
+    generate_lora / generate_base 用它导出流式、投机解码等单条推理函数（如 stream_lora）。
+    """
+    def bound(prompt, **kwargs):
+        # 检查模型是否已加载
+        load_model()
+        model, tokenizer, prefix_cache = get_model()
+        return generate_fn(model, tokenizer, prompt, prefix_cache=prefix_cache, **kwargs)
+
+    bound.__doc__ = generate_fn.__doc__
+    return bound
@@ -0,0 +1,164 @@
+import os
+import json
+import mmap
+
+# 可选依赖：安装了 orjson 时用它解析（更快，且可直接解析 memoryview，免去逐行复制）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+use_orjson = orjson is not None
+
+
+def loads(data):
+    """
+    解析一行 JSON，data 可以是 str / bytes / memoryview。
+    orjson 不接受的写法（如 NaN、超长整数）回退到标准库再解析一次。
+    """
+    if use_orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    序列化为一行 JSON。与原有输出保持同一格式（json.dumps + ensure_ascii=False），
+    保证结果文件逐字节一致，因此写入不走 orjson。
+    """
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _scan_lines(file_path, parse, start=0, end=None):
+    """
+    基于 mmap 逐行切分文件（不含换行符），对每行调用 parse 并产出结果。
+    行以 memoryview 切片传给 parse，不复制数据；切片在产出前释放，页面由内核按需换入换出，
+    内存占用与文件大小无关。
+    start / end 为字节范围，只处理起始位置落在 [start, end) 内的行（范围边界应位于行首，见 split_ranges）。
+    """
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+
+            with memoryview(mm) as view:
+                while start < end:
+                    line_end = mm.find(b"\n", start)
+                    if line_end == -1:
+                        line_end = size
+                    with view[start:line_end] as line:
+                        result = parse(line)
+                    yield result
+                    start = line_end + 1
+
+
+def split_ranges(file_path, num_chunks):
+    """
+    将文件按字节切分为约 num_chunks 段，每段边界对齐到行首，返回 [(start, end), ...]。
+    各段首尾相接覆盖整个文件，可分别交给不同进程读取（iter_jsonl 的 start / end 参数）。
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+
+    bounds = [0]
+    with open(file_path, "rb") as file:
+        for i in range(1, num_chunks):
+            offset = size * i // num_chunks
+            if offset <= bounds[-1]:
+                continue
+            # 从 offset 所在行的下一行行首开始切分
+            file.seek(offset - 1)
+            file.readline()
+            offset = file.tell()
+            if bounds[-1] < offset < size:
+                bounds.append(offset)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_lines(file_path):
+    """ 逐行读取文件，返回去掉首尾空白的 str """
+    return _scan_lines(file_path, lambda line: str(line, "utf-8").strip())
+
+
+def iter_jsonl(file_path, errors="skip", start=0, end=None):
+    """
+    流式读取 jsonl 文件，逐条产出解析后的对象。start / end 可限定读取的字节范围。
+    - errors="skip": 打印警告并跳过无法解析的行（含非法 UTF-8 编码的行）
+    - errors="none": 打印警告，无法解析的行产出 None（保持与输入按行对齐）
+    - errors="raise": 抛出 json.JSONDecodeError / UnicodeDecodeError
+    """
+    invalid = object()
+
+    def parse(line):
+        try:
+            return loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            if errors == "raise":
+                raise
+            print(f"⚠️ 无法解析行：{str(line, 'utf-8', 'replace').strip()}")
+            return invalid
+
+    for item in _scan_lines(file_path, parse, start, end):
+        if item is invalid:
+            if errors == "none":
+                yield None
+            continue
+        yield item
+
+
+def load_jsonl(file_path, errors="skip"):
+    """ 加载 jsonl 文件，返回列表（需要随机访问或预先校验条数时使用） """
+    return list(iter_jsonl(file_path, errors=errors))
+
+
+class JsonlWriter:
+    """
+    缓冲批量写入 jsonl：攒满 buffer_lines 行后一次性编码写入文件。
+    flush(sync=True) 额外 fsync 落盘，返回本次写入的字节数。
+    """
+
+    def __init__(self, file_path, mode="w", buffer_lines=1000):
+        self.file = open(file_path, mode.replace("b", "") + "b")
+        self.buffer_lines = buffer_lines
+        self.buffer = []
+        self.bytes_written = 0
+
+    def write(self, obj):
+        self.buffer.append(dumps(obj))
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self, sync=False):
+        written = 0
+        if self.buffer:
+            content = ("\n".join(self.buffer) + "\n").encode("utf-8")
+            self.file.write(content)
+            self.buffer = []
+            written = len(content)
+            self.bytes_written += written
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+        return written
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
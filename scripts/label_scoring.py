@@ -0,0 +1,183 @@
+import numpy as np
+import torch
+from transformers import DynamicCache
+from generate_utils import encode_prompts, format_output
+from label_trie import TokenTrie, ACTION, load_txt, encode, accu_path, law_path
+
+# 回答模板中的固定片段（与 prepare_dataset.format_response 一致）
+accusation_prefix = "罪名："
+article_prefix = "法条：《中华人民共和国刑法》第"
+
+# 默认打分参数：归一化概率不低于 threshold 的标签入选（至少 1 个、至多 max_labels 个）
+default_scoring_config = {
+    "threshold": 0.2,
+    "max_labels": 5,
+}
+
+# 按 tokenizer 缓存打分用的标签前缀树（叶子记录标签）
+_scoring_trie_cache = {}
+
+
+def build_scoring_tries(tokenizer, accusations, articles):
+    """
+    打分用的前缀树，叶子结点的 ACTION 记录对应标签：
+    - 罪名：每个罪名（可带 "罪" 字）后接 "，" 或换行，同一罪名的多条路径概率相加
+    - 法条：编号后接 "条"
+    路径包含结束符，可区分互为前缀的标签。
+    """
+    charge_trie = TokenTrie()
+    for accusation in accusations:
+        for variant in (accusation, accusation + "罪"):
+            for end in ("，", "\n"):
+                charge_trie.insert(encode(tokenizer, variant) + encode(tokenizer, end), accusation)
+
+    article_trie = TokenTrie()
+    for article in articles:
+        article_trie.insert(encode(tokenizer, str(article)) + encode(tokenizer, "条"), int(article))
+    return charge_trie, article_trie
+
+
+def get_scoring_tries(tokenizer):
+    """ meta/ 中全部罪名与法条的打分前缀树（按 tokenizer 缓存） """
+    key = getattr(tokenizer, "name_or_path", id(tokenizer))
+    if key not in _scoring_trie_cache:
+        _scoring_trie_cache[key] = build_scoring_tries(tokenizer, load_txt(accu_path), load_txt(law_path))
+    return _scoring_trie_cache[key]
+
+
+def flatten_trie(trie):
+    """
+    深度优先展开前缀树的内部结点（不含根结点与叶子），返回 (tokens, parents, depths, edges)：
+    - tokens / parents / depths: 每个内部结点的 token、父结点序号（根为 -1）与深度
+    - edges: [(父结点序号, token, 子结点序号或 None, 叶子标签或 None), ...]，按父结点先于子结点排列
+    """
+    tokens, parents, depths, edges = [], [], [], []
+    stack = [(trie.root, -1, 0)]
+    while stack:
+        node, index, depth = stack.pop()
+        for token, child in node.items():
+            if token == ACTION:
+                continue
+            if ACTION in child:
+                edges.append((index, token, None, child[ACTION]))
+            if any(key != ACTION for key in child):
+                tokens.append(token)
+                parents.append(index)
+                depths.append(depth + 1)
+                edges.append((index, token, len(tokens) - 1, None))
+                stack.append((child, len(tokens) - 1, depth + 1))
+    return tokens, parents, depths, edges
+
+
+def tree_attention_mask(num_past, num_prefix, parents, dtype, device):
+    """
+    4D 加性注意力掩码 (1, 1, 查询数, num_past + 查询数)：查询为 num_prefix 个前缀 token 加前缀树结点。
+    前缀按因果掩码；每个结点可见全部已缓存 token、全部前缀以及自己的祖先结点，不同分支互不可见。
+    """
+    num_nodes = len(parents)
+    visible = np.zeros((num_prefix + num_nodes, num_prefix + num_nodes), dtype=bool)
+    visible[:num_prefix, :num_prefix] = np.tril(np.ones((num_prefix, num_prefix), dtype=bool))
+    visible[num_prefix:, :num_prefix] = True
+    for i, parent in enumerate(parents):
+        row = num_prefix + i
+        if parent >= 0:
+            visible[row] = visible[num_prefix + parent]
+        visible[row, row] = True
+
+    visible = np.concatenate([np.ones((len(visible), num_past), dtype=bool), visible], axis=1)
+    mask = torch.zeros(visible.shape, dtype=dtype, device=device)
+    mask.masked_fill_(~torch.from_numpy(visible).to(device), torch.finfo(dtype).min)
+    return mask[None, None]
+
+
+def score_trie(model, past_key_values, num_past, prefix_ids, trie):
+    """
+    一次前向为前缀树中全部标签打分：查询 = prefix_ids（接在已缓存的 num_past 个 token 之后）+ 树的内部结点。
+    返回 {标签: 对数似然}（同一标签多条路径取 logsumexp）。
+    前向结束后 KV cache 裁回 num_past + len(prefix_ids)，树结点不保留。
+    """
+    tokens, parents, depths, edges = flatten_trie(trie)
+    num_prefix = len(prefix_ids)
+    device = model.device
+
+    input_ids = torch.tensor([list(prefix_ids) + tokens], device=device)
+    position_ids = torch.tensor([list(range(num_past, num_past + num_prefix)) +
+                                 [num_past + num_prefix - 1 + depth for depth in depths]], device=device)
+    attention_mask = tree_attention_mask(num_past, num_prefix, parents, model.dtype, device)
+
+    with torch.no_grad():
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                        past_key_values=past_key_values, use_cache=True)
+    outputs.past_key_values.crop(num_past + num_prefix)
+
+    # 第 num_prefix - 1 行预测根结点的子结点，第 num_prefix + i 行预测结点 i 的子结点
+    log_probs = torch.log_softmax(outputs.logits[0, num_prefix - 1:].float(), dim=-1).cpu().numpy()
+    node_scores = np.zeros(len(tokens))
+    label_scores = {}
+    for parent, token, child, label in edges:
+        score = (node_scores[parent] if parent >= 0 else 0.0) + log_probs[parent + 1, token]
+        if child is not None:
+            node_scores[child] = score
+        else:
+            label_scores[label] = np.logaddexp(label_scores.get(label, -np.inf), score)
+    return label_scores
+
+
+def rank_labels(label_scores, threshold=0.2, max_labels=5):
+    """
+    对数似然在候选标签上做 softmax 归一化，按概率降序返回 [(标签, 概率), ...] 与入选的标签列表：
+    概率不低于 threshold 的标签入选，至少 1 个、至多 max_labels 个。
+    """
+    labels = list(label_scores)
+    scores = np.array([label_scores[label] for label in labels])
+    probs = np.exp(scores - scores.max())
+    probs /= probs.sum()
+
+    ranked = [(labels[i], float(probs[i])) for i in np.argsort(-probs, kind="stable")]
+    selected = [label for label, prob in ranked[:max_labels] if prob >= threshold] or [ranked[0][0]]
+    return ranked, selected
+
+
+def score_labels(model, tokenizer, prompt, prefix_cache=None, threshold=0.2, max_labels=5, accusations=None, articles=None):
+    """
+    似然打分预测（单条）：
+    1. 一次前向：案情 + "罪名：" 之后挂接罪名前缀树，得到全部罪名的似然
+    2. 一次前向：接入选罪名与 "法条：《中华人民共和国刑法》第" 之后挂接法条前缀树，得到全部法条的似然
+    accusations / articles 不为空时只在这些候选中打分（如检索预筛得到的候选），不在 meta/ 中的标签被忽略。
+    返回 (罪名排序, 入选罪名, 法条排序, 入选法条)，排序为 [(标签, 归一化概率), ...]。
+    """
+    charge_trie, article_trie = get_scoring_tries(tokenizer)
+    if accusations or articles:
+        legal_accusations, legal_articles = set(load_txt(accu_path)), set(load_txt(law_path))
+        accusations = [acc for acc in accusations or [] if acc in legal_accusations]
+        articles = [art for art in articles or [] if str(art) in legal_articles]
+        subset_charge_trie, subset_article_trie = build_scoring_tries(tokenizer, accusations, articles)
+        charge_trie = subset_charge_trie if accusations else charge_trie
+        article_trie = subset_article_trie if articles else article_trie
+    input_ids, attention_mask, past_key_values = encode_prompts(model, tokenizer, [prompt], prefix_cache)
+    if past_key_values is None:
+        past_key_values = DynamicCache()
+    num_past = attention_mask.shape[1] - input_ids.shape[1]
+
+    # 罪名
+    prefix_ids = input_ids[0].tolist() + encode(tokenizer, accusation_prefix)
+    charge_scores = score_trie(model, past_key_values, num_past, prefix_ids, charge_trie)
+    ranked_accusations, accusations = rank_labels(charge_scores, threshold, max_labels)
+    num_past += len(prefix_ids)
+
+    # 法条（以入选罪名为上下文）
+    prefix_ids = encode(tokenizer, "，".join(accusations) + "\n" + article_prefix)
+    article_scores = score_trie(model, past_key_values, num_past, prefix_ids, article_trie)
+    ranked_articles, articles = rank_labels(article_scores, threshold, max_labels)
+
+    return ranked_accusations, accusations, ranked_articles, articles
+
+
+def score_generate(model, tokenizer, prompt, prefix_cache=None, **scoring_kwargs):
+    """
+    似然打分预测单条 prompt，返回与生成函数相同的 (formatted_output, accusations, articles)，
+    罪名与法条按概率降序排列。
+    """
+    config = dict(default_scoring_config, **scoring_kwargs)
+    _, accusations, _, articles = score_labels(model, tokenizer, prompt, prefix_cache=prefix_cache, **config)
+    return format_output(accusations, articles), accusations, articles
@@ -0,0 +1,162 @@
+import os
+import torch
+from post_process_output import IncrementalDecoder
+
+# 路径配置
+base_dir = os.path.dirname(__file__)
+accu_path = os.path.join(base_dir, "..", "meta", "accu.txt")
+law_path = os.path.join(base_dir, "..", "meta", "law.txt")
+
+# 叶子结点上记录匹配完成后的动作："next" 继续下一个标签，"done" 退出约束
+ACTION = "action"
+
+# 按 tokenizer 缓存已构建的前缀树，避免重复编码
+_trie_cache = {}
+
+
+def load_txt(file_path):
+    """ 加载 txt 文件，返回按原顺序去重的列表 """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
+
+def encode(tokenizer, text):
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+class TokenTrie:
+    """
+    token 级前缀树：结点为 {token_id: 子结点}，叶子结点额外记录 ACTION。
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, token_ids, action):
+        node = self.root
+        for token_id in token_ids:
+            node = node.setdefault(token_id, {})
+        node[ACTION] = action
+
+    @staticmethod
+    def allowed_tokens(node):
+        return [key for key in node if key != ACTION]
+
+
+def build_charge_trie(tokenizer, accusations, actions=("next", "done")):
+    """
+    罪名前缀树：每个罪名（可带 "罪" 字后缀）后接 "，"（继续下一个罪名）或换行（结束）。
+    actions 只含 "done" 时罪名后只能接换行（用于最后一个允许的罪名）。
+    """
+    separators = {"next": "，", "done": "\n"}
+    trie = TokenTrie()
+    for accusation in accusations:
+        for variant in (accusation, accusation + "罪"):
+            for action in actions:
+                trie.insert(encode(tokenizer, variant) + encode(tokenizer, separators[action]), action)
+    return trie
+
+
+def build_article_trie(tokenizer, articles):
+    """
+    法条前缀树：合法法条编号后必须接 "条"。
+    """
+    trie = TokenTrie()
+    for article in articles:
+        trie.insert(encode(tokenizer, str(article)) + encode(tokenizer, "条"), "done")
+    return trie
+
+
+def get_label_tries(tokenizer):
+    """
+    从 meta/accu.txt 与 meta/law.txt 构建（并缓存）罪名与法条前缀树。
+    """
+    key = getattr(tokenizer, "name_or_path", id(tokenizer))
+    if key not in _trie_cache:
+        accusations = load_txt(accu_path)
+        articles = [int(article) for article in load_txt(law_path)]
+        _trie_cache[key] = (build_charge_trie(tokenizer, accusations), build_article_trie(tokenizer, articles))
+    return _trie_cache[key]
+
+
+class LabelConstraintProcessor:
+    """
+    约束解码：生成 "罪名：" 之后只允许拼出合法罪名，在 "法条：" 行内生成 "第" 之后只允许拼出合法法条编号。
+    其余位置不做限制。每行维护 (前缀树, 当前结点, 已处理 token 数) 状态，按原始行号索引。
+    """
+
+    def __init__(self, tokenizer, batch_size, charge_trie=None, article_trie=None):
+        self.tokenizer = tokenizer
+        default_charge_trie, default_article_trie = get_label_tries(tokenizer)
+        self.charge_trie = charge_trie or default_charge_trie
+        self.article_trie = article_trie or default_article_trie
+        self.states = [None] * batch_size
+        self.consumed = [0] * batch_size
+        # 增量解码：每行只保留文本末尾 3 个字符与当前行去掉前导空白后的前 3 个字符
+        self.decoders = [IncrementalDecoder(tokenizer) for _ in range(batch_size)]
+        self.tails = [""] * batch_size
+        self.heads = [""] * batch_size
+
+    def _feed_text(self, row, tokens):
+        """ 解码该行新增的 token，更新文本末尾与当前行行首 """
+        text = self.decoders[row].feed(tokens)
+        if not text:
+            return
+        head, line = self.heads[row], text
+        if "\n" in text:
+            head, line = "", text.rsplit("\n", 1)[1]
+        self.heads[row] = (head + (line if head else line.lstrip()))[:3]
+        self.tails[row] = (self.tails[row] + text)[-3:]
+
+    def _trigger(self, row):
+        """ 根据已生成文本判断是否进入约束状态（末尾字符不完整时不触发） """
+        if self.decoders[row].pending:
+            return None
+        if self.tails[row].endswith("罪名："):
+            return self.charge_trie
+        if self.tails[row].endswith("第") and self.heads[row] == "法条：":
+            return self.article_trie
+        return None
+
+    def _update(self, row, tokens):
+        """ 用新生成的 token 推进该行的状态 """
+        for token in tokens[self.consumed[row]:]:
+            state = self.states[row]
+            if state is None:
+                continue
+            trie, node = state
+            node = node.get(token)
+            if node is None:
+                # 理论上不会出现（已被屏蔽），保险起见退出约束
+                self.states[row] = None
+            elif node.get(ACTION) == "next":
+                self.states[row] = (trie, trie.root)
+            elif node.get(ACTION) == "done":
+                self.states[row] = None
+            else:
+                self.states[row] = (trie, node)
+        self.consumed[row] = len(tokens)
+        self._feed_text(row, tokens)
+
+        if self.states[row] is None:
+            trie = self._trigger(row)
+            if trie is not None:
+                self.states[row] = (trie, trie.root)
+
+    def __call__(self, rows, generated, scores):
+        """
+        - rows: 当前 batch 各行对应的原始行号
+        - generated: 按原始行号索引的已生成 token 列表
+        - scores: 当前步的 logits，形状 (len(rows), vocab_size)
+        """
+        for i, row in enumerate(rows):
+            self._update(row, generated[row])
+            if self.states[row] is None:
+                continue
+
+            _, node = self.states[row]
+            allowed = torch.tensor(TokenTrie.allowed_tokens(node), device=scores.device)
+            mask = torch.full_like(scores[i], float("-inf"))
+            mask[allowed] = 0
+            scores[i] = scores[i] + mask
+        return scores
@@ -0,0 +1,65 @@
+import json
+import time
+import asyncio
+import aiohttp
+from jsonl_io import iter_jsonl
+from serve import percentile
+
+# 压测配置
+server_url = "http://127.0.0.1:8000"
+input_path = "../data/test2.0.jsonl"
+concurrency = 32      # 并发客户端数
+num_requests = 200    # 请求总数
+
+
+def load_facts(file_path, num_facts):
+    facts = []
+    for item in iter_jsonl(file_path, errors="raise"):
+        fact = item.get("fact", "")
+        if fact:
+            facts.append(fact)
+        if len(facts) >= num_facts:
+            break
+    return facts
+
+
+async def run_load_test():
+    """
+    以固定并发向 /predict 发送请求，统计客户端延迟与吞吐，并拉取服务端指标。
+    """
+    facts = load_facts(input_path, num_requests)
+    queue = asyncio.Queue()
+    for fact in facts:
+        queue.put_nowait(fact)
+
+    latencies = []
+    errors = 0
+
+    async def client(session):
+        nonlocal errors
+        while not queue.empty():
+            fact = queue.get_nowait()
+            start = time.perf_counter()
+            async with session.post(f"{server_url}/predict", json={"fact": fact}) as response:
+                await response.json()
+                if response.status != 200:
+                    errors += 1
+                    continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start_time = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+
+        async with session.get(f"{server_url}/metrics") as response:
+            server_metrics = await response.json()
+
+    print(f"\n📊 压测结果（并发 {concurrency}，请求 {len(facts)} 条）：")
+    print(f"吞吐：{len(latencies) / elapsed:.2f} 条/秒，失败 {errors} 条")
+    print(f"客户端延迟：p50 = {percentile(latencies, 50):.1f} ms，p99 = {percentile(latencies, 99):.1f} ms")
+    print(f"服务端指标：{json.dumps(server_metrics, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load_test())
@@ -1,5 +1,29 @@
 import re
 
+def parse_line(line):
+    """
+    解析单行文本，返回该行中的 (accusations, articles)。
+    """
+    accusations = []
+    articles = []
+    line = line.strip()
+
+    # 提取罪名部分
+    if line.startswith("罪名："):
+        # 去掉 "罪名：" 前缀并分割多个罪名
+        accusations = [acc.strip() for acc in line[3:].split("，")]
+
+    # 提取法条部分
+    elif line.startswith("法条："):
+        # 去掉 "法条：" 前缀并分割多个法条
+        for article in line[3:].split("，"):
+            # 使用正则提取法条编号（仅数字部分）
+            match = re.search(r"第(\d+)条", article)
+            if match:
+                articles.append(int(match.group(1)))
+
+    return accusations, articles
+
 def post_process_output(output_text, prompt):
     """
     - 移除 prompt 部分
@@ -21,26 +45,94 @@ def post_process_output(output_text, prompt):
     # 4. 逐行扫描并提取罪名和法条
     lines = output_text.strip().split("\n")
     for line in lines:
-        line = line.strip()
-
-        # 提取罪名部分
-        if line.startswith("罪名："):
-            # 去掉 "罪名：" 前缀并分割多个罪名
-            extracted_accusations = [acc.strip() for acc in line[3:].split("，")]
-            accusations.extend(extracted_accusations)
-
-        # 提取法条部分
-        elif line.startswith("法条："):
-            # 去掉 "法条：" 前缀并分割多个法条
-            extracted_articles = line[3:].split("，")
-            for article in extracted_articles:
-                # 使用正则提取法条编号（仅数字部分）
-                match = re.search(r"第(\d+)条", article)
-                if match:
-                    articles.append(int(match.group(1)))
+        line_accusations, line_articles = parse_line(line)
+        accusations.extend(line_accusations)
+        articles.extend(line_articles)
 
     # 5. 去重
     accusations = list(set(accusations))
     articles = list(set(articles))
 
     return accusations, articles
+
+class IncrementalDecoder:
+    """
+    增量解码 token 序列：每次只解码上次之后新增的 token，返回新增的文本。
+    末尾为不完整的多字节字符（解码出 "\ufffd"）时暂不输出，留到下一次与后续 token 一起解码。
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.offset = 0
+        self.pending = False  # 是否有尚未输出的不完整字符
+
+    def feed(self, tokens):
+        """ tokens 为该序列目前全部已生成的 token（只会追加），返回新增文本 """
+        text = self.tokenizer.decode(tokens[self.offset:], skip_special_tokens=True)
+        self.pending = text.endswith("\ufffd")
+        if self.pending:
+            return ""
+        self.offset = len(tokens)
+        return text
+
+class IncrementalParser:
+    """
+    增量解析流式生成的文本：每次 feed 只处理新增部分，出现完整行时才解析该行，
+    不必在每个 token 到达时重新扫描全文。最终结果与 post_process_output 一致。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.accusations = []
+        self.articles = []
+        self.finished = False
+
+    def _parse(self, line):
+        """ 解析一行，返回新解析出的字段 [("accusation", [...]) / ("articles", [...])] """
+        line_accusations, line_articles = parse_line(line)
+        self.accusations.extend(line_accusations)
+        self.articles.extend(line_articles)
+
+        events = []
+        if line_accusations:
+            events.append(("accusation", line_accusations))
+        if line_articles:
+            events.append(("articles", line_articles))
+        return events
+
+    def feed(self, text):
+        """
+        追加一段新生成的文本，返回其中已完成行解析出的字段。
+        """
+        if self.finished:
+            return []
+
+        self.buffer += text
+        events = []
+
+        # 遇到 "输出结束" 后忽略其后的全部内容
+        if "输出结束" in self.buffer:
+            self.buffer = self.buffer.split("输出结束")[0]
+            self.finished = True
+
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            events.extend(self._parse(line))
+
+        if self.finished:
+            events.extend(self._parse(self.buffer))
+            self.buffer = ""
+        return events
+
+    def close(self):
+        """
+        生成结束时解析缓冲区中剩余的最后一行。
+        """
+        events = [] if self.finished else self._parse(self.buffer)
+        self.buffer = ""
+        self.finished = True
+        return events
+
+    def result(self):
+        """ 返回去重后的 (accusations, articles) """
+        return list(set(self.accusations)), list(set(self.articles))
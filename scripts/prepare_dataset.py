@@ -1,13 +1,17 @@
 import os
-import json
+import shutil
+import tempfile
+from multiprocessing import Pool
 from tqdm import tqdm
+from jsonl_io import iter_jsonl, split_ranges, JsonlWriter
 
 # 输入输出路径
 input_path = os.path.join(os.path.dirname(__file__), "..", "data", "final_all_data", "exercise_contest", "data_test.json")
 output_path = os.path.join(os.path.dirname(__file__), "..", "data", "train2.0.jsonl")
 
-multi_accu_count = 0
-multi_article_count = 0
+# 并行配置
+num_workers = os.cpu_count() or 1
+chunk_mb = 64   # 每个分块的大约字节数（MB），分块数至少为进程数的 4 倍以均衡负载
 
 # 模板配置（改得更明确 + 更结构化）
 def format_prompt(fact_text):
@@ -25,41 +29,78 @@ def format_response(accusations, articles):
     return f"罪名：{accusation_str}\n法条：{articles_str}\n输出结束"
 
 
-# 加载原始数据
-raw_data = []
-with open(input_path, 'r', encoding='utf-8') as f:
-    for line in f:
-        raw_data.append(json.loads(line.strip()))
+def process_chunk(task):
+    """
+    子进程：读取 [start, end) 字节范围内的原始数据，转换后写入分片文件。
+    返回 (分片路径, 样本数, 多罪名样本数, 多法条样本数, 分块字节数)。
+    """
+    input_path, shard_path, start, end = task
+    sample_count = 0
+    multi_accu_count = 0
+    multi_article_count = 0
 
-# 构建新数据结构
-new_data = []
-for item in tqdm(raw_data):
-    fact = item.get("fact", "")
-    meta = item.get("meta", {})
-    accusations = meta.get("accusation", [])
-    articles = meta.get("relevant_articles", [])
+    with JsonlWriter(shard_path) as writer:
+        for item in iter_jsonl(input_path, errors="raise", start=start, end=end):
+            fact = item.get("fact", "")
+            meta = item.get("meta", {})
+            accusations = meta.get("accusation", [])
+            articles = meta.get("relevant_articles", [])
 
-    if not fact or not accusations or not articles:
-        continue
+            if not fact or not accusations or not articles:
+                continue
 
-    # 多标签统计
-    if len(accusations) > 1:
-        multi_accu_count += 1
-    if len(articles) > 1:
-        multi_article_count += 1
+            # 多标签统计
+            if len(accusations) > 1:
+                multi_accu_count += 1
+            if len(articles) > 1:
+                multi_article_count += 1
 
-    prompt = format_prompt(fact)
-    response = format_response(accusations, articles)
+            prompt = format_prompt(fact)
+            response = format_response(accusations, articles)
 
-    new_data.append({"prompt": prompt, "response": response})
+            writer.write({"prompt": prompt, "response": response})
+            sample_count += 1
 
+    return shard_path, sample_count, multi_accu_count, multi_article_count, end - start
 
-# 写入新文件
-with open(output_path, 'w', encoding='utf-8') as f:
-    for sample in new_data:
-        f.write(json.dumps(sample, ensure_ascii=False) + "\n")
 
-print(f"✅ 共生成训练样本 {len(new_data)} 条，已保存至 {output_path}")
-print(f"📊 多罪名样本数量：{multi_accu_count}")
-print(f"📊 多法条样本数量：{multi_article_count}")
+def prepare_dataset(input_path, output_path, num_workers=num_workers, chunk_mb=chunk_mb):
+    """
+    按字节范围将原始数据切分为多个分块，多进程并行转换，各自写入分片文件，
+    最后按分块顺序拼接为输出文件（与单进程逐条处理的结果逐字节一致）。
+    """
+    file_size = os.path.getsize(input_path)
+    num_chunks = max(num_workers * 4, -(-file_size // (chunk_mb * 1024 * 1024)))
+    ranges = split_ranges(input_path, num_chunks)
 
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    shard_dir = tempfile.mkdtemp(prefix=".shards_", dir=output_dir)
+    tasks = [(input_path, os.path.join(shard_dir, f"{i:05d}.jsonl"), start, end) for i, (start, end) in enumerate(ranges)]
+
+    sample_count = 0
+    multi_accu_count = 0
+    multi_article_count = 0
+    try:
+        with Pool(num_workers) as pool, open(output_path, "wb") as output, \
+                tqdm(total=file_size, unit="B", unit_scale=True) as progress:
+            # imap 按提交顺序返回结果，分片按顺序拼接
+            for shard_path, samples, multi_accu, multi_article, size in pool.imap(process_chunk, tasks):
+                with open(shard_path, "rb") as shard:
+                    shutil.copyfileobj(shard, output)
+                os.remove(shard_path)
+
+                sample_count += samples
+                multi_accu_count += multi_accu
+                multi_article_count += multi_article
+                progress.update(size)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    print(f"✅ 共生成训练样本 {sample_count} 条，已保存至 {output_path}（{len(ranges)} 个分块，{num_workers} 个进程）")
+    print(f"📊 多罪名样本数量：{multi_accu_count}")
+    print(f"📊 多法条样本数量：{multi_article_count}")
+
+
+if __name__ == "__main__":
+    prepare_dataset(input_path, output_path)
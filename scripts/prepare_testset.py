@@ -1,74 +1,186 @@
 import os
-import json
+import re
 import random
+from jsonl_io import iter_jsonl, JsonlWriter
 
 # 路径配置
 input_path = os.path.join(os.path.dirname(__file__), "..", "data", "final_all_data", "exercise_contest", "data_train.json")
 output_path = os.path.join(os.path.dirname(__file__), "..", "data", "test2.0.jsonl")
+accu_path = os.path.join(os.path.dirname(__file__), "..", "meta", "accu.txt")
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-def prepare_testset(input_path, output_path, sample_size=3000, method="random"):
+def normalize_accusation(acc):
+    """ 去掉中括号和‘罪’字 """
+    acc = re.sub(r"[\[\]]", "", acc).strip()
+    return acc[:-1] if acc.endswith("罪") else acc
+
+def load_txt(file_path):
+    """ 加载 txt 文件，返回按原顺序去重的列表 """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
+def iter_valid_samples(input_path):
+    """
+    流式读取数据集，逐条产出有效样本（案情、罪名、法条均非空），无法解析的行打印警告并跳过。
+    """
+    for sample in iter_jsonl(input_path):
+        fact = sample.get("fact", "")
+        meta = sample.get("meta", {})
+        accusations = meta.get("accusation", [])
+        articles = meta.get("relevant_articles", [])
+
+        # 跳过无效样本
+        if not fact or not accusations or not articles:
+            continue
+
+        yield {
+            "fact": fact,
+            "meta": {
+                "accusation": accusations,
+                "relevant_articles": articles
+            }
+        }
+
+class Reservoir:
+    """
+    蓄水池抽样：单次遍历、只保留 size 条，每条样本被选中的概率相同。
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.items = []
+
+    def add(self, item):
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            j = self.rng.randrange(self.seen + 1)
+            if j < self.size:
+                self.items[j] = item
+        self.seen += 1
+
+def sample_random(input_path, sample_size, rng):
+    """ 随机抽样：单次遍历的蓄水池抽样，内存只与 sample_size 有关 """
+    reservoir = Reservoir(sample_size, rng)
+    for sample in iter_valid_samples(input_path):
+        reservoir.add(sample)
+
+    print(f"📦 数据集总样本数：{reservoir.seen}")
+    return reservoir.items
+
+def sample_interval(input_path, sample_size):
+    """ 间隔抽样：第一遍统计有效样本数，第二遍每隔 n 个样本抽取 1 个 """
+    total = sum(1 for _ in iter_valid_samples(input_path))
+    print(f"📦 数据集总样本数：{total}")
+
+    interval = max(1, total // sample_size)
+    sampled_data = []
+    for i, sample in enumerate(iter_valid_samples(input_path)):
+        if len(sampled_data) >= sample_size:
+            break
+        if i % interval == 0:
+            sampled_data.append(sample)
+
+    return sampled_data, interval
+
+def sample_stratified(input_path, sample_size, rng, min_per_charge):
     """
-    从输入数据集中抽取样本。
-    - method: "random" 随机抽样，"interval" 间隔抽样。
+    按罪名分层抽样：meta/accu.txt 中每个罪名各维护一个容量为 min_per_charge 的蓄水池，
+    保证每个罪名至少抽到 min_per_charge 条（数据集中不足时全部抽取），
+    其余名额从全体有效样本的蓄水池中随机补齐。内存只与 sample_size 和罪名数有关。
     """
-    data = []
-
-    # 读取整个数据集到内存（适用于较小规模数据集）
-    with open(input_path, "r", encoding="utf-8") as infile:
-        for line in infile:
-            try:
-                sample = json.loads(line.strip())
-                fact = sample.get("fact", "")
-                meta = sample.get("meta", {})
-                accusations = meta.get("accusation", [])
-                articles = meta.get("relevant_articles", [])
-
-                # 跳过无效样本
-                if not fact or not accusations or not articles:
-                    continue
-
-                # 将有效样本存入列表
-                data.append({
-                    "fact": fact,
-                    "meta": {
-                        "accusation": accusations,
-                        "relevant_articles": articles
-                    }
-                })
-
-            except json.JSONDecodeError:
-                print(f"⚠️ 无法解析行：{line.strip()}")
-                continue
-
-    print(f"📦 数据集总样本数：{len(data)}")
+    charges = load_txt(accu_path)
+    charge_reservoirs = {charge: Reservoir(min_per_charge, rng) for charge in charges}
+    reservoir = Reservoir(sample_size, rng)
+
+    for index, sample in enumerate(iter_valid_samples(input_path)):
+        item = (index, sample)
+        reservoir.add(item)
+        for charge in set(normalize_accusation(acc) for acc in sample["meta"]["accusation"]):
+            if charge in charge_reservoirs:
+                charge_reservoirs[charge].add(item)
+
+    print(f"📦 数据集总样本数：{reservoir.seen}")
+
+    # 先取各罪名的保底样本（多罪名样本可同时满足多个罪名）
+    selected = {}
+    for charge_reservoir in charge_reservoirs.values():
+        for index, sample in charge_reservoir.items:
+            selected[index] = sample
+
+    if len(selected) > sample_size:
+        print(f"⚠️ 每个罪名保底 {min_per_charge} 条共需 {len(selected)} 条，超过 sample_size={sample_size}，按保底数量输出")
+
+    # 再从全体样本中随机补齐
+    fill = [item for item in reservoir.items if item[0] not in selected]
+    rng.shuffle(fill)
+    for index, sample in fill[:max(0, sample_size - len(selected))]:
+        selected[index] = sample
+
+    # 按数据集原顺序输出
+    return [selected[index] for index in sorted(selected)]
+
+def report_coverage(sampled_data):
+    """
+    打印测试集对 meta/accu.txt 中各罪名的覆盖情况。
+    """
+    charges = load_txt(accu_path)
+    charge_count = {charge: 0 for charge in charges}
+    for sample in sampled_data:
+        for charge in set(normalize_accusation(acc) for acc in sample["meta"]["accusation"]):
+            if charge in charge_count:
+                charge_count[charge] += 1
+
+    covered = [charge for charge, count in charge_count.items() if count > 0]
+    uncovered = [charge for charge, count in charge_count.items() if count == 0]
+    rarest = sorted(charge_count.items(), key=lambda x: x[1])[:10]
+
+    print(f"\n📊 罪名覆盖：{len(covered)}/{len(charges)} 个罪名至少出现 1 次")
+    print("出现次数最少的罪名：", "，".join(f"{charge}({count})" for charge, count in rarest))
+    print("未覆盖罪名：", uncovered)
+
+def prepare_testset(input_path, output_path, sample_size=3000, method="random", seed=None, min_per_charge=5):
+    """
+    从输入数据集中抽取样本，单次（间隔抽样为两次）流式遍历，不把整个数据集读入内存。
+    - method: "random" 随机抽样（蓄水池），"interval" 间隔抽样，
+      "stratified" 按罪名分层抽样（每个罪名至少 min_per_charge 条）。
+    - seed: 随机种子，设置后抽样结果可复现。
+    """
+    rng = random.Random(seed)
 
     # 抽样
     if method == "random":
-        # 随机抽样
-        sampled_data = random.sample(data, min(sample_size, len(data)))
+        sampled_data = sample_random(input_path, sample_size, rng)
         print(f"✅ 随机抽样完成，共抽取 {len(sampled_data)} 条样本。")
 
     elif method == "interval":
-        # 每隔 n 个样本抽取 1 个
-        interval = max(1, len(data) // sample_size)
-        sampled_data = data[::interval][:sample_size]
+        sampled_data, interval = sample_interval(input_path, sample_size)
         print(f"✅ 间隔抽样完成，每隔 {interval} 个样本抽取 1 个，共 {len(sampled_data)} 条样本。")
 
+    elif method == "stratified":
+        sampled_data = sample_stratified(input_path, sample_size, rng, min_per_charge)
+        print(f"✅ 分层抽样完成，每个罪名至少 {min_per_charge} 条，共抽取 {len(sampled_data)} 条样本。")
+
     else:
         print(f"❌ 无效抽样方法：{method}")
         return
 
     # 写入输出文件
-    with open(output_path, "w", encoding="utf-8") as outfile:
+    with JsonlWriter(output_path) as writer:
         for item in sampled_data:
-            outfile.write(json.dumps(item, ensure_ascii=False) + "\n")
+            writer.write(item)
 
     print(f"✅ 测试集已保存至 {output_path}，共 {len(sampled_data)} 条样本。")
+    report_coverage(sampled_data)
 
 if __name__ == "__main__":
-    # 示例运行：随机抽样
-    prepare_testset(input_path, output_path, sample_size=3000, method="random")
+    # 示例运行：随机抽样（固定种子可复现）
+    prepare_testset(input_path, output_path, sample_size=3000, method="random", seed=42)
+
+    # 示例运行：按罪名分层抽样，每个罪名至少 5 条
+    # prepare_testset(input_path, output_path, sample_size=3000, method="stratified", seed=42, min_per_charge=5)
 
     # 示例运行：间隔抽样
     # prepare_testset(input_path, output_path, sample_size=10000, method="interval")
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# 路径配置
+default_cache_path = os.path.join(os.path.dirname(__file__), "..", "outputs", "result_cache.sqlite")
+
+
+def file_checksum(file_path):
+    """ 计算文件内容的 sha256 """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def directory_checksum(dir_path):
+    """
+    计算目录下顶层文件（如 adapter_model.safetensors、adapter_config.json）的 sha256，
+    不包含 checkpoint 等子目录。目录不存在时返回 None。
+    """
+    if not os.path.isdir(dir_path):
+        return None
+
+    sha = hashlib.sha256()
+    for name in sorted(os.listdir(dir_path)):
+        file_path = os.path.join(dir_path, name)
+        if not os.path.isfile(file_path):
+            continue
+        sha.update(name.encode("utf-8"))
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def make_key(model_id, adapter_hash, generation_config, prompt):
+    """
+    缓存键：(模型标识, adapter 哈希, 解码配置, prompt 的 sha256)。
+    """
+    prompt_sha = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    payload = json.dumps([model_id, adapter_hash, generation_config, prompt_sha], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    基于 SQLite 的推理结果缓存：保存 (罪名列表, 法条列表)，
+    条目数超过 max_entries 时按最近访问时间淘汰最旧的条目。
+    """
+
+    def __init__(self, cache_path=default_cache_path, max_entries=100000):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON results (last_access)")
+        self.conn.commit()
+
+    def get(self, key):
+        """
+        命中返回 (accusations, articles)，未命中返回 None。
+        """
+        row = self.conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        accusations, articles = json.loads(row[0])
+        return accusations, articles
+
+    def put(self, key, accusations, articles):
+        value = json.dumps([accusations, articles], ensure_ascii=False)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results (key, value, last_access) VALUES (?, ?, ?)",
+            (key, value, time.time()),
+        )
+        self.conn.commit()
+        self._evict()
+
+    def _evict(self):
+        """
+        超出容量时删除最久未访问的条目。
+        """
+        size = len(self)
+        if size <= self.max_entries:
+            return
+
+        overflow = size - self.max_entries
+        self.conn.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+            (overflow,),
+        )
+        self.conn.commit()
+        self.evictions += overflow
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0.0
+        print(f"🗃️ 结果缓存：命中 {self.hits}，未命中 {self.misses}，命中率 {hit_rate:.2%}，"
+              f"淘汰 {self.evictions}，当前条目 {len(self)}/{self.max_entries}")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from tqdm import tqdm
+from jsonl_io import iter_jsonl, JsonlWriter
+from post_process_output import parse_line
+from result_cache import file_checksum
+
+# 路径配置
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+train_path = os.path.join(BASE_DIR, "data", "train2.0.jsonl")
+test_path = os.path.join(BASE_DIR, "data", "test2.0.jsonl")
+index_dir = os.path.join(BASE_DIR, "data", "retrieval_index")
+output_path = os.path.join(BASE_DIR, "outputs", "test_results_retrieval.jsonl")
+
+# 索引配置
+ngram_range = (2, 3)         # 字符 n-gram 长度范围
+num_features = 2 ** 20       # 哈希特征空间大小（2 的幂）
+max_postings = 5000          # 每个特征只保留权重最高的 max_postings 条倒排记录（近似检索）
+
+# 检索配置
+top_k = 10                   # 返回的相似案例数
+vote_threshold = 0.5         # 标签得票（相似度加权）占比不低于该值时入选
+fast_threshold = 0.9         # 最相似案例的余弦相似度不低于该值时直接采用投票结果，不调用模型
+
+# 训练 prompt 中案情之前的固定片段
+fact_marker = "案情描述如下："
+
+# 哈希常数（64 位 FNV 素数与 murmur3 finalizer 乘数）
+_prime = np.uint64(1099511628211)
+_mixer = np.uint64(0xff51afd7ed558ccd)
+
+# 运行统计，由 reset_retrieval_stats 清零
+# - fast_path: 相似度足够高、直接采用投票结果的条数
+# - candidate_accusations / candidate_articles: 交给模型打分的候选罪名 / 法条总数
+retrieval_stats = {
+    "queries": 0,
+    "fast_path": 0,
+    "candidate_accusations": 0,
+    "candidate_articles": 0,
+}
+
+
+def reset_retrieval_stats():
+    for key in retrieval_stats:
+        retrieval_stats[key] = 0
+
+
+def report_retrieval_stats():
+    """
+    打印快速通道命中率与平均候选标签数。
+    """
+    queries, fast = retrieval_stats["queries"], retrieval_stats["fast_path"]
+    scored = max(queries - fast, 1)
+    print(f"🔎 检索预筛：快速通道 {fast}/{queries}（{fast / max(queries, 1):.2%}），"
+          f"其余样本平均候选罪名 {retrieval_stats['candidate_accusations'] / scored:.1f} 个、"
+          f"法条 {retrieval_stats['candidate_articles'] / scored:.1f} 个")
+
+
+def fact_from_prompt(prompt):
+    """ 取出 prompt 中的案情部分（没有固定片段时返回原文） """
+    return prompt.split(fact_marker, 1)[-1]
+
+
+def normalize_accusation(acc):
+    """ 去掉中括号和‘罪’字（与 evaluation/ 中的规范化一致） """
+    acc = acc.replace("[", "").replace("]", "").strip()
+    return acc[:-1] if acc.endswith("罪") else acc
+
+
+def parse_response(response):
+    """ 解析训练集的回答，返回按原顺序去重的 (罪名列表, 法条列表) """
+    accusations, articles = [], []
+    for line in response.split("输出结束")[0].split("\n"):
+        line_accusations, line_articles = parse_line(line)
+        accusations.extend(normalize_accusation(acc) for acc in line_accusations if acc.strip())
+        articles.extend(line_articles)
+    return list(dict.fromkeys(accusations)), list(dict.fromkeys(articles))
+
+
+def ngram_features(text, ngram_range=ngram_range, num_features=num_features):
+    """
+    字符 n-gram 的哈希特征编号（向量化计算，不生成子串）：
+    按 Unicode 码位做多项式哈希，再经过一次混合，取低位映射到 [0, num_features)。
+    """
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            continue
+        h = np.full(count, n, dtype=np.uint64)
+        for i in range(n):
+            h = h * _prime + codes[i:i + count]
+        hashes.append(h)
+    if not hashes:
+        return np.zeros(0, dtype=np.int64)
+
+    h = np.concatenate(hashes)
+    h ^= h >> np.uint64(33)
+    h *= _mixer
+    h ^= h >> np.uint64(33)
+    return (h & np.uint64(num_features - 1)).astype(np.int64)
+
+
+def term_frequencies(text):
+    """ 返回 (特征编号, 次线性词频 1 + log(tf))，特征编号升序 """
+    terms, counts = np.unique(ngram_features(text), return_counts=True)
+    return terms, (1 + np.log(counts)).astype(np.float32)
+
+
+def build_index(train_path=train_path, index_dir=index_dir):
+    """
+    由训练集构建 TF-IDF 倒排索引，写入 index_dir：
+    - idf.npy: (num_features,) float32
+    - term_ptr.npy: (num_features + 1,) int64，特征 t 的倒排记录为 [term_ptr[t], term_ptr[t + 1])
+    - post_docs.npy / post_weights.npy: 倒排记录的案例编号与 L2 归一化后的 TF-IDF 权重，
+      每个特征内按权重降序，只保留前 max_postings 条
+    - labels.json: 每个案例的 [罪名列表, 法条列表]
+    - meta.json: 训练集 sha256 与索引参数，用于判断索引是否过期
+    先写入临时目录再整体改名，中途中断不会留下不完整的索引。
+    """
+    doc_terms, doc_tfs, labels = [], [], []
+    for data in tqdm(iter_jsonl(train_path, errors="skip"), desc="Indexing"):
+        fact = fact_from_prompt(data.get("prompt", ""))
+        if not fact:
+            continue
+        terms, tfs = term_frequencies(fact)
+        doc_terms.append(terms.astype(np.int32))
+        doc_tfs.append(tfs)
+        labels.append(parse_response(data.get("response", "")))
+
+    num_docs = len(labels)
+    terms = np.concatenate(doc_terms)
+    weights = np.concatenate(doc_tfs)
+    docs = np.repeat(np.arange(num_docs, dtype=np.int32), [len(t) for t in doc_terms])
+    del doc_terms, doc_tfs
+
+    # 平滑 idf，与 sklearn 的 smooth_idf 一致
+    df = np.bincount(terms, minlength=num_features)
+    idf = (np.log((num_docs + 1) / (df + 1)) + 1).astype(np.float32)
+    weights *= idf[terms]
+    norms = np.sqrt(np.bincount(docs, weights=weights.astype(np.float64) ** 2, minlength=num_docs))
+    weights /= np.maximum(norms, 1e-12)[docs].astype(np.float32)
+
+    # 按 (特征, 权重降序) 排序，每个特征只保留前 max_postings 条
+    order = np.lexsort((-weights, terms))
+    terms, docs, weights = terms[order], docs[order], weights[order]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=num_features))])
+    keep = np.arange(len(terms)) - starts[terms] < max_postings
+    terms, docs, weights = terms[keep], docs[keep], weights[keep]
+    term_ptr = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=num_features))]).astype(np.int64)
+
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "idf.npy"), idf)
+    np.save(os.path.join(tmp_dir, "term_ptr.npy"), term_ptr)
+    np.save(os.path.join(tmp_dir, "post_docs.npy"), docs)
+    np.save(os.path.join(tmp_dir, "post_weights.npy"), weights)
+    with open(os.path.join(tmp_dir, "labels.json"), "w", encoding="utf-8") as file:
+        json.dump(labels, file, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({
+            "train_path": os.path.abspath(train_path),
+            "train_checksum": file_checksum(train_path),
+            "params": index_params(),
+            "num_docs": num_docs,
+            "num_postings": int(term_ptr[-1]),
+            "pruned_postings": int((~keep).sum()),
+        }, file, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.rename(tmp_dir, index_dir)
+
+
+def index_params():
+    return {"ngram_range": list(ngram_range), "num_features": num_features, "max_postings": max_postings}
+
+
+class RetrievalIndex:
+    """
+    内存映射的 TF-IDF 倒排索引：查询只读取案情 n-gram 对应的倒排记录，
+    累加得到与各训练案例的（近似）余弦相似度，再取 top-k。
+    """
+
+    def __init__(self, index_dir=index_dir):
+        self.idf = np.load(os.path.join(index_dir, "idf.npy"))
+        self.term_ptr = np.load(os.path.join(index_dir, "term_ptr.npy"))
+        self.post_docs = np.load(os.path.join(index_dir, "post_docs.npy"), mmap_mode="r")
+        self.post_weights = np.load(os.path.join(index_dir, "post_weights.npy"), mmap_mode="r")
+        with open(os.path.join(index_dir, "labels.json"), "r", encoding="utf-8") as file:
+            self.labels = json.load(file)
+        self.num_docs = len(self.labels)
+
+    def search(self, fact, k=top_k):
+        """ 返回最相似的 k 个训练案例 [(案例编号, 相似度), ...]，按相似度降序，不含相似度为 0 的案例 """
+        terms, weights = term_frequencies(fact)
+        weights = weights * self.idf[terms]
+        weights /= max(float(np.linalg.norm(weights)), 1e-12)
+
+        starts, ends = self.term_ptr[terms], self.term_ptr[terms + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0 or self.num_docs == 0:
+            return []
+
+        # 展开各特征的倒排区间 [start, end) 为下标数组
+        positions = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        scores = np.bincount(self.post_docs[positions], weights=self.post_weights[positions] * np.repeat(weights, lengths),
+                             minlength=self.num_docs)
+
+        k = min(k, self.num_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(doc), float(scores[doc])) for doc in top if scores[doc] > 0]
+
+    def vote(self, neighbours, threshold=vote_threshold):
+        """
+        相似度加权投票，返回 (罪名排序, 入选罪名, 法条排序, 入选法条)，排序为 [(标签, 得票占比), ...]：
+        得票占比不低于 threshold 的标签入选，至少 1 个。排序中的全部标签即检索得到的候选集。
+        """
+        total = sum(score for _, score in neighbours) or 1.0
+        results = []
+        for field in (0, 1):
+            votes = {}
+            for doc, score in neighbours:
+                for label in self.labels[doc][field]:
+                    votes[label] = votes.get(label, 0.0) + score / total
+            ranked = sorted(votes.items(), key=lambda item: -item[1])
+            selected = [label for label, share in ranked if share >= threshold] or [label for label, _ in ranked[:1]]
+            results.extend([ranked, selected])
+        return tuple(results)
+
+
+def load_index(train_path=train_path, index_dir=index_dir):
+    """
+    加载检索索引；不存在、训练集已变化或索引参数不同时先重新构建。
+    """
+    meta_path = os.path.join(index_dir, "meta.json")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+
+    if meta is not None and meta["params"] == index_params() and meta["train_checksum"] == file_checksum(train_path):
+        print(f"✅ 命中检索索引：{index_dir}")
+    else:
+        print(f"🔄 正在构建检索索引：{train_path}")
+        start = time.perf_counter()
+        build_index(train_path, index_dir)
+        print(f"✅ 检索索引已保存至：{index_dir}（耗时 {time.perf_counter() - start:.1f} 秒）")
+
+    return RetrievalIndex(index_dir)
+
+
+def report_accuracy(index, test_path=test_path, output_path=output_path, k=top_k):
+    """
+    在测试集上评估检索：
+    - 投票结果写入 output_path（每条输入一行 meta），再交给 evaluation/evaluate.py 计算 Micro / Macro
+    - 候选覆盖率：真实罪名 / 法条全部落在 top-k 案例标签并集中的样本比例（打分预筛的召回上限）
+    - 快速通道：最相似案例相似度不低于 fast_threshold 的样本比例及其罪名完全正确率
+    """
+    num_cases = covered_accusations = covered_articles = fast = fast_correct = 0
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with JsonlWriter(output_path, "w") as writer:
+        for data in tqdm(iter_jsonl(test_path, errors="none"), desc="Retrieval"):
+            fact = data.get("fact", "") if data is not None else ""
+            neighbours = index.search(fact, k) if fact else []
+            if not neighbours:
+                writer.write({"meta": {"accusation": [], "relevant_articles": []}})
+                continue
+
+            ranked_accusations, accusations, ranked_articles, articles = index.vote(neighbours)
+            writer.write({"meta": {"accusation": accusations, "relevant_articles": articles}})
+
+            gold_accusations = {normalize_accusation(acc) for acc in data.get("meta", {}).get("accusation", [])}
+            gold_articles = {int(art) for art in data.get("meta", {}).get("relevant_articles", [])}
+            num_cases += 1
+            covered_accusations += gold_accusations <= {label for label, _ in ranked_accusations}
+            covered_articles += gold_articles <= {label for label, _ in ranked_articles}
+            if neighbours[0][1] >= fast_threshold:
+                fast += 1
+                fast_correct += gold_accusations == set(accusations)
+
+    print(f"\n📊 检索评估（top-{k}，{num_cases} 条有效样本）：")
+    print(f"候选覆盖率：罪名 {covered_accusations / max(num_cases, 1):.2%}，法条 {covered_articles / max(num_cases, 1):.2%}")
+    print(f"快速通道（相似度 ≥ {fast_threshold}）：{fast / max(num_cases, 1):.2%}，"
+          f"其中罪名完全正确 {fast_correct / max(fast, 1):.2%}")
+
+    # 复用 evaluation/ 中的评估引擎
+    sys.path.insert(0, os.path.join(BASE_DIR, "evaluation"))
+    from evaluate import evaluate, print_summary
+    print_summary(evaluate(test_path, [output_path]))
+
+
+if __name__ == "__main__":
+    # 构建（或加载）索引，并在测试集上评估检索投票的效果
+    index = load_index()
+    report_accuracy(index)
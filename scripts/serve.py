@@ -0,0 +1,188 @@
+import json
+import asyncio
+import time
+from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+import generate_lora
+import generate_base
+from generate_utils import prompt_header
+
+# 服务配置
+host = "127.0.0.1"
+port = 8000
+model_type = "lora"   # "lora" 或 "base"
+max_batch_size = 16   # 每个微批次的最大请求数
+max_wait_ms = 5       # 收到首个请求后最多等待多久凑批
+generation_kwargs = {}  # 透传给 generate_batch，如 {"do_sample": False, "constrain_labels": True}
+
+
+# 响应中保留中文字符
+json_response = partial(web.json_response, dumps=partial(json.dumps, ensure_ascii=False))
+
+
+def percentile(values, q):
+    """ 最近邻法分位数，values 为空时返回 0 """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class MicroBatcher:
+    """
+    动态微批次：请求进入队列，后台任务取出首个请求后继续收集，
+    直到凑满 max_batch_size 或等待超过 max_wait_ms，再整批送入常驻模型推理。
+    推理在单线程执行器中进行，不阻塞事件循环；推理期间到达的请求自然累积成下一批。
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # 监控指标
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def submit(self, prompt):
+        """
+        提交一条 prompt，返回 (formatted_output, accusations, articles)。
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await future
+
+    async def collect(self):
+        """
+        收集一个微批次：阻塞等待首个请求，之后在 max_wait 内尽量凑满。
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect()
+            prompts = [prompt for prompt, _, _ in batch]
+            self.batch_sizes.append(len(batch))
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, prompts)
+            except Exception as e:
+                self.failed += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            for (_, future, start), result in zip(batch, results):
+                self.latencies.append(now - start)
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        latencies_ms = [latency * 1000 for latency in self.latencies]
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": len(self.batch_sizes),
+            "avg_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            "latency_p50_ms": percentile(latencies_ms, 50),
+            "latency_p99_ms": percentile(latencies_ms, 99),
+        }
+
+
+async def handle_predict(request):
+    """
+    POST /predict，请求体 {"fact": "..."} 或 {"prompt": "..."}，
+    返回格式化输出与结构化的罪名 / 法条列表。
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        return json_response({"error": "请求体不是合法 JSON"}, status=400)
+    if not isinstance(data, dict):
+        return json_response({"error": "请求体必须是 JSON 对象"}, status=400)
+
+    prompt = data.get("prompt") or (f"{prompt_header}{data['fact']}" if data.get("fact") else None)
+    if not prompt:
+        return json_response({"error": "缺少 fact 或 prompt 字段"}, status=400)
+
+    start = time.perf_counter()
+    try:
+        formatted_output, accusations, articles = await request.app["batcher"].submit(prompt)
+    except Exception as e:
+        return json_response({"error": f"推理失败：{e}"}, status=500)
+
+    return json_response({
+        "output": formatted_output,
+        "accusation": accusations,
+        "relevant_articles": articles,
+        "latency_ms": (time.perf_counter() - start) * 1000,
+    })
+
+
+async def handle_metrics(request):
+    return json_response(request.app["batcher"].metrics())
+
+
+async def handle_health(request):
+    return json_response({"status": "ok", "model_type": model_type})
+
+
+async def on_startup(app):
+    module = generate_lora if model_type == "lora" else generate_base
+
+    def batch_fn(prompts):
+        return module.generate_batch(prompts, batch_size=max_batch_size, **generation_kwargs)
+
+    # 启动时加载常驻模型，避免首个请求承担加载耗时
+    await asyncio.get_running_loop().run_in_executor(None, module.load_model)
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    app["batcher"] = batcher
+    app["batcher_task"] = asyncio.create_task(batcher.run())
+
+
+async def on_cleanup(app):
+    app["batcher_task"].cancel()
+    app["batcher"].executor.shutdown(wait=False)
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/predict", handle_predict)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/health", handle_health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    print(f"🚀 推理服务启动：http://{host}:{port}（{model_type}，max_batch_size={max_batch_size}，max_wait_ms={max_wait_ms}）")
+    web.run_app(create_app(), host=host, port=port)
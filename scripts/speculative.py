@@ -0,0 +1,218 @@
+import torch
+from transformers import DynamicCache
+from generate_utils import encode_prompts, format_output, SentinelStoppingCriteria, default_generation_config
+from post_process_output import post_process_output
+from label_trie import load_txt, encode, accu_path, law_path
+
+# 回答模板中的固定片段（与 prepare_dataset.format_response 一致）
+article_prefix = "法条：《中华人民共和国刑法》第"
+template_spans = [
+    "罪名：",
+    "\n" + article_prefix,
+    "条，《中华人民共和国刑法》第",
+    "条\n输出结束",
+]
+
+# 运行统计，由 reset_speculative_stats 清零
+# - drafted / accepted: 草稿 token 数与被验证接受的 token 数
+# - forward_passes: 模型前向次数（含 prefill）
+# - generated_tokens: 最终输出的 token 数
+speculative_stats = {
+    "drafted": 0,
+    "accepted": 0,
+    "forward_passes": 0,
+    "generated_tokens": 0,
+}
+
+# 按 tokenizer 缓存由模板与标签构建的 n-gram 表
+_seed_cache = {}
+
+
+def reset_speculative_stats():
+    for key in speculative_stats:
+        speculative_stats[key] = 0
+
+
+def report_speculative_stats():
+    """
+    打印草稿接受率与每次前向平均产出的 token 数。
+    """
+    drafted, accepted = speculative_stats["drafted"], speculative_stats["accepted"]
+    passes, generated = speculative_stats["forward_passes"], speculative_stats["generated_tokens"]
+    acceptance = accepted / drafted if drafted else 0.0
+    per_pass = generated / passes if passes else 0.0
+    print(f"🎯 草稿接受率：{acceptance:.2%}（接受 {accepted} / 草稿 {drafted}）")
+    print(f"⏩ 每次前向平均产出 {per_pass:.2f} 个 token（输出 {generated} 个 token，前向 {passes} 次）")
+
+
+def index_ngrams(index, tokens, ngram_size, start=0, end=None):
+    """
+    登记 tokens 中结束于 [start, end) 的 n-gram（n = 1..ngram_size）：
+    index[n-gram] = (tokens, 续写起点)。tokens 为同一列表对象，后续追加的 token 也能作为续写。
+    """
+    end = len(tokens) if end is None else end
+    for position in range(start, end):
+        for n in range(1, min(ngram_size, position + 1) + 1):
+            index[tuple(tokens[position - n + 1:position + 1])] = (tokens, position + 1)
+
+
+def build_seed_index(tokenizer, ngram_size):
+    """
+    由回答模板与 meta/ 中的合法标签构建 n-gram 表（按 tokenizer 缓存）：
+    每个罪名（可带 "罪" 字）接换行与法条前缀、接 "，"，每个法条编号接 "条"。
+    """
+    key = (getattr(tokenizer, "name_or_path", id(tokenizer)), ngram_size)
+    if key not in _seed_cache:
+        texts = list(template_spans)
+        for accusation in load_txt(accu_path):
+            for variant in (accusation, accusation + "罪"):
+                texts.append(f"罪名：{variant}\n{article_prefix}")
+                texts.append(f"罪名：{variant}，")
+        for article in load_txt(law_path):
+            texts.append(f"第{article}条")
+
+        index = {}
+        for text in texts:
+            index_ngrams(index, encode(tokenizer, text), ngram_size)
+        _seed_cache[key] = index
+    return _seed_cache[key]
+
+
+class NgramDrafter:
+    """
+    n-gram 草稿器（prompt lookup）：用已生成文本的最后 n 个 token 依次在
+    已生成部分、模板与标签表、prompt 中查找最近一次出现，取其后续 token 作为草稿。
+    n 从 ngram_size 递减到 1，优先使用更长的匹配。
+    """
+
+    def __init__(self, tokenizer, prompt_ids, ngram_size=3, max_draft=8):
+        self.ngram_size = ngram_size
+        self.max_draft = max_draft
+        self.generated = []
+        self.generated_index = {}
+        self.prompt_index = {}
+        index_ngrams(self.prompt_index, list(prompt_ids), ngram_size)
+        self.indexes = [self.generated_index, build_seed_index(tokenizer, ngram_size), self.prompt_index]
+
+    def append(self, token):
+        """ 追加一个已确定的 token，登记以上一个 token 结尾的 n-gram（其续写从新 token 开始） """
+        self.generated.append(token)
+        if len(self.generated) > 1:
+            index_ngrams(self.generated_index, self.generated, self.ngram_size, len(self.generated) - 2, len(self.generated) - 1)
+
+    def propose(self, limit=None):
+        """ 返回草稿 token 列表（可能为空），长度不超过 max_draft 与 limit """
+        size = self.max_draft if limit is None else min(self.max_draft, limit)
+        if size <= 0 or not self.generated:
+            return []
+        for n in range(min(self.ngram_size, len(self.generated)), 0, -1):
+            key = tuple(self.generated[-n:])
+            for index in self.indexes:
+                match = index.get(key)
+                if match is None:
+                    continue
+                tokens, start = match
+                draft = tokens[start:start + size]
+                if draft:
+                    return draft
+        return []
+
+
+def speculative_decode(model, tokenizer, input_ids, attention_mask, past_key_values=None, prompt_ids=None,
+                       max_new_tokens=200, stop_on_sentinel=True, ngram_size=3, max_draft=8):
+    """
+    单条贪心解码的投机解码版本，返回新生成的 token 列表（不含 eos）。
+    每步把 “上一步确定的 token + 草稿” 一次前向验证：逐个比较草稿与模型的贪心预测，
+    接受最长一致前缀，再加上模型在第一个不一致位置的预测，随后裁掉未被接受部分的 KV cache。
+    结束条件（eos、SentinelStoppingCriteria、max_new_tokens）逐 token 判断，输出与 decode(do_sample=False) 一致。
+    """
+    if input_ids.shape[0] != 1:
+        raise ValueError("投机解码仅支持单条输入")
+
+    stopping_criteria = SentinelStoppingCriteria(tokenizer) if stop_on_sentinel else None
+    drafter = NgramDrafter(tokenizer, input_ids[0].tolist() if prompt_ids is None else prompt_ids,
+                           ngram_size=ngram_size, max_draft=max_draft)
+    if past_key_values is None:
+        past_key_values = DynamicCache()
+
+    # prefill（past_key_values 非空时只计算 input_ids 部分）
+    position_ids = (attention_mask.long().cumsum(-1) - 1)[:, -input_ids.shape[1]:]
+    with torch.no_grad():
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                        past_key_values=past_key_values, use_cache=True)
+    speculative_stats["forward_passes"] += 1
+    past_key_values = outputs.past_key_values
+    length = attention_mask.shape[1]  # 已写入 KV cache 的 token 数
+    next_token = int(outputs.logits[0, -1].argmax())
+
+    generated = []
+
+    def commit(token):
+        """ 追加一个确定的 token，返回是否应结束 """
+        if token == tokenizer.eos_token_id:
+            return True
+        generated.append(token)
+        drafter.append(token)
+        if stopping_criteria and stopping_criteria(0, generated):
+            return True
+        return len(generated) >= max_new_tokens
+
+    with torch.no_grad():
+        while not commit(next_token):
+            draft = drafter.propose(limit=max_new_tokens - len(generated))
+            current_ids = torch.tensor([[next_token] + draft], device=input_ids.device)
+            outputs = model(
+                input_ids=current_ids,
+                attention_mask=attention_mask.new_ones((1, length + current_ids.shape[1])),
+                position_ids=torch.arange(length, length + current_ids.shape[1], device=input_ids.device)[None],
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            predictions = outputs.logits[0].argmax(dim=-1).tolist()
+            speculative_stats["forward_passes"] += 1
+            speculative_stats["drafted"] += len(draft)
+
+            # 接受与模型预测一致的最长草稿前缀
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predictions[accepted]:
+                accepted += 1
+            speculative_stats["accepted"] += accepted
+
+            finished = False
+            for token in draft[:accepted]:
+                if commit(token):
+                    finished = True
+                    break
+            if finished:
+                break
+
+            # 裁掉未被接受的草稿对应的 KV cache，模型在第一个不一致位置的预测作为下一个 token
+            length += 1 + accepted
+            past_key_values.crop(length)
+            next_token = predictions[accepted]
+
+    speculative_stats["generated_tokens"] += len(generated)
+    return generated
+
+
+def speculative_generate(model, tokenizer, prompt, prefix_cache=None, ngram_size=3, max_draft=8, **generation_kwargs):
+    """
+    投机解码推理单条 prompt，返回 (formatted_output, accusations, articles)，
+    结果与 batch_generate(..., do_sample=False) 一致。只支持贪心解码，不支持 constrain_labels。
+    """
+    config = dict(default_generation_config, do_sample=False)
+    config.update(generation_kwargs)
+    if config["do_sample"] or config["constrain_labels"]:
+        raise ValueError("投机解码只支持贪心解码（do_sample=False），且不支持 constrain_labels")
+
+    input_ids, attention_mask, past_key_values = encode_prompts(model, tokenizer, [prompt], prefix_cache)
+    tokens = speculative_decode(
+        model, tokenizer, input_ids, attention_mask, past_key_values=past_key_values,
+        max_new_tokens=config["max_new_tokens"], stop_on_sentinel=config["stop_on_sentinel"],
+        ngram_size=ngram_size, max_draft=max_draft,
+    )
+
+    output_text = tokenizer.decode(tokens, skip_special_tokens=True)
+    accusations, articles = post_process_output(output_text, prompt)
+    return format_output(accusations, articles), accusations, articles
@@ -0,0 +1,183 @@
+import torch
+from transformers import DynamicCache
+from generate_utils import encode_prompts, format_output, build_logits_warpers, default_generation_config
+from label_trie import get_label_tries, build_charge_trie, load_txt, accu_path, encode, TokenTrie, ACTION
+
+# 回答模板中的固定片段（与 prepare_dataset.format_response 一致），由解码器直接写入序列
+accusation_prefix = "罪名："
+article_prefix = "法条：《中华人民共和国刑法》第"
+next_article_prefix = "《中华人民共和国刑法》第"
+answer_suffix = "输出结束"
+
+# 最后一个允许的罪名只能以换行结尾：只含 "done" 叶子的罪名前缀树，按 tokenizer 缓存
+_last_charge_tries = {}
+
+# 运行统计，由 reset_template_stats 清零
+# - forward_passes: 模型前向次数（含 prefill）
+# - model_tokens: 由模型在空位中选出的 token 数
+# - forced_tokens: 直接写入的模板 token 数
+template_stats = {
+    "cases": 0,
+    "forward_passes": 0,
+    "model_tokens": 0,
+    "forced_tokens": 0,
+}
+
+
+def reset_template_stats():
+    for key in template_stats:
+        template_stats[key] = 0
+
+
+def report_template_stats():
+    """
+    打印每条样本的平均前向次数与模板 token 占比。
+    """
+    cases, passes = template_stats["cases"], template_stats["forward_passes"]
+    model_tokens, forced = template_stats["model_tokens"], template_stats["forced_tokens"]
+    total = model_tokens + forced
+    print(f"🧩 模板填充：平均每条前向 {passes / max(cases, 1):.1f} 次，"
+          f"输出 token 中模板占 {forced / max(total, 1):.2%}（模板 {forced} / 模型 {model_tokens}）")
+
+
+def get_last_charge_trie(tokenizer):
+    """ 构建（并缓存）罪名后只能接换行的前缀树，罪名数达到 max_labels 时用于最后一个空位 """
+    key = getattr(tokenizer, "name_or_path", id(tokenizer))
+    if key not in _last_charge_tries:
+        _last_charge_tries[key] = build_charge_trie(tokenizer, load_txt(accu_path), actions=("done",))
+    return _last_charge_tries[key]
+
+
+def template_decode(model, tokenizer, input_ids, attention_mask, past_key_values=None, max_new_tokens=200,
+                    do_sample=True, temperature=1.0, top_p=1.0, max_labels=10):
+    """
+    模板约束解码（单条）：回答结构固定为
+        罪名：<罪名>（，<罪名>）* 换行 法条：《中华人民共和国刑法》第<编号>条（，《中华人民共和国刑法》第<编号>条）* 换行 输出结束
+    固定片段直接写入序列，并与前一个 token 一起做一次前向扩展 KV cache；
+    模型只在空位中选 token：罪名与法条编号按 meta/ 的前缀树约束，法条之后只在 "，" 与换行之间二选一。
+    返回 (输出 token 列表, 罪名列表, 法条列表)，罪名与法条直接取自空位，无需再解析文本。
+    max_labels 限制每个字段的标签数，输出 token 数达到 max_new_tokens 时提前结束（返回已完成的标签）。
+    """
+    if input_ids.shape[0] != 1:
+        raise ValueError("模板约束解码仅支持单条输入")
+
+    charge_trie, article_trie = get_label_tries(tokenizer)
+    last_charge_trie = get_last_charge_trie(tokenizer)
+    warpers = build_logits_warpers(do_sample, temperature, top_p)
+    comma_ids, newline_ids = encode(tokenizer, "，"), encode(tokenizer, "\n")
+
+    if past_key_values is None:
+        past_key_values = DynamicCache()
+    state = {"past_key_values": past_key_values, "length": attention_mask.shape[1] - input_ids.shape[1]}
+    tokens = []
+
+    def forward(ids):
+        """ 将 ids 追加进 KV cache，返回最后一个位置的 logits """
+        length = state["length"]
+        current_ids = torch.tensor([ids], device=input_ids.device)
+        with torch.no_grad():
+            outputs = model(
+                input_ids=current_ids,
+                attention_mask=attention_mask.new_ones((1, length + len(ids))),
+                position_ids=torch.arange(length, length + len(ids), device=input_ids.device)[None],
+                past_key_values=state["past_key_values"],
+                use_cache=True,
+            )
+        state["past_key_values"] = outputs.past_key_values
+        state["length"] = length + len(ids)
+        template_stats["forward_passes"] += 1
+        return outputs.logits[:, -1, :].float()
+
+    def force(text):
+        ids = encode(tokenizer, text)
+        tokens.extend(ids)
+        template_stats["forced_tokens"] += len(ids)
+        return ids
+
+    def choose(scores, allowed):
+        """ 只在 allowed 中选取下一个 token """
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, allowed] = 0
+        scores = warpers(None, scores + mask)
+        if do_sample:
+            token = int(torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1))
+        else:
+            token = int(torch.argmax(scores, dim=-1))
+        tokens.append(token)
+        template_stats["model_tokens"] += 1
+        return token
+
+    def fill(scores, trie):
+        """
+        沿前缀树逐 token 填充一个空位，返回 (空位 token, 叶子动作, 最后一个 token)；
+        输出长度用尽时返回 None。最后一个 token 尚未送入模型，由调用方与后续模板片段一并前向。
+        """
+        node, slot = trie.root, []
+        while len(tokens) < max_new_tokens:
+            token = choose(scores, TokenTrie.allowed_tokens(node))
+            slot.append(token)
+            node = node[token]
+            if ACTION in node:
+                return slot, node[ACTION], token
+            scores = forward([token])
+        return None
+
+    template_stats["cases"] += 1
+    accusations, articles = [], []
+
+    # prefill：案情与 "罪名：" 一起前向（past_key_values 非空时只计算 input_ids 部分）
+    scores = forward(input_ids[0].tolist() + force(accusation_prefix))
+
+    # 罪名：叶子动作 "next" 表示以 "，" 结尾、继续下一个罪名，"done" 表示以换行结尾；
+    # 最后一个允许的空位只能以换行结尾，罪名行不会以 "，" 收尾
+    while True:
+        filled = fill(scores, charge_trie if len(accusations) < max_labels - 1 else last_charge_trie)
+        if filled is None:
+            return tokens, list(dict.fromkeys(accusations)), list(dict.fromkeys(articles))
+        slot, action, last = filled
+        accusations.append(tokenizer.decode(slot, skip_special_tokens=True).rstrip("，\n").strip())
+        if action == "next":
+            scores = forward([last])
+            continue
+        # 罪名行结束后直接写入法条前缀
+        scores = forward([last] + force(article_prefix))
+        break
+
+    # 法条：编号以 "条" 结尾，之后由模型在 "，"（下一条）与换行（结束）之间选择
+    while True:
+        filled = fill(scores, article_trie)
+        if filled is None:
+            break
+        slot, _, last = filled
+        articles.append(int("".join(ch for ch in tokenizer.decode(slot, skip_special_tokens=True) if ch.isdigit())))
+        if len(articles) >= max_labels or len(tokens) >= max_new_tokens:
+            force("\n" + answer_suffix)
+            break
+
+        scores = forward([last])
+        token = choose(scores, [comma_ids[0], newline_ids[0]])
+        if token == newline_ids[0]:
+            # 回答已完整，结束标记无需再经过模型
+            tokens.extend(newline_ids[1:])
+            force(answer_suffix)
+            break
+        tokens.extend(comma_ids[1:])
+        scores = forward([token] + comma_ids[1:] + force(next_article_prefix))
+
+    return tokens, list(dict.fromkeys(accusations)), list(dict.fromkeys(articles))
+
+
+def template_generate(model, tokenizer, prompt, prefix_cache=None, max_labels=10, **generation_kwargs):
+    """
+    模板约束解码推理单条 prompt，返回 (formatted_output, accusations, articles)。
+    生成参数（max_new_tokens、do_sample、temperature、top_p）与 batch_generate 相同，
+    结构由解码器保证，stop_on_sentinel / constrain_labels 不再需要。
+    """
+    config = dict(default_generation_config, **generation_kwargs)
+    input_ids, attention_mask, past_key_values = encode_prompts(model, tokenizer, [prompt], prefix_cache)
+    _, accusations, articles = template_decode(
+        model, tokenizer, input_ids, attention_mask, past_key_values=past_key_values,
+        max_new_tokens=config["max_new_tokens"], do_sample=config["do_sample"],
+        temperature=config["temperature"], top_p=config["top_p"], max_labels=max_labels,
+    )
+    return format_output(accusations, articles), accusations, articles
@@ -1,8 +1,24 @@
 import os
 import json
+import time
+import shutil
+import multiprocessing
+import torch
 from tqdm import tqdm
 from generate_lora import generate_lora  # 从之前的生成模块中导入 generate_lora 函数
 from generate_base import generate_base  # 从基础模型模块中导入 generate_base 函数
+from generate_lora import generate_batch as generate_lora_batch
+from generate_base import generate_batch as generate_base_batch
+from generate_lora import load_model as load_lora_model
+from generate_base import load_model as load_base_model
+from generate_lora import score_lora
+from generate_base import score_base
+from generate_utils import reset_generation_stats, report_generation_stats, prompt_header, format_output, default_generation_config
+from retrieval_index import load_index, fact_from_prompt, retrieval_stats, reset_retrieval_stats, report_retrieval_stats
+from retrieval_index import top_k as default_top_k, fast_threshold as default_fast_threshold
+from result_cache import ResultCache, default_cache_path
+from dedup_cache import DedupCache, dedup_path_pattern
+from jsonl_io import iter_jsonl, JsonlWriter
 
 # 输入输出路径配置
 input_path = "../data/test2.0.jsonl"
@@ -10,62 +26,387 @@ output_path_lora = "../outputs/test_results2.0_lora.jsonl"
 output_path_base = "../outputs/test_results3.0_base.jsonl"
 os.makedirs(os.path.dirname(output_path_lora), exist_ok=True)
 
-def process_data(input_path, output_path, model_type="lora"):
+# 预测方式及其接受的参数（打分类预测方式不接受生成参数）
+predictors = ("generate", "score", "retrieval")
+scoring_params = {
+    "score": ("threshold", "max_labels"),
+    "retrieval": ("threshold", "max_labels", "top_k", "fast_threshold"),
+}
+
+def build_prompt(fact):
+    """
+    构建输入 prompt。
+    """
+    return f"{prompt_header}{fact}"
+
+def progress_path_for(output_path):
+    return output_path + ".progress"
+
+
+def load_progress(output_path):
+    """
+    读取断点信息，返回 (已完成的输入行数, 输出文件的有效字节数)。
+    没有进度文件但输出文件已存在时，按其中完整的行数推断（每条输入恰好对应一行输出）。
+    """
+    progress_path = progress_path_for(output_path)
+    if os.path.exists(progress_path):
+        with open(progress_path, "r", encoding="utf-8") as file:
+            progress = json.load(file)
+        return progress["input_lines"], progress["output_bytes"]
+
+    if os.path.exists(output_path):
+        with open(output_path, "rb") as file:
+            content = file.read()
+        valid = content[:content.rfind(b"\n") + 1]
+        done_lines = valid.count(b"\n")
+        print(f"⚠️ 未找到进度文件，按输出文件中的 {done_lines} 行完整结果续跑")
+        return done_lines, len(valid)
+
+    return 0, 0
+
+
+def save_progress(output_path, input_lines, output_bytes):
+    """
+    原子写入断点信息：先写临时文件并落盘，再替换。
+    """
+    progress_path = progress_path_for(output_path)
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"input_lines": input_lines, "output_bytes": output_bytes}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, progress_path)
+
+
+def check_predictor(predictor, generation_kwargs):
+    """
+    校验预测方式及透传参数：未知的预测方式、打分类预测方式收到的生成参数（如 do_sample）直接报错，
+    避免在推理循环中逐条出错、整份结果被写成空 meta。
+    """
+    if predictor not in predictors:
+        raise ValueError(f"未知的预测方式：{predictor}（可选：{'、'.join(predictors)}）")
+    if predictor in scoring_params:
+        unsupported = sorted(set(generation_kwargs) - set(scoring_params[predictor]))
+        if unsupported:
+            raise ValueError(f"预测方式 {predictor} 不接受参数 {'、'.join(unsupported)}，"
+                             f"可用参数：{'、'.join(scoring_params[predictor])}")
+
+
+def process_data(input_path, output_path, model_type="lora", batch_size=8, max_tokens=None, window_size=256,
+                 use_cache=False, cache_path=default_cache_path, resume=False, start_line=0, end_line=None,
+                 precision=None, predictor="generate", use_dedup=False, dedup_threshold=0.9, **generation_kwargs):
     """
-    逐条读取测试数据，送入模型进行推理，并保存生成结果（仅包含 meta 字段）。
+    分批读取测试数据，送入模型进行推理，并保存生成结果（仅包含 meta 字段）。
     - model_type: "lora" 或 "base"
+    - batch_size: 每批推理的样本数，1 即逐条推理
+    - max_tokens: 设置后每次读入 window_size 条，按 token 长度分桶、按 token 预算装箱
+    - use_cache: 使用磁盘结果缓存，已推理过的 prompt 直接复用结果（需配合 do_sample=False，采样解码时缓存不生效）
+    - resume: 从上次中断处续跑，跳过已完成的输入行并追加写入
+    - start_line / end_line: 只处理输入文件中 [start_line, end_line) 范围内的行（分片推理时使用）
+    - precision: 推理精度（"fp16" / "bf16" / "fp32" / "int8"），默认使用生成模块的 default_precision
+    - predictor: "generate" 自回归生成后解析；"score" 似然打分，逐条为全部候选罪名与法条打分后按阈值选取
+      （generation_kwargs 此时为打分参数 threshold、max_labels，不使用结果缓存）；
+      "retrieval" 先检索训练集中最相似的 top_k 个案例：最高相似度不低于 fast_threshold 时直接采用相似案例的投票结果，
+      否则只在相似案例的罪名 / 法条中做似然打分（generation_kwargs 另可传入 top_k、fast_threshold）；
+      未知的预测方式或打分模式下传入生成参数（do_sample 等）时抛出 ValueError
+    - use_dedup: 生成前查近重复去重缓存（按模型保存在 outputs/dedup_cache_<model_type>.npz），
+      规范化案情（人名、日期、金额等替换为占位符）后 MinHash 估计的相似度不低于 dedup_threshold 时直接复用已有答案；
+      条目按模型、adapter 与解码配置区分，需配合 do_sample=False
+    - generation_kwargs: 透传给生成函数，如 constrain_labels=True 开启合法标签约束解码，
+      do_sample=False 使用确定性的贪心解码
+    每条输入恰好对应一行输出（无效或出错的样本写入空 meta），保证与测试集按行对齐。
     """
+    check_predictor(predictor, generation_kwargs)
+
     # 选择模型
     generate_fn = generate_lora if model_type == "lora" else generate_base
-    print(f"\n🔍 当前模型：{'LoRA 微调模型' if model_type == 'lora' else '基础模型'}")
+    batch_fn = generate_lora_batch if model_type == "lora" else generate_base_batch
+    if predictor in ("score", "retrieval"):
+        generate_fn = score_lora if model_type == "lora" else score_base
+        use_cache = False
+        use_dedup = False
+
+        def batch_fn(prompts, batch_size=None, max_tokens=None, **scoring_kwargs):
+            # 打分模式每条两次前向，逐条执行
+            return [generate_fn(prompt, **scoring_kwargs) for prompt in prompts]
+
+    if predictor == "retrieval":
+        # 检索预筛：包装打分函数（batch_fn 在调用时取到包装后的 generate_fn）
+        index = load_index()
+        score_fn = generate_fn
+        top_k = generation_kwargs.pop("top_k", default_top_k)
+        fast_threshold = generation_kwargs.pop("fast_threshold", default_fast_threshold)
+
+        def generate_fn(prompt, **scoring_kwargs):
+            neighbours = index.search(fact_from_prompt(prompt), top_k)
+            retrieval_stats["queries"] += 1
+            if not neighbours:
+                return score_fn(prompt, **scoring_kwargs)
+
+            ranked_accusations, accusations, ranked_articles, articles = index.vote(neighbours)
+            if neighbours[0][1] >= fast_threshold:
+                # 快速通道：与训练案例几乎相同，不调用模型
+                retrieval_stats["fast_path"] += 1
+                return format_output(accusations, articles), accusations, articles
+
+            retrieval_stats["candidate_accusations"] += len(ranked_accusations)
+            retrieval_stats["candidate_articles"] += len(ranked_articles)
+            return score_fn(prompt, accusations=[label for label, _ in ranked_accusations],
+                            articles=[label for label, _ in ranked_articles], **scoring_kwargs)
+
+    print(f"\n🔍 当前模型：{'LoRA 微调模型' if model_type == 'lora' else '基础模型'}，batch_size={batch_size}，预测方式：{predictor}")
+    load_fn = load_lora_model if model_type == "lora" else load_base_model
+    load_fn(precision)
 
     skipped_count = 0
+    processed_count = 0
+    reset_generation_stats()
+    reset_retrieval_stats()
+    if (use_cache or use_dedup) and generation_kwargs.get("do_sample", default_generation_config["do_sample"]):
+        print("⚠️ 采样解码的结果不可复用，结果缓存与去重缓存仅在 do_sample=False 时生效，本次不使用缓存")
+        use_cache = False
+        use_dedup = False
+    result_cache = ResultCache(cache_path) if use_cache else None
+    if result_cache is not None:
+        generation_kwargs["result_cache"] = result_cache
+    dedup_cache = DedupCache(dedup_path_pattern.format(model_type=model_type), threshold=dedup_threshold) if use_dedup else None
+    if dedup_cache is not None:
+        generation_kwargs["dedup_cache"] = dedup_cache
+    start_time = time.perf_counter()
+
+    # 断点续跑：截掉上次未记录进度的尾部输出
+    done_lines, output_bytes = load_progress(output_path) if resume else (0, 0)
+    if done_lines:
+        print(f"⏩ 从第 {done_lines + 1} 条样本继续推理")
+        with open(output_path, "r+b") as file:
+            file.truncate(output_bytes)
+
+    # 按 token 预算调度时，以窗口为单位排序装箱；否则攒满一批即推理
+    flush_size = window_size if max_tokens is not None else batch_size
+
+    def run_batch(prompts):
+        """
+        批量推理；整批出错时回退为逐条推理，出错的样本记为 None。
+        """
+        try:
+            return batch_fn(prompts, batch_size=batch_size, max_tokens=max_tokens, **generation_kwargs)
+        except Exception as e:
+            print(f"⚠️ 批量推理出错，回退为逐条推理：{e}")
 
-    with open(input_path, "r", encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
-        for line in tqdm(infile, desc=f"Processing {model_type.upper()} Model"):
+        results = []
+        for prompt in prompts:
             try:
-                # 解析输入 JSON 数据
-                data = json.loads(line.strip())
-                fact = data.get("fact", "")
+                results.append(generate_fn(prompt, **generation_kwargs))
+            except Exception as e:
+                print(f"⚠️ 处理样本时出错：{e}")
+                results.append(None)
+        return results
 
-                # 跳过无效数据
-                if not fact:
-                    skipped_count += 1
-                    continue
-
-                # 构建输入 prompt
-                prompt = (
-                    "请根据以下案情判断罪名与适用法条，并按照以下格式输出：\n"
-                    "罪名：XXX罪\n"
-                    "法条：《中华人民共和国刑法》第XXX条\n"
-                    "请不要重复案情内容，直接开始回答。\n\n"
-                    f"案情描述如下：{fact}"
-                )
-
-                # 调用生成函数
-                _, accusations, articles = generate_fn(prompt)
-
-                # 构建输出数据结构（仅保存 meta）
-                output_data = {
-                    "meta": {
-                        "accusation": accusations,
-                        "relevant_articles": articles
-                    }
+    def flush(pending, writer, input_lines):
+        """
+        推理一批样本，按输入顺序写入并落盘，然后记录进度。
+        pending 中 None 表示无效输入行，对应写入空 meta。
+        """
+        nonlocal skipped_count, processed_count, output_bytes
+        results = iter(run_batch([prompt for prompt in pending if prompt is not None]))
+
+        for prompt in pending:
+            result = next(results) if prompt is not None else None
+            if result is None:
+                skipped_count += 1
+                accusations, articles = [], []
+            else:
+                _, accusations, articles = result
+                processed_count += 1
+
+            # 构建输出数据结构（仅保存 meta）
+            writer.write({
+                "meta": {
+                    "accusation": accusations,
+                    "relevant_articles": articles
                 }
+            })
+
+        # 写入结果
+        before = writer.bytes_written
+        writer.flush(sync=True)
+        output_bytes += writer.bytes_written - before
+        save_progress(output_path, input_lines, output_bytes)
+
+    # 无法解析的输入行产出 None，同样写入空 meta
+    with JsonlWriter(output_path, "a" if done_lines else "w", buffer_lines=max(flush_size, 1000)) as writer:
+        pending = []
+        line_index = 0
+        for absolute_index, data in enumerate(tqdm(iter_jsonl(input_path, errors="none"), desc=f"Processing {model_type.upper()} Model")):
+            if end_line is not None and absolute_index >= end_line:
+                break
 
-                # 写入结果
-                outfile.write(json.dumps(output_data, ensure_ascii=False) + "\n")
+            # line_index 为本次处理范围内已读取的行数
+            line_index = absolute_index - start_line + 1
+            if line_index <= done_lines:
+                continue
+
+            try:
+                fact = data.get("fact", "") if data is not None else ""
+
+                # 无效数据写入空 meta，保持行对齐
+                if not fact:
+                    pending.append(None)
+                else:
+                    # 构建输入 prompt
+                    pending.append(build_prompt(fact))
 
             except Exception as e:
                 print(f"⚠️ 处理样本时出错：{e}")
-                skipped_count += 1
+                pending.append(None)
+
+            # 攒满一批（或一个调度窗口）后推理并按原顺序写入
+            if sum(prompt is not None for prompt in pending) >= flush_size:
+                flush(pending, writer, line_index)
+                pending = []
+
+        if pending:
+            flush(pending, writer, line_index)
+
+    # 全部完成后清除进度文件
+    if os.path.exists(progress_path_for(output_path)):
+        os.remove(progress_path_for(output_path))
+
+    elapsed = time.perf_counter() - start_time
+    throughput = processed_count / elapsed if elapsed > 0 else 0.0
 
     print(f"\n✅ 生成完成，结果已保存至 {output_path}")
     print(f"📦 跳过样本数：{skipped_count}")
+    print(f"⚡ 推理吞吐：{throughput:.2f} 条/秒（共 {processed_count} 条，耗时 {elapsed:.1f} 秒）")
+    report_generation_stats()
+    if predictor == "retrieval":
+        report_retrieval_stats()
+    if result_cache is not None:
+        result_cache.report()
+        result_cache.close()
+    if dedup_cache is not None:
+        dedup_cache.report()
+        dedup_cache.save()
+
+def count_lines(file_path):
+    with open(file_path, "rb") as file:
+        return sum(1 for _ in file)
+
+
+def shard_worker(shard_id, input_path, shard_path, start_line, end_line, model_type, cores, device, kwargs):
+    """
+    单个分片的推理进程：绑定 CPU 核心 / GPU 设备后处理 [start_line, end_line) 范围内的样本。
+    """
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+    if cores:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+
+    print(f"\n🧩 分片 {shard_id}：样本 {start_line}-{end_line}，CPU 核心 {len(cores)} 个，设备 {device}")
+    process_data(input_path, shard_path, model_type=model_type, start_line=start_line, end_line=end_line, **kwargs)
+
+
+def merge_shards(shard_paths, output_path):
+    """
+    按分片顺序拼接分片结果，恢复与输入一致的顺序。
+    """
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as outfile:
+        for shard_path in shard_paths:
+            with open(shard_path, "rb") as infile:
+                shutil.copyfileobj(infile, outfile)
+    os.replace(tmp_path, output_path)
+
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+
+
+def process_data_sharded(input_path, output_path, model_type="lora", num_workers=2, devices=None, **kwargs):
+    """
+    数据并行推理：将测试集按行切成 num_workers 个连续分片，每个分片一个进程、一份模型副本。
+    - 可用 CPU 核心平均分给各进程（绑定亲和性并设置 torch 线程数）
+    - devices: GPU 编号列表，分片轮流使用；为空时不限制设备
+    - 各分片流式写入 <output_path>.shard<k>，全部完成后按顺序合并
+    其余参数（batch_size、resume 等）透传给 process_data；resume=True 时各分片分别续跑。
+    各进程会同时写同一个去重缓存文件，分片模式下不使用去重缓存（use_dedup）。
+    """
+    if kwargs.get("use_dedup"):
+        print("⚠️ 分片推理的各进程会同时写同一个去重缓存文件，分片模式下不使用去重缓存")
+        kwargs["use_dedup"] = False
+
+    total_lines = count_lines(input_path)
+    available_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    print(f"\n🚀 分片推理：{num_workers} 个进程，共 {total_lines} 条样本，可用 CPU 核心 {len(available_cores)} 个")
+
+    start_time = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    shard_paths = []
+    for shard_id in range(num_workers):
+        start_line = total_lines * shard_id // num_workers
+        end_line = total_lines * (shard_id + 1) // num_workers
+        cores = available_cores[len(available_cores) * shard_id // num_workers:
+                                len(available_cores) * (shard_id + 1) // num_workers]
+        device = devices[shard_id % len(devices)] if devices else None
+        shard_path = f"{output_path}.shard{shard_id}"
+        shard_paths.append(shard_path)
+
+        worker = context.Process(
+            target=shard_worker,
+            args=(shard_id, input_path, shard_path, start_line, end_line, model_type, cores, device, kwargs),
+        )
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join()
+
+    failed = [shard_id for shard_id, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        print(f"❌ 分片 {failed} 推理失败，已完成部分保留在分片文件中，可使用 resume=True 续跑")
+        return
+
+    merge_shards(shard_paths, output_path)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n✅ 分片推理完成，结果已合并至 {output_path}")
+    print(f"⚡ 总吞吐：{total_lines / elapsed:.2f} 条/秒（{num_workers} 个进程，耗时 {elapsed:.1f} 秒）")
 
 if __name__ == "__main__":
     # 生成 LoRA 模型结果
-    # process_data(input_path, output_path_lora, model_type="lora")
+    # process_data(input_path, output_path_lora, model_type="lora", batch_size=8)
 
     # 生成基础模型结果
-    process_data(input_path, output_path_base, model_type="base")
+    process_data(input_path, output_path_base, model_type="base", batch_size=8)
+
+    # 按 token 长度分桶调度（减少填充浪费）
+    # process_data(input_path, output_path_base, model_type="base", batch_size=32, max_tokens=8192)
+
+    # 合法标签约束解码（罪名/法条只能取 meta/ 中的合法值）
+    # process_data(input_path, output_path_lora, model_type="lora", batch_size=8, constrain_labels=True)
+
+    # 确定性贪心解码 + 磁盘结果缓存（重复运行只需推理一次）
+    # process_data(input_path, output_path_lora, model_type="lora", batch_size=8, do_sample=False, use_cache=True)
+
+    # 近重复去重缓存（模板化案情只推理一次，相似案情直接复用答案）
+    # process_data(input_path, output_path_lora, model_type="lora", batch_size=8, do_sample=False, use_dedup=True)
+
+    # 断点续跑（跳过已完成的样本并追加写入）
+    # process_data(input_path, output_path_base, model_type="base", batch_size=8, resume=True)
+
+    # 多进程分片推理（num_workers 指定进程数）
+    # process_data_sharded(input_path, output_path_lora, model_type="lora", num_workers=4, batch_size=8)
+
+    # CPU 主机：int8 动态量化推理
+    # process_data(input_path, output_path_lora, model_type="lora", batch_size=8, precision="int8")
+
+    # 似然打分预测（不生成，为全部候选标签打分后按概率阈值选取）
+    # process_data(input_path, output_path_lora, model_type="lora", predictor="score", threshold=0.2)
+
+    # 检索预筛 + 似然打分（相似度高的样本直接采用相似案例的标签，其余只为候选标签打分）
+    # process_data(input_path, output_path_lora, model_type="lora", predictor="retrieval", top_k=10, fast_threshold=0.9)
+
+    # 逐条推理（对比吞吐）
+    # process_data(input_path, output_path_base, model_type="base", batch_size=1)
@@ -0,0 +1,152 @@
+import os
+os.environ["USE_TF"] = "0"
+
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+from datasets import load_dataset
+from transformers import AutoTokenizer
+from result_cache import file_checksum
+
+# 路径配置
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+model_path = os.path.join(BASE_DIR, "models", "DeepSeek-R1-Distill-Qwen-1.5B")
+data_path = os.path.join(BASE_DIR, "data", "train2.0.jsonl")
+cache_root = os.path.join(BASE_DIR, "data", "token_cache")
+
+# 预处理配置
+max_length = 512
+num_proc = min(os.cpu_count() or 1, 8)
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    tokenizer 的标识：词表 / 合并规则 / 前后处理（fast tokenizer 的完整序列化配置）加特殊 token。
+    调用 tokenizer 时会改写后端的截断、填充状态，这两项不计入标识。
+    """
+    if tokenizer.is_fast:
+        config = json.loads(tokenizer.backend_tokenizer.to_str())
+        config["truncation"] = None
+        config["padding"] = None
+    else:
+        config = sorted(tokenizer.get_vocab().items())
+    payload = json.dumps(
+        [type(tokenizer).__name__, config, tokenizer.special_tokens_map, tokenizer.truncation_side],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_key(tokenizer, data_path, max_length):
+    """ 缓存键：(tokenizer 标识, 数据文件 sha256, 截断长度) """
+    payload = json.dumps([tokenizer_fingerprint(tokenizer), file_checksum(data_path), max_length])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_token_cache(tokenizer, data_path, cache_dir, max_length=max_length, num_proc=num_proc):
+    """
+    多进程分词（不填充，只截断到 max_length），写入缓存目录：
+    - tokens.bin: 全部样本的 input_ids 首尾相接的扁平 uint32 数组
+    - offsets.npy: (样本数 + 1,) int64，第 i 条样本为 tokens[offsets[i]:offsets[i + 1]]
+    - meta.json: 样本数、token 总数等信息
+    先写入临时目录再整体改名，中途中断不会留下不完整的缓存。
+    """
+    def tokenize_fn(batch):
+        texts = [prompt + "\n" + response for prompt, response in zip(batch["prompt"], batch["response"])]
+        input_ids = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+        return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+    dataset = load_dataset("json", data_files=data_path, split="train")
+    dataset = dataset.map(tokenize_fn, batched=True, num_proc=num_proc, remove_columns=dataset.column_names)
+
+    lengths = np.asarray(dataset["length"], dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    tokens = np.memmap(os.path.join(tmp_dir, "tokens.bin"), dtype=np.uint32, mode="w+", shape=(max(int(offsets[-1]), 1),))
+    start = 0
+    for batch in dataset.iter(batch_size=10000):
+        ids = np.fromiter((i for row in batch["input_ids"] for i in row), dtype=np.uint32)
+        tokens[start:start + len(ids)] = ids
+        start += len(ids)
+    tokens.flush()
+    del tokens
+
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({
+            "data_path": os.path.abspath(data_path),
+            "tokenizer": tokenizer.name_or_path,
+            "max_length": max_length,
+            "num_samples": len(lengths),
+            "num_tokens": int(offsets[-1]),
+        }, file, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+
+
+class TokenCacheDataset(torch.utils.data.Dataset):
+    """
+    基于内存映射的预分词数据集：打开时只读取 offsets 索引，token 按需从 tokens.bin 换入。
+    pad_to 不为 None 时按 tokenizer 的 padding_side 填充到固定长度（与原 padding="max_length" 一致），
+    否则返回原始长度，由 data collator 动态填充。
+    """
+
+    def __init__(self, cache_dir, tokenizer, pad_to=None):
+        self.offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+        self.tokens = np.memmap(os.path.join(cache_dir, "tokens.bin"), dtype=np.uint32, mode="r")
+        self.lengths = np.diff(self.offsets)
+        self.pad_to = pad_to
+        self.pad_token_id = tokenizer.pad_token_id
+        self.padding_side = tokenizer.padding_side
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        input_ids = self.tokens[self.offsets[index]:self.offsets[index + 1]].tolist()
+        attention_mask = [1] * len(input_ids)
+
+        if self.pad_to is not None and len(input_ids) < self.pad_to:
+            pad = self.pad_to - len(input_ids)
+            if self.padding_side == "left":
+                input_ids = [self.pad_token_id] * pad + input_ids
+                attention_mask = [0] * pad + attention_mask
+            else:
+                input_ids = input_ids + [self.pad_token_id] * pad
+                attention_mask = attention_mask + [0] * pad
+
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def load_token_cache(tokenizer, data_path=data_path, max_length=max_length, pad_to=None, num_proc=num_proc):
+    """
+    按 (tokenizer, 数据文件, max_length) 查找预分词缓存，不存在时先构建，返回 TokenCacheDataset。
+    """
+    key = cache_key(tokenizer, data_path, max_length)
+    cache_dir = os.path.join(cache_root, f"{os.path.splitext(os.path.basename(data_path))[0]}-{key[:16]}")
+
+    if os.path.exists(os.path.join(cache_dir, "meta.json")):
+        print(f"✅ 命中预分词缓存：{cache_dir}")
+    else:
+        print(f"🔄 正在预分词（{num_proc} 个进程）：{data_path}")
+        os.makedirs(cache_root, exist_ok=True)
+        build_token_cache(tokenizer, data_path, cache_dir, max_length=max_length, num_proc=num_proc)
+        print(f"✅ 预分词缓存已保存至：{cache_dir}")
+
+    return TokenCacheDataset(cache_dir, tokenizer, pad_to=pad_to)
+
+
+if __name__ == "__main__":
+    # 单独运行时只构建缓存，之后 train.py 直接加载
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    dataset = load_token_cache(tokenizer)
+    print(f"📊 样本数：{len(dataset)}，token 总数：{int(dataset.lengths.sum())}，平均长度：{dataset.lengths.mean():.1f}")
@@ -2,9 +2,10 @@ import os
 os.environ["USE_TF"] = "0"
 
 import torch
-from datasets import load_dataset
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForLanguageModeling
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, DataCollatorForLanguageModeling
 from peft import get_peft_model, LoraConfig, TaskType
+from token_cache import load_token_cache
+from train_utils import LengthGroupedTrainer, PackedDataset, PackedCollator, CountingCollator, ThroughputCallback
 
 # 路径配置
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -13,6 +14,19 @@ model_path = os.path.join(BASE_DIR, "models", "DeepSeek-R1-Distill-Qwen-1.5B")
 data_path = os.path.join(BASE_DIR, "data", "train2.0.jsonl")
 output_dir = os.path.join(BASE_DIR, "models", "lora_adapter2.0")
 
+# 填充方式：
+# - "max_length": 每条样本填充到 max_length（原方式），batch 1 × 梯度累积 8
+# - "dynamic": 按长度分组，批内动态填充到最长样本，batch 8 × 梯度累积 1（每步样本数不变）
+# - "packing": 多条样本拼接为不超过 pack_length 的序列，块对角掩码隔离样本（需 sdpa / eager 注意力）
+padding_mode = "max_length"
+max_length = 512
+pack_length = 1024
+batch_config = {
+    "max_length": (1, 8),
+    "dynamic": (8, 1),
+    "packing": (1, 8),
+}
+
 
 # 加载 tokenizer 和 model（基础模型）
 tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
@@ -32,21 +46,35 @@ model = get_peft_model(model, lora_config)
 model.print_trainable_parameters()
 
 
-# 数据集预处理
-def tokenize_fn(example):
-    prompt = example["prompt"]
-    response = example["response"]
-    text = prompt + "\n" + response
-    return tokenizer(text, truncation=True, max_length=512, padding="max_length")
-
-dataset = load_dataset("json", data_files=data_path, split="train")
-dataset = dataset.map(tokenize_fn, remove_columns=["prompt", "response"])
+# 数据集预处理：首次运行时多进程分词并写入内存映射缓存（data/token_cache/），
+# 之后按 tokenizer 与数据文件哈希直接加载，不再重复分词
+samples = load_token_cache(tokenizer, data_path, max_length=max_length, pad_to=max_length if padding_mode == "max_length" else None)
+
+if padding_mode == "max_length":
+    dataset = samples
+    collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+elif padding_mode == "dynamic":
+    dataset = samples
+    collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False, pad_to_multiple_of=8)
+elif padding_mode == "packing":
+    dataset = PackedDataset(samples, pack_length=pack_length)
+    collator = PackedCollator(tokenizer.pad_token_id)
+else:
+    raise ValueError(f"未知填充方式：{padding_mode}")
+
+# 统计实际 token 与填充后 token，训练结束时打印吞吐
+collator = CountingCollator(collator)
+num_tokens = int(samples.lengths.sum())
+print(f"📊 {len(samples)} 条样本 → {len(dataset)} 条训练序列（{padding_mode}），实际 token {num_tokens}，"
+      f"固定填充到 {max_length} 时非填充占比 {num_tokens / (len(samples) * max_length):.2%}")
 
 # 设置训练参数
 training_args = TrainingArguments(
     output_dir=output_dir,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=8,
+    per_device_train_batch_size=batch_config[padding_mode][0],
+    gradient_accumulation_steps=batch_config[padding_mode][1],
+    group_by_length=padding_mode == "dynamic",
+    remove_unused_columns=False,  # 打包模式的 seq_lengths 需要传给 collator
     num_train_epochs=1,
     learning_rate=2e-4,
     fp16=True,
@@ -56,16 +84,14 @@ training_args = TrainingArguments(
     report_to="none",
 )
 
-# 数据动态填充器
-collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
-
 # Trainer 初始化
-trainer = Trainer(
+trainer = LengthGroupedTrainer(
     model=model,
     args=training_args,
     train_dataset=dataset,
     tokenizer=tokenizer,
-    data_collator=collator
+    data_collator=collator,
+    callbacks=[ThroughputCallback(collator)]
 )
 
 # 开始训练
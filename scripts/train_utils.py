@@ -0,0 +1,146 @@
+import time
+import numpy as np
+import torch
+from transformers import Trainer, TrainerCallback
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+
+class LengthGroupedTrainer(Trainer):
+    """
+    group_by_length 时直接使用数据集的 lengths 数组分组，
+    避免 LengthGroupedSampler 逐条读取整个数据集来统计长度。
+    """
+
+    def _get_train_sampler(self):
+        if self.args.group_by_length and hasattr(self.train_dataset, "lengths"):
+            return LengthGroupedSampler(
+                self.args.train_batch_size * self.args.gradient_accumulation_steps,
+                lengths=self.train_dataset.lengths.tolist(),
+            )
+        return super()._get_train_sampler()
+
+
+def pack_lengths(lengths, pack_length):
+    """
+    按原顺序贪心装箱：依次把样本放入当前序列，放不下时另起一条。
+    样本不拆分（长度已截断到 max_length <= pack_length），返回每条打包序列包含的样本下标列表。
+    """
+    packs = []
+    current, used = [], 0
+    for index, length in enumerate(lengths):
+        if current and used + length > pack_length:
+            packs.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += int(length)
+    if current:
+        packs.append(current)
+    return packs
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    将 TokenCacheDataset（不填充）中的多条样本拼接为一条不超过 pack_length 的序列。
+    每条样本的 position_ids 从 0 重新开始，seq_lengths 记录各段长度，供 PackedCollator 构造块对角注意力掩码。
+    """
+
+    def __init__(self, dataset, pack_length=1024):
+        self.dataset = dataset
+        self.pack_length = pack_length
+        self.packs = pack_lengths(dataset.lengths, pack_length)
+        self.lengths = np.array([dataset.lengths[pack].sum() for pack in self.packs], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __getitem__(self, index):
+        input_ids, position_ids, seq_lengths = [], [], []
+        for sample_index in self.packs[index]:
+            ids = self.dataset[sample_index]["input_ids"]
+            input_ids.extend(ids)
+            position_ids.extend(range(len(ids)))
+            seq_lengths.append(len(ids))
+        return {
+            "input_ids": input_ids,
+            "attention_mask": [1] * len(input_ids),
+            "position_ids": position_ids,
+            "seq_lengths": seq_lengths,
+        }
+
+
+class PackedCollator:
+    """
+    打包序列的 data collator：右侧填充到批内最长，构造 4D 块对角因果掩码（加性形式，0 可见、dtype 最小值不可见），
+    每条样本只能看到自身之前的 token；每段首个 token 与填充位置的 label 记为 -100，不跨样本计算 loss。
+    """
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        max_len = max(len(feature["input_ids"]) for feature in features)
+        max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, max_len), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, max_len), dtype=torch.long)
+        labels = torch.full((batch_size, max_len), -100, dtype=torch.long)
+        # 段编号：同一样本的 token 互相可见，填充位置各自单独成段
+        segments = torch.arange(max_len).repeat(batch_size, 1) + max_len
+
+        for i, feature in enumerate(features):
+            length = len(feature["input_ids"])
+            input_ids[i, :length] = torch.tensor(feature["input_ids"])
+            position_ids[i, :length] = torch.tensor(feature["position_ids"])
+            labels[i, :length] = input_ids[i, :length]
+
+            start = 0
+            for segment, seq_length in enumerate(feature["seq_lengths"]):
+                segments[i, start:start + seq_length] = segment
+                labels[i, start] = -100
+                start += seq_length
+
+        causal = torch.ones((max_len, max_len), dtype=torch.bool).tril()
+        visible = (segments[:, :, None] == segments[:, None, :]) & causal
+        attention_mask = torch.zeros((batch_size, 1, max_len, max_len))
+        attention_mask.masked_fill_(~visible[:, None], torch.finfo(attention_mask.dtype).min)
+
+        return {"input_ids": input_ids, "position_ids": position_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+class CountingCollator:
+    """
+    包装 data collator，统计实际 token 数（attention_mask 为 1 的位置）与填充后的总 token 数。
+    """
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features):
+        self.real_tokens += sum(sum(feature["attention_mask"]) for feature in features)
+        batch = self.collator(features)
+        self.total_tokens += batch["input_ids"].numel()
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    训练结束时打印吞吐：实际 token/秒、含填充 token/秒与非填充 token 占比。
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.start = None
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start = time.perf_counter()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        elapsed = time.perf_counter() - self.start
+        real, total = self.counter.real_tokens, self.counter.total_tokens
+        print(f"\n📊 训练吞吐：实际 {real / elapsed:.1f} token/秒，含填充 {total / elapsed:.1f} token/秒，"
+              f"非填充 token 占比 {real / max(total, 1):.2%}（实际 {real} / 总计 {total}，耗时 {elapsed:.1f} 秒）")
+